@@ -1,22 +1,40 @@
 """
 Модуль с маршрутами API.
 """
+import asyncio
 import logging
+from functools import lru_cache
 from typing import Dict, Optional
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import Response
 from pydantic import BaseModel
 
 from backend.llm.openrouter import OpenRouterClient
 from backend.config import Config
+from backend.vision.image_generator import ImageGenerator, get_image_generator
 
 logger = logging.getLogger("bot.api")
 
 # Создаем роутер
 router = APIRouter()
 
-# Инициализируем компоненты
-config = Config()
-llm_client = OpenRouterClient(config)
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """Конфигурация API (создаётся при первом запросе)"""
+    return Config()
+
+
+@lru_cache(maxsize=None)
+def get_llm_client() -> OpenRouterClient:
+    """LLM клиент для API (создаётся при первом запросе и переиспользуется)"""
+    return OpenRouterClient(get_config())
+
+
+# Ограничение одновременных запросов к внешним API (LLM и генерация изображений),
+# чтобы всплеск запросов не упирался в rate limit провайдеров
+UPSTREAM_CONCURRENCY = 8
+_upstream_semaphore = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
 
 # Модели данных
 class MessageRequest(BaseModel):
@@ -36,14 +54,18 @@ class ImageGenerateRequest(BaseModel):
 
 
 @router.post("/message", response_model=MessageResponse)
-async def send_message(request: MessageRequest):
+async def send_message(
+    request: MessageRequest,
+    llm_client: OpenRouterClient = Depends(get_llm_client)
+):
     """Обработка текстового сообщения"""
     try:
-        response = await llm_client.chat_completion(
-            user_message=request.message,
-            system_prompt="",
-            temperature=0.7
-        )
+        async with _upstream_semaphore:
+            response = await llm_client.chat_completion(
+                user_message=request.message,
+                system_prompt="",
+                temperature=0.7
+            )
         
         return MessageResponse(message=response)
         
@@ -53,23 +75,23 @@ async def send_message(request: MessageRequest):
 
 
 @router.post("/image/generate")
-async def generate_image(request: ImageGenerateRequest):
+async def generate_image(
+    request: ImageGenerateRequest,
+    generator: ImageGenerator = Depends(get_image_generator)
+):
     """Генерация изображения"""
     try:
-        from backend.vision.image_generator import get_image_generator
-        generator = get_image_generator()
-        
-        image_data = await generator.generate_image(
-            prompt=request.prompt,
-            width=request.width,
-            height=request.height
-        )
+        async with _upstream_semaphore:
+            image_data = await generator.generate_image(
+                prompt=request.prompt,
+                width=request.width,
+                height=request.height
+            )
         
         if not image_data:
             raise HTTPException(status_code=500, detail="Не удалось сгенерировать изображение")
         
         # Возвращаем изображение как bytes
-        from fastapi.responses import Response
         return Response(content=image_data, media_type="image/png")
         
     except Exception as e:
@@ -1,9 +1,14 @@
 """
 Модуль для базовой интеграции с Telegram.
 """
+import asyncio
+import functools
 import logging
 import aiohttp
-from typing import Dict, Any, Optional, List
+import aiofiles
+import orjson
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Sequence, Tuple, Union
 from pathlib import Path
 
 from backend.config import TELEGRAM_CONFIG, TELEGRAM_BOT_TOKENS
@@ -12,30 +17,159 @@ logger = logging.getLogger("bot.telegram")
 
 TELEGRAM_API_URL = "https://api.telegram.org/bot"
 
-# Глобальное хранилище для связи chat_id -> token
-_chat_to_token = {}
+# Скачивание файлов: крупные куски и буфер записи - меньше итераций цикла и write()
+DOWNLOAD_CHUNK_SIZE = 1 << 18  # 256 KiB
+DOWNLOAD_WRITE_BUFFER = 1 << 20  # 1 MiB
+
+# Передача файлов (скачивание до 20 МБ, multipart sendPhoto/sendAudio) не укладывается в общий
+# total=30 сессии на медленных каналах: ограничиваем только подключение и паузы между чтениями
+FILE_TRANSFER_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+
+# Заголовки для тела, заранее сериализованного через orjson
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Глобальное хранилище для связи chat_id -> token (LRU, чтобы не расти бесконечно)
+_MAX_CHAT_TOKENS = 10000
+_chat_to_token: "OrderedDict[str, str]" = OrderedDict()
+
+# Заранее сериализованные статические клавиатуры: id(keyboard) -> (keyboard, json bytes)
+_keyboard_serialized: Dict[int, Tuple[Dict, bytes]] = {}
+
+# Кэш адресов методов Bot API: (token, method) -> url
+_url_cache: Dict[Tuple[str, str], str] = {}
+
+
+def _url(token: str, method: str) -> str:
+    """Возвращает адрес метода Bot API для токена (строка собирается один раз)"""
+    key = (token, method)
+    url = _url_cache.get(key)
+    if url is None:
+        url = f"{TELEGRAM_API_URL}{token}/{method}"
+        _url_cache[key] = url
+    return url
+
+
+# Общая HTTP-сессия на всё время жизни приложения (keep-alive к api.telegram.org)
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Лениво создает общую HTTP-сессию с пулом соединений."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=30,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            force_close=False,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+    return _session
+
+
+async def close_session():
+    """Закрывает общую HTTP-сессию (вызывается при остановке приложения)."""
+    global _session
+    # Отменяем отправки из очереди: без сессии они всё равно не смогут отправлять
+    for task in list(_pending_sends):
+        task.cancel()
+    _pending_sends.clear()
+    _chat_send_tails.clear()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов по алгоритму token bucket.
+    Telegram допускает ~30 сообщений в секунду на бота, поэтому отправки
+    притормаживаются заранее, а не упираются в ответы 429.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated: Optional[float] = None
+        # До какого момента (loop.time()) отправки приостановлены после 429
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов всем отправителям (Telegram вернул 429 с retry_after)"""
+        until = asyncio.get_running_loop().time() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+
+    async def acquire(self):
+        """Ждёт, пока в ведре появится свободный токен, и забирает его"""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._updated is not None:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Лимит на отправку сообщений/медиа (лимит Telegram ~30 msg/s действует на каждого бота отдельно),
+# поэтому ведро и пауза после 429 заводятся на каждый токен
+SEND_RATE_PER_BOT = 28
+SEND_BURST_PER_BOT = 30
+_send_rate_limiters: Dict[str, TokenBucket] = {}
+
+
+def _get_rate_limiter(token: str) -> TokenBucket:
+    """Возвращает ограничитель отправки для бота с этим токеном"""
+    limiter = _send_rate_limiters.get(token)
+    if limiter is None:
+        limiter = _send_rate_limiters[token] = TokenBucket(rate=SEND_RATE_PER_BOT, capacity=SEND_BURST_PER_BOT)
+    return limiter
+
+
+# Токен по умолчанию (вычисляется один раз при первом обращении)
+_default_token: Optional[str] = None
+
+
+def get_default_token() -> str:
+    """Возвращает токен по умолчанию: первый из списка токенов или одиночный токен из конфига"""
+    global _default_token
+    if _default_token is None:
+        tokens = TELEGRAM_CONFIG.get("tokens") or []
+        _default_token = tokens[0] if tokens else (TELEGRAM_CONFIG.get("token") or "")
+    return _default_token
 
 
 def get_token_for_chat(chat_id: str) -> str:
     """Получает токен для чата (использует первый доступный, если не установлен)"""
-    if chat_id in _chat_to_token:
-        return _chat_to_token[chat_id]
-    
-    # По умолчанию используем первый токен
-    tokens = TELEGRAM_CONFIG.get("tokens", [])
-    if not tokens:
-        token = TELEGRAM_CONFIG.get("token")
-        if token:
-            return token
-    return tokens[0] if tokens else ""
+    token = _chat_to_token.get(chat_id)
+    if token is not None:
+        _chat_to_token.move_to_end(chat_id)
+        return token
+    return get_default_token()
 
 
 def set_token_for_chat(chat_id: str, token: str):
     """Устанавливает токен для конкретного чата"""
     _chat_to_token[chat_id] = token
+    _chat_to_token.move_to_end(chat_id)
+    if len(_chat_to_token) > _MAX_CHAT_TOKENS:
+        _chat_to_token.popitem(last=False)
 
 
-def split_long_message(text: str, max_length: int = 4000) -> List[str]:
+def split_long_message(text: str, max_length: int = 4000) -> Sequence[str]:
     """
     Разбивает длинное сообщение на части для отправки в Telegram.
     Telegram лимит: 4096 символов, используем 4000 для безопасности.
@@ -45,61 +179,204 @@ def split_long_message(text: str, max_length: int = 4000) -> List[str]:
         max_length: Максимальная длина одной части
         
     Returns:
-        Список частей сообщения
+        Последовательность частей сообщения (кортеж из одного элемента, если разбивка не нужна)
     """
     text_len = len(text)
     if text_len <= max_length:
-        logger.debug(f"Сообщение не требует разбивки: {text_len} символов")
-        return [text]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Сообщение не требует разбивки: {text_len} символов")
+        return (text,)
     
-    logger.info(f"Разбиваю длинное сообщение: {text_len} символов на части по {max_length}")
+    info_enabled = logger.isEnabledFor(logging.INFO)
+    if info_enabled:
+        logger.info(f"Разбиваю длинное сообщение: {text_len} символов на части по {max_length}")
     
     parts = []
-    current_part = ""
-    
-    # Разбиваем по абзацам (двойной перенос строки)
-    paragraphs = text.split("\n\n")
+    start = 0
+    
+    # Один проход по тексту: ищем последний перенос абзаца (или строки) в окне max_length,
+    # без промежуточных списков абзацев и строк
+    while start < text_len:
+        end = start + max_length
+        if end >= text_len:
+            parts.append(text[start:])
+            break
+        
+        brk = text.rfind("\n\n", start, end)
+        if brk <= start:
+            brk = text.rfind("\n", start, end)
+            if brk <= start:
+                # Нет подходящего переноса - режем жёстко по лимиту
+                brk = end
+        
+        parts.append(text[start:brk])
+        
+        # Пропускаем переносы на границе частей, чтобы не отправлять пустые куски
+        start = brk
+        while start < text_len and text[start] == "\n":
+            start += 1
     
-    for paragraph in paragraphs:
-        # Если текущая часть + новый абзац помещается
-        if len(current_part) + len(paragraph) + 2 <= max_length:
-            if current_part:
-                current_part += "\n\n" + paragraph
-            else:
-                current_part = paragraph
-        else:
-            # Если текущая часть не пуста, сохраняем её
-            if current_part:
-                parts.append(current_part)
-            
-            # Если сам абзац длиннее лимита, разбиваем по строкам
-            if len(paragraph) > max_length:
-                lines = paragraph.split("\n")
-                current_part = ""
-                for line in lines:
-                    if len(current_part) + len(line) + 1 <= max_length:
-                        if current_part:
-                            current_part += "\n" + line
-                        else:
-                            current_part = line
-                    else:
-                        if current_part:
-                            parts.append(current_part)
-                        # Если строка сама длиннее лимита, обрезаем
-                        while len(line) > max_length:
-                            parts.append(line[:max_length])
-                            line = line[max_length:]
-                        current_part = line
+    result = parts if parts else [text[:max_length]]
+    if info_enabled:
+        logger.info(f"Сообщение разбито на {len(result)} частей: {[len(p) for p in result]} символов каждая")
+    return result
+
+
+def compile_keyboard(buttons: List[List[Dict[str, str]]]) -> Dict:
+    """
+    Преобразует кнопки в inline-клавиатуру Telegram и заранее сериализует её.
+    Предназначено для статических меню, которые собираются один раз при импорте:
+    при отправке такой клавиатуры JSON повторно не кодируется.
+
+    Args:
+        buttons: Список списков кнопок [[{"text": "...", "callback_data": "..."}] или [{"text": "...", "url": "..."}]]
+
+    Returns:
+        Словарь {"inline_keyboard": [...]}
+    """
+    return register_keyboard(_build_inline_keyboard(buttons))
+
+
+def register_keyboard(keyboard: Dict) -> Dict:
+    """
+    Заранее сериализует готовую клавиатуру (reply или inline) для повторной отправки.
+    Объект после регистрации нельзя изменять: в запрос уходят сохранённые байты.
+
+    Args:
+        keyboard: Структура reply_markup для Telegram API
+
+    Returns:
+        Тот же словарь keyboard
+    """
+    # Держим ссылку на сам объект, чтобы id не переиспользовался
+    _keyboard_serialized[id(keyboard)] = (keyboard, orjson.dumps(keyboard))
+    return keyboard
+
+
+def _build_inline_keyboard(buttons: List[List[Dict[str, str]]]) -> Dict:
+    """Преобразует кнопки в формат inline-клавиатуры Telegram"""
+    keyboard = {"inline_keyboard": []}
+    for row in buttons:
+        new_row = []
+        for btn in row:
+            if "url" in btn:
+                # Кнопка со ссылкой
+                new_row.append({"text": btn["text"], "url": btn["url"]})
             else:
-                current_part = paragraph
+                # Callback кнопка
+                new_row.append({"text": btn["text"], "callback_data": btn["callback_data"]})
+        keyboard["inline_keyboard"].append(new_row)
+    return keyboard
+
+
+def _dumps_with_markup(payload: Dict, reply_markup: Optional[Dict]) -> bytes:
+    """Сериализует payload; заранее скомпилированная клавиатура подставляется готовыми байтами"""
+    if reply_markup is None:
+        return orjson.dumps(payload)
     
-    # Добавляем последнюю часть
-    if current_part:
-        parts.append(current_part)
+    cached = _keyboard_serialized.get(id(reply_markup))
+    if cached is None:
+        return orjson.dumps({**payload, "reply_markup": reply_markup})
     
-    result = parts if parts else [text[:max_length]]
-    logger.info(f"Сообщение разбито на {len(result)} частей: {[len(p) for p in result]} символов каждая")
-    return result
+    body = orjson.dumps(payload)
+    return b"".join((body[:-1], b',"reply_markup":', cached[1], b"}"))
+
+
+# Методы, которые расходуют лимит Telegram на отправку сообщений
+_RATE_LIMITED_METHODS = frozenset({"sendMessage", "sendPhoto", "sendAudio"})
+
+# Повторы при 429 / 5xx / сетевых ошибках
+API_MAX_ATTEMPTS = 3
+API_RETRY_BASE_DELAY = 0.5
+# Если Telegram просит ждать дольше - не держим обработчик, а сдаёмся
+API_MAX_RETRY_AFTER = 60
+
+
+async def _api_call(
+    method: str,
+    payload: Dict,
+    token: Optional[str] = None,
+    chat_id: Optional[str] = None,
+    reply_markup: Optional[Dict] = None,
+    need_body: bool = False
+) -> Tuple[bool, Optional[Dict]]:
+    """
+    Выполняет JSON-вызов метода Bot API через общую сессию.
+
+    Args:
+        method: Имя метода (sendMessage, deleteMessage, ...)
+        payload: Параметры вызова
+        token: Токен бота (если не указан, определяется по chat_id или берётся токен по умолчанию)
+        chat_id: ID чата для выбора токена
+        reply_markup: Клавиатура (скомпилированная через compile_keyboard подставляется без кодирования)
+        need_body: Разбирать ли JSON успешного ответа (тело всё равно дочитывается для keep-alive)
+
+    Returns:
+        Кортеж (успех, тело ответа Telegram или None)
+
+    При 429 ждёт retry_after из ответа, при 5xx и сетевых ошибках - экспоненциальную паузу;
+    всего не более API_MAX_ATTEMPTS попыток.
+    """
+    if not token:
+        token = get_token_for_chat(chat_id) if chat_id is not None else get_default_token()
+
+    if not token:
+        logger.error("TELEGRAM_BOT_TOKEN не настроен")
+        return False, None
+
+    url = _url(token, method)
+    body = _dumps_with_markup(payload, reply_markup)
+    rate_limited = method in _RATE_LIMITED_METHODS
+
+    rate_limiter = _get_rate_limiter(token) if rate_limited else None
+
+    for attempt in range(API_MAX_ATTEMPTS):
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+
+        try:
+            session = await get_session()
+            async with session.post(url, data=body, headers=JSON_HEADERS) as response:
+                status = response.status
+                if status == 200:
+                    # Тело дочитываем всегда (оно крошечное): release() до EOF закрыл бы
+                    # соединение вместо возврата в keep-alive пул; разбираем только по запросу
+                    raw = await response.read()
+                    return True, (orjson.loads(raw) if need_body else None)
+
+                if status == 429:
+                    try:
+                        error_data = orjson.loads(await response.read())
+                        delay = error_data.get("parameters", {}).get("retry_after", 1)
+                    except orjson.JSONDecodeError:
+                        delay = 1
+                    if delay > API_MAX_RETRY_AFTER:
+                        logger.error(f"❌ {method}: Telegram просит подождать {delay} с, отказываюсь от отправки")
+                        return False, None
+                    logger.warning(f"⚠️ {method}: 429 Too Many Requests, повтор через {delay} с")
+                    if rate_limiter is not None:
+                        # Лимит общий на бота: придерживаем все отправки этого бота, а не только эту
+                        rate_limiter.pause(delay)
+                elif status >= 500:
+                    delay = API_RETRY_BASE_DELAY * 2 ** attempt
+                    logger.warning(f"⚠️ {method}: ошибка сервера {status}, повтор через {delay} с")
+                else:
+                    error_text = await response.text()
+                    logger.warning(f"⚠️ Ошибка вызова {method}: {status} - {error_text}")
+                    return False, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            delay = API_RETRY_BASE_DELAY * 2 ** attempt
+            logger.warning(f"⚠️ {method}: сетевая ошибка {e!r}, повтор через {delay} с")
+        except Exception as e:
+            logger.error(f"❌ Исключение при вызове {method}: {e}")
+            return False, None
+
+        # Пауза вне async with, чтобы соединение успело вернуться в пул
+        if attempt < API_MAX_ATTEMPTS - 1:
+            await asyncio.sleep(delay)
+
+    logger.error(f"❌ {method}: не удалось выполнить запрос за {API_MAX_ATTEMPTS} попытки")
+    return False, None
 
 
 async def send_telegram_message(
@@ -113,6 +390,8 @@ async def send_telegram_message(
     """
     Отправляет текстовое сообщение в Telegram.
     Автоматически разбивает длинные сообщения на части.
+    Если для чата есть сообщения в очереди отправки, сначала дожидается их,
+    чтобы ответы приходили в том порядке, в котором их отправил обработчик.
 
     Args:
         chat_id: ID чата
@@ -125,6 +404,21 @@ async def send_telegram_message(
     Returns:
         True если успешно, False иначе
     """
+    tail = _chat_send_tails.get(str(chat_id))
+    if tail is not None:
+        await asyncio.wait((tail,))
+    return await _send_message_parts(chat_id, text, parse_mode, reply_to_message_id, token, reply_markup)
+
+
+async def _send_message_parts(
+    chat_id: str,
+    text: str,
+    parse_mode: Optional[str] = None,
+    reply_to_message_id: Optional[int] = None,
+    token: Optional[str] = None,
+    reply_markup: Optional[Dict] = None
+) -> bool:
+    """Отправляет сообщение (частями, если оно длинное) без учёта очереди отправки"""
     if not token:
         token = get_token_for_chat(chat_id)
     
@@ -137,11 +431,13 @@ async def send_telegram_message(
     
     logger.info(f"Отправляю сообщение в чат {chat_id}: {len(message_parts)} частей, общая длина {len(text)} символов")
     
-    url = f"{TELEGRAM_API_URL}{token}/sendMessage"
+    parts_count = len(message_parts)
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
     
     success = True
     for i, part in enumerate(message_parts):
-        logger.debug(f"Отправка части {i+1}/{len(message_parts)}: {len(part)} символов")
+        if debug_enabled:
+            logger.debug(f"Отправка части {i+1}/{parts_count}: {len(part)} символов")
         
         payload = {
             "chat_id": chat_id,
@@ -154,40 +450,88 @@ async def send_telegram_message(
         # Ответ только на первое сообщение
         if i == 0 and reply_to_message_id:
             payload["reply_to_message_id"] = reply_to_message_id
-            logger.debug(f"Ответ на сообщение {reply_to_message_id}")
+            if debug_enabled:
+                logger.debug(f"Ответ на сообщение {reply_to_message_id}")
         
         # Добавляем клавиатуру если есть
+        part_markup = None
         if reply_markup and i == 0:
-            payload["reply_markup"] = reply_markup
-            logger.debug(f"Добавлена клавиатура: {reply_markup.get('keyboard', [[]])}")
+            part_markup = reply_markup
+            if debug_enabled:
+                logger.debug(f"Добавлена клавиатура: {reply_markup.get('keyboard', [[]])}")
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        response_data = await response.json()
-                        logger.info(f"✅ Часть {i+1}/{len(message_parts)} успешно отправлена в чат {chat_id}")
-                        # Небольшая задержка между частями
-                        if i < len(message_parts) - 1:
-                            import asyncio
-                            await asyncio.sleep(0.3)
-                            logger.debug(f"Задержка перед отправкой части {i+2}")
-                    else:
-                        error = await response.text()
-                        logger.error(f"❌ Ошибка отправки сообщения (часть {i+1}/{len(message_parts)}): {error}")
-                        success = False
-        except Exception as e:
-            logger.error(f"❌ Исключение при отправке сообщения (часть {i+1}/{len(message_parts)}): {e}")
+        ok, _ = await _api_call("sendMessage", payload, token, reply_markup=part_markup)
+        if ok:
+            logger.info(f"✅ Часть {i+1}/{parts_count} успешно отправлена в чат {chat_id}")
+        else:
+            logger.error(f"❌ Ошибка отправки сообщения (часть {i+1}/{parts_count}) в чат {chat_id}")
             success = False
     
     if success:
         logger.info(f"✅ Все {len(message_parts)} частей сообщения успешно отправлены в чат {chat_id}")
     else:
         logger.warning(f"⚠️ Не все части сообщения отправлены в чат {chat_id}")
-    
+
     return success
 
 
+# Очередь исходящих сообщений, для которых не нужно подтверждение доставки.
+# Отправки одного чата выстраиваются в цепочку (каждая ждёт предыдущую), разные чаты
+# идут параллельно; темп задаёт ограничитель бота (_get_rate_limiter).
+SEND_QUEUE_MAXSIZE = 10000
+
+# chat_id -> последняя поставленная в очередь отправка этого чата
+_chat_send_tails: Dict[str, asyncio.Task] = {}
+_pending_sends: set = set()
+
+
+async def _send_after(previous: Optional[asyncio.Task], chat_id: str, text: str, kwargs: Dict):
+    """Дожидается предыдущей отправки в тот же чат и отправляет сообщение"""
+    if previous is not None:
+        await asyncio.wait((previous,))
+    try:
+        await _send_message_parts(chat_id, text, **kwargs)
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки сообщения из очереди: {e}")
+
+
+def _on_send_done(key: str, task: asyncio.Task):
+    """Убирает завершённую отправку из очереди"""
+    _pending_sends.discard(task)
+    if _chat_send_tails.get(key) is task:
+        del _chat_send_tails[key]
+
+
+def enqueue_telegram_message(chat_id: str, text: str, **kwargs) -> bool:
+    """
+    Ставит сообщение в очередь отправки и сразу возвращает управление.
+    Подходит для ответов, после которых обработчик завершается (меню, статистика, справка).
+    Сообщения одного чата уходят в порядке постановки, а send_telegram_message
+    в этот чат не обгоняет их.
+
+    Args:
+        chat_id: ID чата
+        text: Текст сообщения
+        **kwargs: Аргументы send_telegram_message (parse_mode, reply_markup, token, ...)
+
+    Returns:
+        True если сообщение поставлено в очередь, False если очередь переполнена
+        (тогда сообщение нужно отправить самостоятельно)
+    """
+    if len(_pending_sends) >= SEND_QUEUE_MAXSIZE:
+        logger.warning(f"⚠️ Очередь отправки переполнена, сообщение в чат {chat_id} не поставлено")
+        return False
+
+    key = str(chat_id)
+    task = asyncio.ensure_future(_send_after(_chat_send_tails.get(key), chat_id, text, kwargs))
+    _pending_sends.add(task)
+    task.add_done_callback(functools.partial(_on_send_done, key))
+    # При eager-запуске задача может завершиться сразу - тогда она уже не хвост очереди
+    if not task.done():
+        _chat_send_tails[key] = task
+    return True
+
+
 async def send_telegram_message_get_id(
     chat_id: str,
     text: str,
@@ -209,7 +553,6 @@ async def send_telegram_message_get_id(
 
     message_parts = split_long_message(text)
     first_message_id = None
-    url = f"{TELEGRAM_API_URL}{token}/sendMessage"
 
     for i, part in enumerate(message_parts):
         payload = {
@@ -221,24 +564,17 @@ async def send_telegram_message_get_id(
             payload["parse_mode"] = parse_mode
         if i == 0 and reply_to_message_id:
             payload["reply_to_message_id"] = reply_to_message_id
-        if reply_markup and i == 0:
-            payload["reply_markup"] = reply_markup
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        response_data = await response.json()
-                        message_id = response_data.get("result", {}).get("message_id")
-                        if i == 0:
-                            first_message_id = message_id
-                    else:
-                        error = await response.text()
-                        logger.error(f"❌ Ошибка отправки сообщения c id (часть {i+1}/{len(message_parts)}): {error}")
-                        return None
-        except Exception as e:
-            logger.error(f"❌ Исключение при отправке сообщения c id (часть {i+1}/{len(message_parts)}): {e}")
+        ok, response_data = await _api_call(
+            "sendMessage", payload, token,
+            reply_markup=reply_markup if i == 0 else None,
+            need_body=i == 0
+        )
+        if not ok:
+            logger.error(f"❌ Ошибка отправки сообщения c id (часть {i+1}/{len(message_parts)})")
             return None
+        if i == 0:
+            first_message_id = response_data.get("result", {}).get("message_id")
 
     return first_message_id
 
@@ -248,7 +584,7 @@ async def send_telegram_message_get_id(
 async def send_telegram_message_with_buttons(
     chat_id: str,
     text: str,
-    buttons: List[List[Dict[str, str]]],
+    buttons: Union[List[List[Dict[str, str]]], Dict],
     token: Optional[str] = None
 ) -> Optional[int]:
     """
@@ -261,56 +597,30 @@ async def send_telegram_message_with_buttons(
         chat_id: ID чата
         text: Текст сообщения
         buttons: Список списков кнопок [[{"text": "...", "callback_data": "..."}] или [{"text": "...", "url": "..."}]]
+                 либо клавиатура, заранее собранная через compile_keyboard()
         token: Токен бота (если не указан, используется токен для чата)
 
     Returns:
         message_id отправленного сообщения или None при ошибке
     """
-    if not token:
-        token = get_token_for_chat(chat_id)
-
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return None
-
-    # Преобразуем кнопки в формат Telegram
-    keyboard = {"inline_keyboard": []}
-    for row in buttons:
-        new_row = []
-        for btn in row:
-            if "url" in btn:
-                # Кнопка со ссылкой
-                new_row.append({"text": btn["text"], "url": btn["url"]})
-            else:
-                # Callback кнопка
-                new_row.append({"text": btn["text"], "callback_data": btn["callback_data"]})
-        keyboard["inline_keyboard"].append(new_row)
-
-    url = f"{TELEGRAM_API_URL}{token}/sendMessage"
+    # Преобразуем кнопки в формат Telegram (скомпилированную клавиатуру используем как есть)
+    keyboard = buttons if isinstance(buttons, dict) else _build_inline_keyboard(buttons)
 
     data = {
         "chat_id": chat_id,
         "text": text,
-        "reply_markup": keyboard,
         "parse_mode": "Markdown"
     }
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                if response.status == 200:
-                    resp_json = await response.json()
-                    message_id = resp_json.get("result", {}).get("message_id")
-                    logger.info(f"✅ Сообщение с кнопками отправлено в чат {chat_id}, message_id: {message_id}")
-                    return message_id
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Ошибка отправки сообщения с кнопками: {error_text}")
-                    return None
-    except Exception as e:
-        logger.error(f"Ошибка при отправке сообщения с кнопками: {e}")
+    ok, resp_json = await _api_call("sendMessage", data, token, chat_id, reply_markup=keyboard, need_body=True)
+    if not ok:
+        logger.error(f"Ошибка отправки сообщения с кнопками в чат {chat_id}")
         return None
 
+    message_id = resp_json.get("result", {}).get("message_id")
+    logger.info(f"✅ Сообщение с кнопками отправлено в чат {chat_id}, message_id: {message_id}")
+    return message_id
+
 
 async def delete_telegram_message(
     chat_id: str,
@@ -328,33 +638,15 @@ async def delete_telegram_message(
     Returns:
         True при успехе, False при ошибке
     """
-    if not token:
-        token = get_token_for_chat(chat_id)
-    
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return False
-    
-    url = f"{TELEGRAM_API_URL}{token}/deleteMessage"
-    
     data = {
         "chat_id": chat_id,
         "message_id": message_id
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                if response.status == 200:
-                    logger.info(f"✅ Сообщение {message_id} удалено из чата {chat_id}")
-                    return True
-                else:
-                    error_text = await response.text()
-                    logger.warning(f"⚠️ Не удалось удалить сообщение {message_id} в чате {chat_id}: {error_text}")
-                    return False
-    except Exception as e:
-        logger.error(f"❌ Исключение при удалении сообщения {message_id} в чате {chat_id}: {e}")
-        return False
+    ok, _ = await _api_call("deleteMessage", data, token, chat_id)
+    if ok:
+        logger.info(f"✅ Сообщение {message_id} удалено из чата {chat_id}")
+    return ok
 
 
 async def answer_callback_query(
@@ -373,19 +665,6 @@ async def answer_callback_query(
     Returns:
         True при успехе, False при ошибке
     """
-    if not token:
-        tokens = TELEGRAM_CONFIG.get("tokens", [])
-        if not tokens:
-            token = TELEGRAM_CONFIG.get("token")
-        else:
-            token = tokens[0]
-    
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return False
-    
-    url = f"{TELEGRAM_API_URL}{token}/answerCallbackQuery"
-    
     data = {
         "callback_query_id": callback_query_id
     }
@@ -393,19 +672,10 @@ async def answer_callback_query(
     if text:
         data["text"] = text
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                if response.status == 200:
-                    logger.debug(f"✅ Callback query {callback_query_id} обработан")
-                    return True
-                else:
-                    error_text = await response.text()
-                    logger.error(f"❌ Ошибка ответа на callback query: {response.status} - {error_text}")
-                    return False
-    except Exception as e:
-        logger.error(f"❌ Исключение при ответе на callback query: {e}")
-        return False
+    ok, _ = await _api_call("answerCallbackQuery", data, token)
+    if ok:
+        logger.debug(f"✅ Callback query {callback_query_id} обработан")
+    return ok
 
 
 async def edit_message_text(
@@ -430,15 +700,6 @@ async def edit_message_text(
     Returns:
         True если успешно, False иначе
     """
-    if not token:
-        token = get_token_for_chat(chat_id)
-
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return False
-
-    url = f"{TELEGRAM_API_URL}{token}/editMessageText"
-
     payload = {
         "chat_id": chat_id,
         "message_id": message_id,
@@ -452,24 +713,15 @@ async def edit_message_text(
     if buttons:
         payload["reply_markup"] = {"inline_keyboard": buttons}
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                if response.status == 200:
-                    logger.info(f"✅ Сообщение {message_id} отредактировано в чате {chat_id}")
-                    return True
-                else:
-                    error = await response.text()
-                    logger.error(f"Ошибка редактирования сообщения: {error}")
-                    return False
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения: {e}")
-        return False
+    ok, _ = await _api_call("editMessageText", payload, token, chat_id)
+    if ok:
+        logger.info(f"✅ Сообщение {message_id} отредактировано в чате {chat_id}")
+    return ok
 
 
 async def send_telegram_photo(
     chat_id: str,
-    photo_path: str,
+    photo_path: Union[str, Path, bytes],
     caption: Optional[str] = None,
     token: Optional[str] = None
 ) -> bool:
@@ -478,41 +730,110 @@ async def send_telegram_photo(
     
     Args:
         chat_id: ID чата
-        photo_path: Путь к файлу фото
+        photo_path: Путь к файлу фото или содержимое изображения (bytes)
         caption: Подпись к фото
         token: Токен бота (если не указан, используется токен для чата)
         
     Returns:
         True если успешно, False иначе
     """
+    ok, _ = await _send_photo(chat_id, photo_path, caption, token)
+    return ok
+
+
+async def send_telegram_photo_get_file_id(
+    chat_id: str,
+    photo_path: Union[str, Path, bytes],
+    caption: Optional[str] = None,
+    token: Optional[str] = None
+) -> Tuple[bool, Optional[str]]:
+    """
+    Отправляет фото и возвращает file_id загруженного изображения.
+    По file_id то же фото можно повторно отправить без загрузки файла.
+
+    Returns:
+        Кортеж (фото отправлено, file_id или None). file_id может отсутствовать
+        и при успешной отправке, если в ответе Telegram нет массива photo.
+    """
+    ok, message = await _send_photo(chat_id, photo_path, caption, token)
+    if not ok:
+        return False, None
+    
+    photos = (message or {}).get("photo") or []
+    # Последний элемент - версия в максимальном размере
+    return True, (photos[-1].get("file_id") if photos else None)
+
+
+async def send_telegram_photo_by_file_id(
+    chat_id: str,
+    file_id: str,
+    caption: Optional[str] = None,
+    token: Optional[str] = None
+) -> bool:
+    """
+    Отправляет уже загруженное в Telegram фото по его file_id (без multipart-загрузки).
+    
+    Returns:
+        True если успешно, False иначе
+    """
+    data = {
+        "chat_id": chat_id,
+        "photo": file_id
+    }
+    if caption:
+        data["caption"] = caption
+    
+    ok, _ = await _api_call("sendPhoto", data, token, chat_id)
+    return ok
+
+
+async def _send_photo(
+    chat_id: str,
+    photo_path: Union[str, Path, bytes],
+    caption: Optional[str],
+    token: Optional[str]
+) -> Tuple[bool, Optional[Dict]]:
+    """Загружает фото в чат и возвращает кортеж (успех, отправленное сообщение или None)."""
     if not token:
         token = get_token_for_chat(chat_id)
     
     if not token:
         logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return False
+        return False, None
     
-    url = f"{TELEGRAM_API_URL}{token}/sendPhoto"
+    url = _url(token, "sendPhoto")
     
     try:
-        with open(photo_path, "rb") as photo_file:
-            form_data = aiohttp.FormData()
-            form_data.add_field("chat_id", str(chat_id))
-            form_data.add_field("photo", photo_file, filename=Path(photo_path).name)
-            if caption:
-                form_data.add_field("caption", caption)
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, data=form_data) as response:
-                    if response.status == 200:
-                        return True
-                    else:
-                        error = await response.text()
-                        logger.error(f"Ошибка отправки фото: {error}")
-                        return False
+        if isinstance(photo_path, (bytes, bytearray)):
+            # Изображение уже в памяти - отправляем без записи на диск
+            return await _post_photo(url, token, chat_id, bytes(photo_path), "image.png", caption)
+
+        async with aiofiles.open(photo_path, "rb") as photo_file:
+            photo_data = await photo_file.read()
+        return await _post_photo(url, token, chat_id, photo_data, Path(photo_path).name, caption)
     except Exception as e:
         logger.error(f"Ошибка при отправке фото: {e}")
-        return False
+        return False, None
+
+
+async def _post_photo(url: str, token: str, chat_id: str, photo: Any, filename: str, caption: Optional[str]) -> Tuple[bool, Optional[Dict]]:
+    """Собирает multipart-запрос sendPhoto, отправляет его и возвращает кортеж (успех, отправленное сообщение)."""
+    form_data = aiohttp.FormData()
+    form_data.add_field("chat_id", str(chat_id))
+    form_data.add_field("photo", photo, filename=filename)
+    if caption:
+        form_data.add_field("caption", caption)
+
+    await _get_rate_limiter(token).acquire()
+    session = await get_session()
+    async with session.post(url, data=form_data, timeout=FILE_TRANSFER_TIMEOUT) as response:
+        if response.status == 200:
+            resp_json = orjson.loads(await response.read())
+            return True, resp_json.get("result")
+        else:
+            error = await response.text()
+            logger.error(f"Ошибка отправки фото: {error}")
+            return False, None
 
 
 async def send_telegram_audio(
@@ -540,24 +861,29 @@ async def send_telegram_audio(
         logger.error("TELEGRAM_BOT_TOKEN не настроен")
         return False
     
-    url = f"{TELEGRAM_API_URL}{token}/sendAudio"
+    url = _url(token, "sendAudio")
     
     try:
-        with open(audio_path, "rb") as audio_file:
-            form_data = aiohttp.FormData()
-            form_data.add_field("chat_id", str(chat_id))
-            form_data.add_field("audio", audio_file, filename=Path(audio_path).name)
-            if caption:
-                form_data.add_field("caption", caption)
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, data=form_data) as response:
-                    if response.status == 200:
-                        return True
-                    else:
-                        error = await response.text()
-                        logger.error(f"Ошибка отправки аудио: {error}")
-                        return False
+        async with aiofiles.open(audio_path, "rb") as audio_file:
+            audio_data = await audio_file.read()
+        
+        form_data = aiohttp.FormData()
+        form_data.add_field("chat_id", str(chat_id))
+        form_data.add_field("audio", audio_data, filename=Path(audio_path).name)
+        if caption:
+            form_data.add_field("caption", caption)
+        
+        await _get_rate_limiter(token).acquire()
+        session = await get_session()
+        async with session.post(url, data=form_data, timeout=FILE_TRANSFER_TIMEOUT) as response:
+            if response.status == 200:
+                # Дочитываем ответ, чтобы соединение вернулось в keep-alive пул
+                await response.read()
+                return True
+            else:
+                error = await response.text()
+                logger.error(f"Ошибка отправки аудио: {error}")
+                return False
     except Exception as e:
         logger.error(f"Ошибка при отправке аудио: {e}")
         return False
@@ -576,89 +902,73 @@ async def send_chat_action(chat_id: str, action: str = "typing", token: Optional
     Returns:
         True если успешно, False при ошибке
     """
-    if not token:
-        token = get_token_for_chat(chat_id)
-    
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return False
-    
-    url = f"{TELEGRAM_API_URL}{token}/sendChatAction"
-    
     data = {
         "chat_id": chat_id,
         "action": action
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                if response.status == 200:
-                    logger.debug(f"✅ Статус '{action}' отправлен в чат {chat_id}")
-                    return True
-                else:
-                    error_text = await response.text()
-                    logger.error(f"❌ Ошибка отправки статуса действия: {response.status} - {error_text}")
-                    return False
-    except Exception as e:
-        logger.error(f"❌ Ошибка при отправке статуса действия: {e}")
-        return False
+    ok, _ = await _api_call("sendChatAction", data, token, chat_id)
+    if ok:
+        logger.debug(f"✅ Статус '{action}' отправлен в чат {chat_id}")
+    return ok
 
 
-async def download_telegram_file(file_id: str, save_path: Path, token: Optional[str] = None) -> Optional[str]:
+async def download_telegram_file(
+    file_id: str,
+    save_path: Path,
+    token: Optional[str] = None,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE
+) -> Optional[str]:
     """
-    Скачивает файл из Telegram.
+    Скачивает файл из Telegram, потоково записывая его на диск.
     
     Args:
         file_id: ID файла в Telegram
         save_path: Путь для сохранения файла
         token: Токен бота (если не указан, используется первый доступный)
+        chunk_size: Размер куска при потоковой записи
         
     Returns:
         Путь к скачанному файлу или None
     """
     if not token:
-        tokens = TELEGRAM_CONFIG.get("tokens", [])
-        if not tokens:
-            token = TELEGRAM_CONFIG.get("token")
-        else:
-            token = tokens[0]
+        token = get_default_token()
     
     if not token:
         logger.error("TELEGRAM_BOT_TOKEN не настроен")
         return None
     
     # Получаем информацию о файле
-    get_file_url = f"{TELEGRAM_API_URL}{token}/getFile?file_id={file_id}"
+    get_file_url = f"{_url(token, 'getFile')}?file_id={file_id}"
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(get_file_url) as response:
-                if response.status == 200:
-                    file_info = await response.json()
-                    if file_info.get("ok"):
-                        file_path = file_info["result"]["file_path"]
+        session = await get_session()
+        async with session.get(get_file_url) as response:
+            if response.status == 200:
+                file_info = orjson.loads(await response.read())
+                if file_info.get("ok"):
+                    file_path = file_info["result"]["file_path"]
                         
-                        # Скачиваем файл
-                        download_url = f"https://api.telegram.org/file/bot{token}/{file_path}"
-                        async with session.get(download_url) as download_response:
-                            if download_response.status == 200:
-                                save_path.parent.mkdir(parents=True, exist_ok=True)
-                                with open(save_path, "wb") as f:
-                                    async for chunk in download_response.content.iter_chunked(8192):
-                                        f.write(chunk)
-                                logger.info(f"Файл скачан: {save_path}")
-                                return str(save_path)
-                            else:
-                                logger.error(f"Ошибка скачивания файла: {download_response.status}")
-                                return None
-                    else:
-                        logger.error(f"Ошибка получения информации о файле: {file_info}")
-                        return None
+                    # Скачиваем файл
+                    download_url = f"https://api.telegram.org/file/bot{token}/{file_path}"
+                    async with session.get(download_url, timeout=FILE_TRANSFER_TIMEOUT) as download_response:
+                        if download_response.status == 200:
+                            await asyncio.to_thread(save_path.parent.mkdir, parents=True, exist_ok=True)
+                            async with aiofiles.open(save_path, "wb", buffering=DOWNLOAD_WRITE_BUFFER) as f:
+                                async for chunk in download_response.content.iter_chunked(chunk_size):
+                                    await f.write(chunk)
+                            logger.info(f"Файл скачан: {save_path}")
+                            return str(save_path)
+                        else:
+                            logger.error(f"Ошибка скачивания файла: {download_response.status}")
+                            return None
                 else:
-                    error = await response.text()
-                    logger.error(f"Ошибка запроса файла: {error}")
+                    logger.error(f"Ошибка получения информации о файле: {file_info}")
                     return None
+            else:
+                error = await response.text()
+                logger.error(f"Ошибка запроса файла: {error}")
+                return None
     except Exception as e:
         logger.error(f"Ошибка при скачивании файла: {e}")
         return None
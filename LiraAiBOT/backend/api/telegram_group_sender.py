@@ -1,18 +1,56 @@
 """
 Модуль для отправки сообщений в группы Telegram.
 """
+import asyncio
 import logging
 from typing import List, Optional
 import aiohttp
 
-from backend.config import TELEGRAM_CONFIG
 from backend.utils.group_manager import get_all_group_ids
-from backend.api.telegram_core import send_telegram_message, send_telegram_photo, send_telegram_audio
+from backend.api.telegram_core import (
+    send_telegram_message,
+    send_telegram_photo,
+    send_telegram_audio,
+    send_telegram_photo_get_file_id,
+    send_telegram_photo_by_file_id,
+    get_default_token,
+)
 
 logger = logging.getLogger("bot.telegram.group_sender")
 
 TELEGRAM_API_URL = "https://api.telegram.org/bot"
 
+# Сколько отправок в группы выполняется одновременно (глобальный лимит Telegram ~30 msg/s)
+GROUP_SEND_CONCURRENCY = 20
+
+
+async def _fan_out(group_ids: List[str], send_one) -> tuple:
+    """
+    Параллельно выполняет send_one(group_id) для всех групп с ограничением конкурентности.
+
+    Returns:
+        Кортеж (success, failed) со списками group_id
+    """
+    semaphore = asyncio.Semaphore(GROUP_SEND_CONCURRENCY)
+
+    async def _bounded(group_id):
+        async with semaphore:
+            return await send_one(group_id)
+
+    results = await asyncio.gather(*(_bounded(gid) for gid in group_ids), return_exceptions=True)
+
+    success = []
+    failed = []
+    for group_id, result in zip(group_ids, results):
+        if isinstance(result, Exception):
+            failed.append(group_id)
+            logger.error(f"❌ Ошибка при отправке в группу {group_id}: {result}")
+        elif result:
+            success.append(group_id)
+        else:
+            failed.append(group_id)
+    return success, failed
+
 
 async def send_message_to_all_groups(text: str, token: Optional[str] = None) -> dict:
     """
@@ -33,31 +71,21 @@ async def send_message_to_all_groups(text: str, token: Optional[str] = None) ->
     
     # Получаем токен
     if not token:
-        tokens = TELEGRAM_CONFIG.get("tokens", [])
-        if not tokens:
-            token = TELEGRAM_CONFIG.get("token")
-        else:
-            token = tokens[0]
+        token = get_default_token()
     
     if not token:
         logger.error("TELEGRAM_BOT_TOKEN не настроен")
         return {"success": [], "failed": group_ids}
     
-    success = []
-    failed = []
+    async def _send_one(group_id):
+        result = await send_telegram_message(group_id, text, token=token)
+        if result:
+            logger.info(f"✅ Сообщение отправлено в группу {group_id}")
+        else:
+            logger.warning(f"❌ Не удалось отправить сообщение в группу {group_id}")
+        return result
     
-    for group_id in group_ids:
-        try:
-            result = await send_telegram_message(group_id, text, token=token)
-            if result:
-                success.append(group_id)
-                logger.info(f"✅ Сообщение отправлено в группу {group_id}")
-            else:
-                failed.append(group_id)
-                logger.warning(f"❌ Не удалось отправить сообщение в группу {group_id}")
-        except Exception as e:
-            failed.append(group_id)
-            logger.error(f"❌ Ошибка при отправке в группу {group_id}: {e}")
+    success, failed = await _fan_out(group_ids, _send_one)
     
     logger.info(f"📤 Отправка завершена: {len(success)} успешно, {len(failed)} ошибок")
     return {"success": success, "failed": failed}
@@ -98,31 +126,36 @@ async def send_photo_to_all_groups(photo_path: str, caption: Optional[str] = Non
     
     # Получаем токен
     if not token:
-        tokens = TELEGRAM_CONFIG.get("tokens", [])
-        if not tokens:
-            token = TELEGRAM_CONFIG.get("token")
-        else:
-            token = tokens[0]
+        token = get_default_token()
     
     if not token:
         logger.error("TELEGRAM_BOT_TOKEN не настроен")
         return {"success": [], "failed": group_ids}
     
-    success = []
-    failed = []
+    # Загружаем файл только в первую группу, остальным отправляем по file_id
+    first_group, *other_groups = group_ids
+    first_sent, file_id = await send_telegram_photo_get_file_id(first_group, photo_path, caption, token=token)
     
-    for group_id in group_ids:
-        try:
+    async def _send_one(group_id):
+        if file_id:
+            result = await send_telegram_photo_by_file_id(group_id, file_id, caption, token=token)
+        else:
             result = await send_telegram_photo(group_id, photo_path, caption, token=token)
-            if result:
-                success.append(group_id)
-                logger.info(f"✅ Фото отправлено в группу {group_id}")
-            else:
-                failed.append(group_id)
-                logger.warning(f"❌ Не удалось отправить фото в группу {group_id}")
-        except Exception as e:
-            failed.append(group_id)
-            logger.error(f"❌ Ошибка при отправке фото в группу {group_id}: {e}")
+        if result:
+            logger.info(f"✅ Фото отправлено в группу {group_id}")
+        else:
+            logger.warning(f"❌ Не удалось отправить фото в группу {group_id}")
+        return result
+    
+    # Первую группу повторно не трогаем: при успехе без file_id фото там уже опубликовано,
+    # остальным группам (если file_id нет) файл загружается заново
+    success, failed = await _fan_out(other_groups, _send_one)
+    if first_sent:
+        logger.info(f"✅ Фото отправлено в группу {first_group}")
+        success.insert(0, first_group)
+    else:
+        logger.warning(f"❌ Не удалось отправить фото в группу {first_group}")
+        failed.insert(0, first_group)
     
     return {"success": success, "failed": failed}
 
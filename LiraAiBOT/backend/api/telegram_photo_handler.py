@@ -3,8 +3,13 @@
 """
 import logging
 import asyncio
+import functools
+import json
 import os
-from typing import Dict, Any, Optional
+import re
+import tempfile
+import time
+from typing import Dict, Any, Optional, Tuple
 from pathlib import Path
 
 from backend.api.telegram_core import (
@@ -17,30 +22,112 @@ from backend.config import Config
 
 logger = logging.getLogger("bot.telegram.photo_handler")
 
-# Простое хранилище для фото (вместо БД)
-_pending_photos: Dict[str, Dict[int, Dict[str, Any]]] = {}
+# Fallback-разбор ответа модели вида {"text": "..."}
+_TEXT_JSON_RE = re.compile(r'"text"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+_JSON_DECODER = json.JSONDecoder()
+
+# Экранированные последовательности в строке JSON, которые разворачиваем вручную
+_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+_ESCAPES = {"n": "\n", "t": "\t", '"': '"', "\\": "\\"}
+
+
+def _unescape_match(match: "re.Match") -> str:
+    """Заменяет одну escape-последовательность (неизвестные оставляет как есть)"""
+    return _ESCAPES.get(match.group(1), match.group(0))
+
+
+def _unescape(text: str) -> str:
+    """
+    Разворачивает \\n, \\t, \\" и \\\\ за один проход по строке.
+    unicode_escape здесь не подходит: он портит кириллицу (байты UTF-8 читаются как latin-1).
+    """
+    if "\\" not in text:
+        return text
+    return _ESCAPE_RE.sub(_unescape_match, text)
+
+def _decode_text_json(response: str) -> Optional[str]:
+    """Достаёт поле "text" из первого JSON-объекта в ответе модели через JSONDecoder.raw_decode"""
+    start = response.find("{")
+    if start == -1:
+        return None
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(response, start)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(obj, dict) and isinstance(obj.get("text"), str):
+        return obj["text"].strip()
+    return None
+
+
+# Промпты для vision-модели
+_PROMPT_IMG_GROUP = "Что на этом изображении? Опиши подробно, но кратко. Используй русский язык."
+_PROMPT_IMG_PRIVATE = "Что на этом изображении? Опиши подробно, обращая внимание на детали. Используй русский язык."
+_PROMPT_TEXT = "Найди и выпиши весь текст, который есть на этом изображении. Ответь строго в формате JSON: {\"text\": \"...\"}"
+
+# В группах описание короче
+_GROUP_TYPES = frozenset({"group", "supergroup"})
+
+# Общий экземпляр анализатора изображений (создаётся при первом фото)
+_analyzer: Optional[ImageAnalyzer] = None
+
+
+def _get_analyzer(config: Config) -> ImageAnalyzer:
+    """Получает или создает экземпляр анализатора изображений"""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = ImageAnalyzer(config)
+    return _analyzer
+
+
+# Сколько фото анализируется одновременно (запросы к vision-модели тяжёлые)
+PHOTO_ANALYSIS_CONCURRENCY = 4
+_analysis_semaphore = asyncio.Semaphore(PHOTO_ANALYSIS_CONCURRENCY)
+
+# Анализы в процессе: (file_id, prompt) -> future с результатом
+_inflight_analyses: Dict[Tuple[str, str], asyncio.Future] = {}
+
+# Фото скачиваются потоково крупными кусками (меньше итераций и write-вызовов)
+PHOTO_DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Через сколько секунд удаляется подсказка с кнопками
+BUTTONS_AUTO_DELETE_DELAY = 10
+
+# Фоновые задачи (авто-удаление кнопок, сообщения об ошибках) — держим ссылки, чтобы их не собрал GC
+_background_tasks = set()
+
+# Сколько хранится фото, для которого так и не нажали кнопку (секунды)
+PENDING_PHOTO_TTL = 600
+
+# Простое хранилище для фото (вместо БД): (chat_id, message_id) -> (время сохранения, сообщение)
+_pending_photos: Dict[Tuple[str, int], Tuple[float, Dict[str, Any]]] = {}
 
 
 def save_pending_photo(chat_id: str, message_id: int, photo_message: Dict[str, Any]):
     """Сохраняет сообщение с фото для последующей обработки"""
-    if chat_id not in _pending_photos:
-        _pending_photos[chat_id] = {}
-    _pending_photos[chat_id][message_id] = photo_message
-    logger.debug(f"Сохранено фото: chat_id={chat_id}, message_id={message_id}")
+    _pending_photos[(chat_id, message_id)] = (time.monotonic(), photo_message)
+    logger.debug("Сохранено фото: chat_id=%s, message_id=%s", chat_id, message_id)
 
 
 def get_pending_photo(chat_id: str, message_id: int) -> Optional[Dict[str, Any]]:
     """Получает сохраненное сообщение с фото"""
-    if chat_id in _pending_photos and message_id in _pending_photos[chat_id]:
-        return _pending_photos[chat_id][message_id]
-    return None
+    entry = _pending_photos.get((chat_id, message_id))
+    return entry[1] if entry else None
 
 
 def delete_pending_photo(chat_id: str, message_id: int):
     """Удаляет сохраненное сообщение с фото"""
-    if chat_id in _pending_photos and message_id in _pending_photos[chat_id]:
-        del _pending_photos[chat_id][message_id]
-        logger.debug(f"Удалено фото: chat_id={chat_id}, message_id={message_id}")
+    if _pending_photos.pop((chat_id, message_id), None) is not None:
+        logger.debug("Удалено фото: chat_id=%s, message_id=%s", chat_id, message_id)
+
+
+def _sweep_pending_photos():
+    """Удаляет фото, которые ждут выбора режима дольше PENDING_PHOTO_TTL"""
+    deadline = time.monotonic() - PENDING_PHOTO_TTL
+    expired = [key for key, (saved_at, _) in _pending_photos.items() if saved_at < deadline]
+    for key in expired:
+        _pending_photos.pop(key, None)
+    if expired:
+        logger.debug("Очищено устаревших фото: %s", len(expired))
 
 
 async def send_photo_recognition_buttons(chat_id: str, message_id: int):
@@ -54,17 +141,243 @@ async def send_photo_recognition_buttons(chat_id: str, message_id: int):
         "Что сделать с этим фото?",
         buttons
     )
-    # Планируем авто-удаление подсказки через 10 секунд
+    # Планируем авто-удаление подсказки через 10 секунд (таймер в цикле событий, без отдельной задачи на ожидание)
     if isinstance(sent_msg_id, int):
-        async def _auto_delete():
+        asyncio.get_running_loop().call_later(BUTTONS_AUTO_DELETE_DELAY, _schedule_auto_delete, chat_id, sent_msg_id)
+
+
+def _schedule_auto_delete(chat_id: str, message_id: int):
+    """Срабатывает по таймеру: запускает удаление кнопок и чистку устаревших фото"""
+    # Заодно вычищаем фото, для которых так и не выбрали режим
+    _sweep_pending_photos()
+    _run_in_background(delete_telegram_message(chat_id, message_id))
+
+
+def _send_nowait(chat_id: str, text: str, parse_mode: Optional[str] = None):
+    """Отправляет сообщение об ошибке, не дожидаясь ответа Telegram"""
+    _run_in_background(send_telegram_message(chat_id, text, parse_mode))
+
+
+def _run_in_background(coro):
+    """Запускает корутину фоновой задачей и держит на неё ссылку до завершения"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_done)
+
+
+def _on_background_done(task: asyncio.Task):
+    """Освобождает ссылку на фоновую задачу и тихо игнорирует её ошибки"""
+    _background_tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.debug("Ошибка фоновой задачи (игнорируем): %s", exc)
+
+
+async def _download_and_analyze(
+    file_id: str,
+    temp_dir: Path,
+    download_telegram_file_func,
+    analyzer: ImageAnalyzer,
+    prompt: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Скачивает фото во временный файл с уникальным именем, анализирует и удаляет файл.
+    Одинаковые запросы (то же фото и тот же промпт), пришедшие одновременно, выполняются один раз.
+
+    Returns:
+        Кортеж (удалось ли скачать, ответ анализатора)
+    """
+    key = (file_id, prompt)
+    pending = _inflight_analyses.get(key)
+    if pending is not None:
+        logger.debug("Анализ фото %s уже выполняется, ждём его результат", file_id)
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_analyses[key] = future
+    try:
+        async with _analysis_semaphore:
+            result = await _download_and_analyze_once(file_id, temp_dir, download_telegram_file_func, analyzer, prompt)
+    except BaseException:
+        # Ожидающим дубликатам отдаём "не удалось", исключение пробрасываем только исходному вызову
+        future.set_result((False, None))
+        raise
+    finally:
+        _inflight_analyses.pop(key, None)
+
+    future.set_result(result)
+    return result
+
+
+async def _download_and_analyze_once(
+    file_id: str,
+    temp_dir: Path,
+    download_telegram_file_func,
+    analyzer: ImageAnalyzer,
+    prompt: str
+) -> Tuple[bool, Optional[str]]:
+    """Одна попытка: скачивание во временный файл, анализ и удаление файла"""
+    # Уникальное имя: параллельные callback-и не перезаписывают файлы друг друга
+    fd, tmp_name = tempfile.mkstemp(dir=str(temp_dir), suffix=".jpg")
+    os.close(fd)
+    local_path = Path(tmp_name)
+    try:
+        downloaded_path = await download_telegram_file_func(file_id, local_path)
+        if not downloaded_path:
+            return False, None
+        return True, await analyzer.analyze_image(downloaded_path, prompt)
+    finally:
+        # Удаляем временный файл даже при ошибке анализа - в пуле потоков, не дожидаясь результата
+        asyncio.get_running_loop().run_in_executor(None, _safe_unlink, local_path)
+
+
+def _safe_unlink(path: Path):
+    """Удаляет временный файл, не пробрасывая ошибки (выполняется в пуле потоков)"""
+    try:
+        path.unlink(missing_ok=True)
+    except Exception as e:
+        logger.error("Ошибка при удалении временного файла: %s", e)
+
+
+async def _handle_photo_img(
+    chat_id: str,
+    real_message_id: int,
+    temp_dir: Path,
+    download_telegram_file_func,
+    config: Config
+) -> bool:
+    """Кнопка "Распознать как изображение": описание фото через vision-модель"""
+    logger.info("[PHOTO CALLBACK] Распознать как изображение: chat_id=%s, message_id=%s", chat_id, real_message_id)
+    
+    photo_message = get_pending_photo(chat_id, real_message_id)
+    if photo_message:
+        photos = photo_message.get("photo", [])
+        if not photos:
+            _send_nowait(chat_id, "❌ Не удалось найти фото для анализа.")
+            return True
+        
+        photo = photos[-1]
+        file_id = photo.get("file_id")
+        if not file_id:
+            _send_nowait(chat_id, "❌ Не удалось получить file_id фото.")
+            return True
+        
+        await send_telegram_message(chat_id, "🔍 Анализирую изображение...")
+        
+        # Анализируем изображение (просто описание, БЕЗ FeedbackBot)
+        analyzer = _get_analyzer(config)
+        chat_type = photo_message.get("chat", {}).get("type", "private")
+        prompt = _PROMPT_IMG_GROUP if chat_type in _GROUP_TYPES else _PROMPT_IMG_PRIVATE
+        
+        downloaded, description = await _download_and_analyze(
+            file_id, temp_dir, download_telegram_file_func, analyzer, prompt
+        )
+        
+        if not downloaded:
+            _send_nowait(chat_id, "❌ Не удалось скачать фото для анализа.")
+            return True
+        
+        if description:
+            await send_telegram_message(chat_id, f"👁️ <b>Я вижу на изображении:</b>\n\n{description}", "HTML")
+        else:
+            _send_nowait(chat_id, "❌ Не удалось проанализировать изображение.")
+        
+        delete_pending_photo(chat_id, real_message_id)
+    else:
+        _send_nowait(chat_id, "⚠️ Сообщение с фото не найдено или устарело")
+    return True
+
+
+async def _handle_photo_text(
+    chat_id: str,
+    real_message_id: int,
+    temp_dir: Path,
+    download_telegram_file_func,
+    config: Config
+) -> bool:
+    """Кнопка "Распознать как текст": извлечение текста с фото"""
+    logger.info("[PHOTO CALLBACK] Распознать как текст: chat_id=%s, message_id=%s", chat_id, real_message_id)
+    
+    photo_message = get_pending_photo(chat_id, real_message_id)
+    if photo_message:
+        photos = photo_message.get("photo", [])
+        if not photos:
+            _send_nowait(chat_id, "❌ Не удалось найти фото для распознавания текста.")
+            return True
+        
+        photo = photos[-1]
+        file_id = photo.get("file_id")
+        if not file_id:
+            _send_nowait(chat_id, "❌ Не удалось получить file_id фото.")
+            return True
+        
+        await send_telegram_message(chat_id, "🔍 Распознаю текст на изображении...")
+        
+        # Анализируем изображение для извлечения текста
+        analyzer = _get_analyzer(config)
+        downloaded, result = await _download_and_analyze(
+            file_id, temp_dir, download_telegram_file_func, analyzer, _PROMPT_TEXT
+        )
+        
+        if not downloaded:
+            _send_nowait(chat_id, "❌ Не удалось скачать фото для распознавания текста.")
+            return True
+        
+        text = None
+        if result:
             try:
-                await asyncio.sleep(10)
-                await delete_telegram_message(chat_id, sent_msg_id)
-                logger.debug(f"Авто-удаление кнопок: chat_id={chat_id}, message_id={sent_msg_id}")
+                # Предварительная обработка ответа модели
+                processed_result = result.strip()
+                
+                # Разбираем JSON-объект одним проходом (допускаются ```-ограждения и хвост после объекта)
+                text = _decode_text_json(processed_result)
+                if text:
+                    logger.info("[PHOTO TEXT] Прямой парсинг сработал!")
+                
+                # Fallback: regex
+                if not text:
+                    text_match = _TEXT_JSON_RE.search(processed_result)
+                    if text_match:
+                        text = text_match.group(1).strip()
+                        text = _unescape(text)
+                        logger.info("[PHOTO TEXT] Regex fallback сработал!")
+                
+                # Последний шанс для битого JSON: берем весь текст между первой и последней кавычкой
+                if not text:
+                    _, key_found, after_key = processed_result.partition('"text":')
+                    if key_found:
+                        # Ищем открывающую кавычку после "text":
+                        _, quote_found, after_quote = after_key.partition('"')
+                        if quote_found:
+                            # Берем ВЕСЬ текст от открывающей кавычки до КОНЦА ответа
+                            raw_text = after_quote.strip()
+                        
+                            # Если текст заканчивается кавычкой - убираем ее
+                            if raw_text.endswith('"'):
+                                raw_text = raw_text[:-1]
+                        
+                            # Обрабатываем escaped символы
+                            text = _unescape(raw_text)
+                        
+                            # Убираем возможные завершающие символы (}, ``` и т.д.)
+                            text = text.partition('}')[0].partition('```')[0].strip()
+                        
+                            logger.info("[PHOTO TEXT] Найден текст длиной %s символов", len(text))
+                
             except Exception as e:
-                # Тихо игнорируем любые ошибки удаления
-                logger.debug(f"Ошибка авто-удаления кнопок (игнорируем): {e}")
-        asyncio.create_task(_auto_delete())
+                logger.error("[PHOTO TEXT] Ошибка парсинга JSON: %s. Ответ модели: %s...", e, result[:200])
+        
+        if text and text.strip():
+            await send_telegram_message(chat_id, f"📝 <b>Распознанный текст:</b>\n\n{text}", "HTML")
+        else:
+            _send_nowait(chat_id, "❌ Не удалось корректно распознать текст на изображении.")
+        
+        delete_pending_photo(chat_id, real_message_id)
+    else:
+        _send_nowait(chat_id, "⚠️ Сообщение с фото не найдено или устарело")
+    return True
 
 
 async def handle_photo_callback(
@@ -81,161 +394,19 @@ async def handle_photo_callback(
     Обрабатывает callback-кнопки для фото: как изображение и как текст.
     message_id должен браться только из callback_data (photo_img_12345), а не из callback_query['message']['message_id']!
     """
-    # Получаем message_id из callback_data (например, photo_text_10996)
-    if callback_data.startswith("photo_img_"):
-        real_message_id = int(callback_data.replace("photo_img_", ""))
-        logger.info(f"[PHOTO CALLBACK] Распознать как изображение: chat_id={chat_id}, message_id={real_message_id}")
-        
-        photo_message = get_pending_photo(chat_id, real_message_id)
-        if photo_message:
-            photos = photo_message.get("photo", [])
-            if not photos:
-                await send_telegram_message(chat_id, "❌ Не удалось найти фото для анализа.")
-                return True
-            
-            photo = photos[-1]
-            file_id = photo.get("file_id")
-            if not file_id:
-                await send_telegram_message(chat_id, "❌ Не удалось получить file_id фото.")
-                return True
-            
-            await send_telegram_message(chat_id, "🔍 Анализирую изображение...")
-            
-            # Скачиваем фото
-            local_path = temp_dir / f"photo_img_{os.getpid()}.jpg"
-            downloaded_path = await download_telegram_file_func(file_id, local_path)
-            
-            if not downloaded_path:
-                await send_telegram_message(chat_id, "❌ Не удалось скачать фото для анализа.")
-                return True
-            
-            # Анализируем изображение (просто описание, БЕЗ FeedbackBot)
-            analyzer = ImageAnalyzer(config)
-            chat_type = photo_message.get("chat", {}).get("type", "private")
-            if chat_type in ("group", "supergroup"):
-                prompt = "Что на этом изображении? Опиши подробно, но кратко. Используй русский язык."
-            else:
-                prompt = "Что на этом изображении? Опиши подробно, обращая внимание на детали. Используй русский язык."
-            
-            description = await analyzer.analyze_image(downloaded_path, prompt)
-            
-            # Удаляем временный файл
-            try:
-                os.remove(downloaded_path)
-            except Exception as e:
-                logger.error(f"Ошибка при удалении временного файла: {e}")
-            
-            if description:
-                await send_telegram_message(chat_id, f"👁️ <b>Я вижу на изображении:</b>\n\n{description}", "HTML")
-            else:
-                await send_telegram_message(chat_id, "❌ Не удалось проанализировать изображение.")
-            
-            delete_pending_photo(chat_id, real_message_id)
-        else:
-            await send_telegram_message(chat_id, "⚠️ Сообщение с фото не найдено или устарело")
-        return True
-        
-    elif callback_data.startswith("photo_text_"):
-        real_message_id = int(callback_data.replace("photo_text_", ""))
-        logger.info(f"[PHOTO CALLBACK] Распознать как текст: chat_id={chat_id}, message_id={real_message_id}")
-        
-        photo_message = get_pending_photo(chat_id, real_message_id)
-        if photo_message:
-            photos = photo_message.get("photo", [])
-            if not photos:
-                await send_telegram_message(chat_id, "❌ Не удалось найти фото для распознавания текста.")
-                return True
-            
-            photo = photos[-1]
-            file_id = photo.get("file_id")
-            if not file_id:
-                await send_telegram_message(chat_id, "❌ Не удалось получить file_id фото.")
-                return True
-            
-            await send_telegram_message(chat_id, "🔍 Распознаю текст на изображении...")
-            
-            # Скачиваем фото
-            local_path = temp_dir / f"photo_text_{os.getpid()}.jpg"
-            downloaded_path = await download_telegram_file_func(file_id, local_path)
-            
-            if not downloaded_path:
-                await send_telegram_message(chat_id, "❌ Не удалось скачать фото для распознавания текста.")
-                return True
-            
-            # Анализируем изображение для извлечения текста
-            analyzer = ImageAnalyzer(config)
-            prompt = "Найди и выпиши весь текст, который есть на этом изображении. Ответь строго в формате JSON: {\"text\": \"...\"}"
-            result = await analyzer.analyze_image(downloaded_path, prompt)
-            
-            # Удаляем временный файл
-            try:
-                os.remove(downloaded_path)
-            except Exception as e:
-                logger.error(f"Ошибка при удалении временного файла: {e}")
-            
-            text = None
-            if result:
-                try:
-                    import re
-                    import json
-                    
-                    # Предварительная обработка ответа модели
-                    processed_result = result.strip()
-                    
-                    # СУПЕР ПРОСТОЙ ПОДХОД: берем весь текст между первой и последней кавычкой
-                    if '"text":' in processed_result:
-                        # Ищем первую кавычку после "text":
-                        text_pos = processed_result.find('"text":')
-                        if text_pos != -1:
-                            # Ищем открывающую кавычку после "text":
-                            start_quote = processed_result.find('"', text_pos + 7)
-                            if start_quote != -1:
-                                # Берем ВЕСЬ текст от открывающей кавычки до КОНЦА ответа
-                                raw_text = processed_result[start_quote + 1:].strip()
-                                
-                                # Если текст заканчивается кавычкой - убираем ее
-                                if raw_text.endswith('"'):
-                                    raw_text = raw_text[:-1]
-                                
-                                # Обрабатываем escaped символы
-                                text = raw_text.replace('\\n', '\n').replace('\\t', '\t').replace('\\"', '"').replace('\\\\', '\\')
-                                
-                                # Убираем возможные завершающие символы (}, ``` и т.д.)
-                                text = text.split('}')[0].split('```')[0].strip()
-                                
-                                logger.info(f"[PHOTO TEXT] Найден текст длиной {len(text)} символов")
-                    
-                    # Пытаемся напрямую распарсить JSON
-                    if not text:
-                        try:
-                            if processed_result.strip().startswith('{'):
-                                direct_json = json.loads(processed_result.strip())
-                                if isinstance(direct_json, dict) and "text" in direct_json:
-                                    text = direct_json["text"].strip()
-                                    logger.info(f"[PHOTO TEXT] Прямой парсинг сработал!")
-                        except Exception:
-                            pass
-                    
-                    # Fallback: regex
-                    if not text:
-                        text_match = re.search(r'"text"\s*:\s*"((?:[^"\\]|\\.)*)"', processed_result, re.DOTALL)
-                        if text_match:
-                            text = text_match.group(1).strip()
-                            text = text.replace('\\n', '\n').replace('\\t', '\t').replace('\\"', '"').replace('\\\\', '\\')
-                            logger.info(f"[PHOTO TEXT] Regex fallback сработал!")
-                    
-                except Exception as e:
-                    logger.error(f"[PHOTO TEXT] Ошибка парсинга JSON: {e}. Ответ модели: {result[:200]}...")
-            
-            if text and text.strip():
-                await send_telegram_message(chat_id, f"📝 <b>Распознанный текст:</b>\n\n{text}", "HTML")
-            else:
-                await send_telegram_message(chat_id, "❌ Не удалось корректно распознать текст на изображении.")
-            
-            delete_pending_photo(chat_id, real_message_id)
-        else:
-            await send_telegram_message(chat_id, "⚠️ Сообщение с фото не найдено или устарело")
-        return True
-    
-    return False
+    # Получаем тип кнопки и message_id из callback_data (например, photo_text_10996) за один разбор
+    kind, _, raw_message_id = callback_data.rpartition("_")
+    handler = _PHOTO_CALLBACK_HANDLERS.get(kind)
+    if handler is None or not raw_message_id.isdigit():
+        return False
+
+    # Параметры скачивания фиксируем один раз; скачивание идёт через общую keep-alive сессию telegram_core
+    download_photo = functools.partial(download_telegram_file_func, chunk_size=PHOTO_DOWNLOAD_CHUNK_SIZE)
+    return await handler(chat_id, int(raw_message_id), temp_dir, download_photo, config)
+
 
+# Обработчики кнопок распознавания фото по префиксу callback_data
+_PHOTO_CALLBACK_HANDLERS = {
+    "photo_img": _handle_photo_img,
+    "photo_text": _handle_photo_text,
+}
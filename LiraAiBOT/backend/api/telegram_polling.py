@@ -2,16 +2,23 @@
 Модуль для обработки Telegram polling.
 """
 import asyncio
+import heapq
 import logging
-import os
 import re
+import time
+import traceback
+import uuid
+import weakref
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from types import MappingProxyType
+from typing import Deque, Dict, Any, Optional, List
 
 import aiohttp
+import orjson
 
-from backend.config import TELEGRAM_CONFIG, Config
+from backend.config import TELEGRAM_CONFIG, Config, BASE_URL
 from backend.api.telegram_core import (
     send_telegram_message,
     send_telegram_message_get_id,
@@ -20,33 +27,59 @@ from backend.api.telegram_core import (
     download_telegram_file,
     send_chat_action,
     send_telegram_message_with_buttons,
-    delete_telegram_message
+    delete_telegram_message,
+    answer_callback_query,
+    edit_message_text,
+    set_token_for_chat,
+    compile_keyboard,
+    register_keyboard,
+    enqueue_telegram_message,
+    get_session
+)
+from backend.api.telegram_photo_handler import (
+    save_pending_photo,
+    send_photo_recognition_buttons,
+    handle_photo_callback
 )
 from backend.api.telegram_vision import process_telegram_photo
 from backend.api.telegram_voice import process_telegram_voice
 from backend.llm.openrouter import OpenRouterClient
 from backend.llm.groq import get_groq_client
 from backend.llm.cerebras import get_cerebras_client
-from backend.vision.hf_replicate import get_hf_replicate_client
+from backend.vision.hf_replicate import get_hf_replicate_client, PROMPT_QUALITY_SUFFIX
+from backend.vision.image_analyzer import ImageAnalyzer
+from backend.voice.stt import SpeechToText
+from backend.database.users_db import get_database, run_db, generate_signature, ACCESS_LEVELS
 from backend.utils.keyboards import (
     create_main_menu_keyboard,
     create_hide_keyboard,
     create_model_selection_keyboard,
     create_image_model_selection_keyboard,
-    get_mode_from_button,
     get_model_from_button,
     get_mode_prompt,
     BOT_MODES
 )
 from backend.utils.mode_manager import get_mode_manager
+from backend.utils.user_state import UserStateCache
 from backend.utils.group_manager import save_group_id_to_env, get_all_group_ids
 from backend.core.feedback_bot import FeedbackBotHandler
+from backend.utils.formatters import format_stats_card
 
 logger = logging.getLogger("bot.telegram_polling")
 
 TELEGRAM_API_URL = "https://api.telegram.org/bot"
 last_update_id = 0
 
+# Команды генерации изображения: префикс, после которого идёт описание
+GENERATE_PREFIXES = ("/generate ", "/рисунок ")
+
+# Экспоненциальная пауза при 502 от getUpdates: 2, 4, 8, ... но не больше POLL_BACKOFF_MAX секунд
+POLL_BACKOFF_MAX = 30
+_poll_502_streak = 0
+
+# Кэш username бота по токену (не меняется за время работы процесса)
+_bot_username_cache: Dict[str, str] = {}
+
 # Создаем папку для временных файлов
 temp_dir = Path(__file__).parent.parent.parent / "temp"
 temp_dir.mkdir(exist_ok=True)
@@ -66,6 +99,9 @@ cerebras_client = get_cerebras_client()
 # Создаем Polza.ai клиент для генерации изображений
 hf_replicate_client = get_hf_replicate_client()
 
+# Группы FeedbackBot (множество: проверка членства на каждое групповое сообщение)
+_FEEDBACK_GROUPS = frozenset(str(gid) for gid in (config.FEEDBACK_BOT_GROUP_IDS or ()))
+
 # Инициализируем FeedbackBotHandler если включен
 feedback_bot_handler = None
 if config.FEEDBACK_BOT_ENABLED:
@@ -73,27 +109,34 @@ if config.FEEDBACK_BOT_ENABLED:
         feedback_bot_handler = FeedbackBotHandler(config)
         logger.info("FeedbackBotHandler инициализирован")
     except Exception as e:
-        logger.error(f"Ошибка инициализации FeedbackBotHandler: {e}")
+        logger.error("Ошибка инициализации FeedbackBotHandler: %s", e)
 
 # Инициализируем менеджер режимов
 mode_manager = get_mode_manager()
 logger.info("✅ ModeManager инициализирован")
 
+# Ограничения для хранилищ состояния пользователей в памяти
+USER_STATE_MAXSIZE = 10000
+USER_STATE_TTL = 3600  # секунды
+
 # Хранилище истории диалогов для FeedbackBot (по группам)
-feedback_chat_history: Dict[str, List[Dict[str, str]]] = {}
+# deque с maxlen сам вытесняет старые сообщения, обрезать историю вручную не нужно
+FEEDBACK_HISTORY_MAXLEN = 20
+feedback_chat_history: Dict[str, Deque[Dict[str, str]]] = UserStateCache(maxsize=USER_STATE_MAXSIZE)
 
 # Хранилище выбранной модели для каждого пользователя
 # По умолчанию используем OpenRouter Solar вместо Groq
-user_models: Dict[str, str] = {}
+# Без TTL: выбор модели - настройка, вытесняются только самые давние пользователи
+user_models: Dict[str, str] = UserStateCache(maxsize=USER_STATE_MAXSIZE)
 
 # Хранилище выбранной модели генерации изображений
-user_image_models: Dict[str, str] = {}
+user_image_models: Dict[str, str] = UserStateCache(maxsize=USER_STATE_MAXSIZE, ttl=USER_STATE_TTL)
 
 # Хранилище состояния для генерации изображений
-user_generating_photo: Dict[str, bool] = {}
+user_generating_photo: Dict[str, bool] = UserStateCache(maxsize=USER_STATE_MAXSIZE, ttl=USER_STATE_TTL)
 
 # Хранилище состояния для выбора модели
-user_selecting_model: Dict[str, bool] = {}
+user_selecting_model: Dict[str, bool] = UserStateCache(maxsize=USER_STATE_MAXSIZE, ttl=USER_STATE_TTL)
 
 # Хранилище для отслеживания нажатий кнопки "Я оплатил"
 # Формат: {user_id: {"count": int, "first_click_time": datetime, "last_click_time": datetime}}
@@ -127,7 +170,15 @@ support_reply_routes: Dict[str, Dict[str, Any]] = {}
 admin_reply_routes: Dict[str, Dict[int, Dict[str, str]]] = {}
 
 # Глобальная переменная для режима тех.работ
-maintenance_mode = {"enabled": False, "until_time": None}
+# until_time_parsed - время окончания, распарсенное один раз при изменении режима
+maintenance_mode = {"enabled": False, "until_time": None, "until_time_parsed": None}
+
+# Формат времени окончания тех.работ: HH:MM
+_MAINTENANCE_TIME_RE = re.compile(r"^\d{2}:\d{2}$")
+
+# Как долго (секунды) доверяем закэшированному статусу тех.работ, не обращаясь к БД
+MAINTENANCE_CACHE_TTL = 5
+_maintenance_checked_at: Optional[float] = None
 
 # Хранилище истории диалогов удалено - теперь используется база данных
 
@@ -145,10 +196,298 @@ AVAILABLE_MODELS = {
     "openrouter-gemma": ("openrouter", "google/gemma-3n-e2b-it:free"),  # OpenRouter Gemma 3N
 }
 
+# Reply-кнопки выбора модели -> ключ модели
+MODEL_BUTTON_KEYS = {
+    "🧠 Groq GPT-oss 20B": "groq-llama",
+    "🦙 Groq Llama 4": "groq-maverick",
+    "🔍 Groq Scout": "groq-scout",
+    "🌙 Groq Kimi K2": "groq-kimi",
+    "⚡ Cerebras Llama 3.1": "cerebras-llama",
+    "🧠 Cerebras GPT-oss 120B": "cerebras-gpt",
+    "☁️ OpenRouter Gemma 3N": "openrouter-gemma",
+}
+
+# Названия моделей в подтверждении выбора
+SELECTED_MODEL_NAMES = {
+    "groq-llama": "🧠 GPT-oss 20B",
+    "groq-maverick": "🦙 Llama 4 Maverick",
+    "groq-scout": "🔍 Llama 4 Scout",
+    "groq-kimi": "🌙 Kimi K2",
+    "cerebras-llama": "⚡ Llama 3.1 8B (Cerebras)",
+    "cerebras-gpt": "🧠 GPT-oss 120B (Cerebras)",
+    "openrouter-gemma": "☁️ Gemma 3N (OpenRouter)",
+    "solar": "☀️ Solar Pro 3",
+    "trinity": "🔱 Trinity Mini",
+    "glm": "🤖 GLM-4.5"
+}
+
+# Названия моделей для команды /model
+CURRENT_MODEL_NAMES = {
+    "groq-llama": "🧠 Groq GPT-oss 20B",
+    "groq-maverick": "🦙 Groq Llama 4",
+    "groq-scout": "🔍 Groq Scout",
+    "groq-kimi": "🌙 Groq Kimi K2",
+    "cerebras-llama": "⚡ Cerebras Llama 3.1",
+    "solar": "☀️ Solar",
+    "trinity": "🔱 Trinity",
+    "glm": "🤖 GLM-4.5"
+}
+
+# Обратный индекс: текст кнопки reply-клавиатуры -> режим
+_BUTTON_TO_MODE: Dict[str, str] = {v: k for k, v in BOT_MODES.items()}
+
 ADMIN_LEVEL_ICONS = {"admin": "👑", "sub+": "🚀", "subscriber": "⭐", "user": "👤"}
 ADMIN_LEVEL_PRIORITY = {"admin": 0, "sub+": 1, "subscriber": 2, "user": 3}
 ADMIN_LEVEL_LIMITS = {"admin": "∞", "sub+": "30", "subscriber": "5", "user": "3"}
 
+# Подписи уровней доступа для карточки статистики (только для чтения)
+LEVEL_INFO = MappingProxyType({
+    "admin": "👑 Администратор (безлимит)",
+    "subscriber": "⭐ Подписчик (5 в день)",
+    "sub+": "🚀 sub+ (30 в день)",
+    "user": "👤 Пользователь (3 в день)"
+})
+
+
+# Стартовое меню (/start): кнопки и приветствие собираются один раз при импорте
+START_MENU_BUTTONS = [
+    [
+        {"text": "🤖 Выбрать модель", "callback_data": "menu_models"},
+        {"text": "🎨 Генерировать фото", "callback_data": "gen_photo"},
+    ],
+    [
+        {"text": "📸 Фото", "callback_data": "menu_photo"},
+        {"text": "🎤 Голос", "callback_data": "menu_voice"},
+    ],
+    [
+        {"text": "📊 Статистика", "callback_data": "stats"},
+        {"text": "📢 Подписаться", "url": "https://t.me/liranexus"},
+    ],
+    [
+        {"text": "ℹ️ Помощь", "callback_data": "help"},
+        {"text": "💬 Поддержка", "url": "https://t.me/suplira"},
+    ]
+]
+
+START_MENU_KEYBOARD = compile_keyboard(START_MENU_BUTTONS)
+
+WELCOME_TEXT = """👋 Привет! Я LiraAI 🤖
+
+Я бесплатный AI-ассистент в Telegram.
+
+Что я умею:
+• 💬 отвечать на вопросы и помогать с текстом
+• 🎤 распознавать голосовые сообщения
+• 🔊 отправлять голосовой ответ
+• 📸 анализировать фотографии
+• 🎨 генерировать изображения через Z-Image
+
+🆓 Общение, голос и анализ фото доступны бесплатно.
+
+Доступные модели:
+• Groq: GPT-oss 20B, Llama 4 Maverick, Llama 4 Scout, Kimi K2
+• Cerebras: Llama 3.1 8B, GPT-oss 120B
+• OpenRouter: Gemma 3N
+
+Обо мне:
+Бота делает LiraDev.
+Новости и обновления: @liranexus
+Помощь : @suplira
+━━━━━━━━━━━━━━━━━━━━
+📱 Начни с выбора модели или просто отправь сообщение
+━━━━━━━━━━━━━━━━━━━━
+
+Выбери действие кнопками ниже 👇"""
+
+# Справка по команде /help
+HELP_TEXT = """📖 Помощь - LiraAI MultiAssistent
+
+Команды:
+• /start - Показать главное меню
+• /models - Выбор модели для общения
+• /generate [описание] - Генерировать изображение
+• /рисунок [описание] - Генерировать изображение (рус)
+• /clear - Очистить историю диалога
+• /cancel - Отменить генерацию изображения
+
+Возможности:
+• 💬 Общение на русском языке с памятью
+• 🎨 Генерация изображений
+• 🎤 Распознавание голоса
+• 📸 Анализ фотографий
+
+Модели (все БЕСПЛАТНЫЕ!):
+🚀 Groq (очень быстрые):
+• GPT-oss 20B - стабильная новая базовая
+• Llama 4 Maverick - новейшая от Meta
+• Llama 4 Scout - легкая и быстрая
+• Kimi K2 - от Moonshot AI
+
+☁️ OpenRouter:
+• Solar Pro 3 - быстрая, качественная
+• Trinity Mini - мультимодальная
+• GLM-4.5 - полностью бесплатная
+
+Бот запоминает последние 10 сообщенияй вашего диалога!
+
+Просто отправьте сообщения или выберите команду в меню!"""
+
+# Справка для режима "❓ Помощь" (reply-клавиатура)
+MODE_HELP_TEXT = """ℹ️ **Помощь - LiraAI MultiAssistant**
+
+**Команды:**
+• /start - Главное меню
+• /menu - Показать клавиатуру
+• /hide - Скрыть клавиатуру
+• /models - Выбор модели
+• /generate [описание] - Генерация изображения
+• /stats - Ваша статистистика
+
+**Возможности:**
+• 💬 Общение на русском языке
+• 🎨 Генерация изображений
+• 🎤 Распознавание голоса
+• 📸 Анализ фотографий
+
+**Режимы:**
+• 💬 Текст - обычное общения
+• 🎤 Голос - распознавание речи
+• 📸 Фото - анализ изображений
+• 🎨 Генерация - создание изображений
+
+Бот запоминает последние 10 сообщенияй вашего диалога!"""
+
+# Справка для inline-кнопки "ℹ️ Помощь"
+CALLBACK_HELP_TEXT = """ℹ️ **Помощь - LiraAI MultiAssistant**
+
+**Команды:**
+• /start - Главное меню
+• /menu - Показать клавиатуру
+• /hide - Скрыть кла��иатуру
+• /models - Выбор модели
+• /generate [описание] - Генерация изображения
+• /stats - Ваша статистика
+
+**Возможности:**
+• 💬 Общение на русском язы��е
+• 🎨 Генерация изображений
+• 🎤 Распознавание го��оса
+• 📸 Анал��з фотографий
+
+Бот запоминает п��следние 10 сообщенияй!"""
+
+# Описания моделей для inline-кнопок model_*
+CALLBACK_MODEL_NAMES = {
+    "groq-llama": "🧠 GPT-oss 20B - новая базовая модель",
+    "groq-maverick": "🦙 Llama 4 Maverick - новейшая от Meta",
+    "groq-scout": "🔍 Llama 4 Scout - легкая и быстрая",
+    "groq-kimi": "🌙 Kimi K2 - от Moonshot AI",
+    "cerebras-llama": "⚡ Llama 3.1 8B - сверхбыстрая (Cerebras)",
+    "solar": "☀️ Solar Pro 3 - быстрая и качественная",
+    "trinity": "🔱 Trinity Mini - мультимодальная",
+    "glm": "🤖 GLM-4.5 - полностью бесплатная"
+}
+
+# Подпись к главной reply-клавиатуре
+MAIN_MENU_TEXT = "📱 **Главное меню**\n\nВыберите режим работы:"
+
+# Reply-клавиатуры статичны: собираем и сериализуем один раз
+MAIN_MENU_KEYBOARD = register_keyboard(create_main_menu_keyboard())
+HIDE_KEYBOARD = register_keyboard(create_hide_keyboard())
+MODEL_SELECTION_KEYBOARD = register_keyboard(create_model_selection_keyboard())
+
+# Inline-меню команды /models
+MODELS_MENU_KEYBOARD = compile_keyboard([
+    [
+        {"text": "🧠 Groq GPT-oss 20B", "callback_data": "model_groq-llama"},
+        {"text": "🦙 Groq Llama 4 Maverick", "callback_data": "model_groq-maverick"},
+    ],
+    [
+        {"text": "🔍 Groq Llama 4 Scout", "callback_data": "model_groq-scout"},
+        {"text": "🌙 Groq Kimi K2", "callback_data": "model_groq-kimi"},
+    ],
+    [
+        {"text": "☁️ OpenRouter Gemma 3N", "callback_data": "model_openrouter-gemma"},
+    ]
+])
+
+# Карточка статистики для inline-кнопки "📊 Статистика" (подставляется через .format)
+STATS_CALLBACK_TEMPLATE = """📊 **Ваша статистика**
+
+👤 {name}
+🔑 Уровень: **{level}**
+
+📈 Генерации:
+• Сегодня: {daily_count}
+• Всего: {total_count}
+
+📅 В боте с: {created_at}"""
+
+# Админ-панель (/admin): текст и кнопки не зависят от пользователя
+ADMIN_PANEL_TEXT = (
+    "👑 *Админ панель*\n\n"
+    "Быстрые разделы открываются кнопками ниже.\n\n"
+    "Текстовые команды:\n"
+    "• `/admin user <id>` карточка пользователя\n"
+    "• `/admin set_level <id> <level>` выдать уровень\n"
+    "• `/admin remove_level <id>` снять уровень\n"
+    "• `/admin ban <id> <days|permanent>` бан\n"
+    "• `/admin unban <id>` разбан\n"
+    "• `/admin pay_confirm <id>` подтвердить оплату\n"
+    "• `/admin pay_decline <id>` отклонить оплату\n"
+    "• `/admin broadcast <текст>` рассылка\n"
+    "• `/admin maintenance HH:MM` техработы"
+)
+ADMIN_PANEL_BUTTONS = [
+    [
+        {"text": "👥 Пользователи", "callback_data": "admin_users"},
+        {"text": "📊 Статистика", "callback_data": "admin_stats_panel"},
+    ],
+    [
+        {"text": "📋 Audit Log", "callback_data": "admin_logs"},
+        {"text": "ℹ️ Команды", "callback_data": "admin_help"},
+    ],
+]
+
+ADMIN_HELP_TEXT = (
+    "ℹ️ *Команды админки*\n\n"
+    "Пользователи:\n"
+    "• `/admin users`\n"
+    "• `/admin user <id>`\n"
+    "• `/admin add_user <id>`\n"
+    "• `/admin remove_user <id>`\n"
+    "• `/admin set_level <id> <level>`\n"
+    "• `/admin remove_level <id>`\n\n"
+    "• `/admin ban <id> <days|permanent>`\n"
+    "• `/admin unban <id>`\n\n"
+    "Платежи:\n"
+    "• `/admin pay_confirm <id>`\n"
+    "• `/admin pay_decline <id>`\n"
+    "• `/admin reset_payment_limit <id>`\n\n"
+    "Сервис:\n"
+    "• `/admin stats`\n"
+    "• `/admin admin_stats`\n"
+    "• `/admin log [user_id] [limit]`\n"
+    "• `/admin maintenance HH:MM`\n"
+    "• `/admin maintenance_off`"
+)
+
+# Уведомление всем пользователям после /admin maintenance_off
+MAINTENANCE_OFF_TEXT = "✅ **Технические работы завершены**\n\nБот снова доступен в полном режиме.\n\nСпасибо за ожидание!"
+
+# Сколько отправок рассылки держим в полёте одновременно (темп задаёт лимитер бота в telegram_core)
+BROADCAST_CONCURRENCY = 20
+
+
+# Блокировки генерации по user_id. Слабые ссылки: блокировка живёт, пока её кто-то держит или ждёт
+_generation_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+async def _send_queued(chat_id: str, text: str, **kwargs):
+    """Ставит ответ в очередь отправки, а если очередь переполнена - отправляет сразу."""
+    if not enqueue_telegram_message(chat_id, text, **kwargs):
+        await send_telegram_message(chat_id, text, **kwargs)
+
 
 def _get_available_image_models(access_level: str) -> Dict[str, Dict[str, Any]]:
     """Собирает все доступные image-модели для уровня доступа."""
@@ -196,12 +535,29 @@ def _format_admin_last_seen(value: Any) -> str:
         return text[:16] if text else "неизвестно"
 
 
+# Таблица экранирования Markdown (str.translate работает за один проход в C)
+_MARKDOWN_ESCAPE_TABLE = str.maketrans({
+    "\\": "\\\\",
+    "_": "\\_",
+    "*": "\\*",
+    "`": "\\`",
+    "[": "\\[",
+})
+
+# Предкомпилированные регулярки для очистки ответа LLM
+_MD_ITALIC_RE = re.compile(r'(?<!\n)\*([^*]+)\*(?!\n)')
+_MD_UNDERSCORE_RE = re.compile(r'(?<!\n)_([^_]+)_(?!\n)')
+_MD_LINK_RE = re.compile(r'\[([^\]]+)\]\([^)]+\)')
+_MD_HEADER_RE = re.compile(r'^#+\s*', re.MULTILINE)
+_MD_QUOTE_RE = re.compile(r'^>\s*', re.MULTILINE)
+_MD_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+# Быстрая проверка: есть ли в тексте хоть что-то, что нужно чистить
+_MD_ANY_MARKUP_RE = re.compile(r'[*_`\[#>]|\n{3}')
+
+
 def _escape_markdown(text: Any) -> str:
     """Минимальное экранирование для Markdown-сообщений Telegram."""
-    value = str(text or "")
-    for char in ("\\", "_", "*", "`", "["):
-        value = value.replace(char, f"\\{char}")
-    return value
+    return str(text or "").translate(_MARKDOWN_ESCAPE_TABLE)
 
 
 def _clean_markdown_formatting(text: str) -> str:
@@ -211,32 +567,36 @@ def _clean_markdown_formatting(text: str) -> str:
     """
     if not text:
         return ""
+
+    # Обычный ответ без разметки - пропускаем все проходы замены
+    if not _MD_ANY_MARKUP_RE.search(text):
+        return text.strip()
     
     # Убираем **жирный** → жирный
     text = text.replace("**", "")
     
     # Убираем *курсив* (но не звездочки в списках)
     # Заменяем *текст* на текст, но не * в начале строки (списки)
-    text = re.sub(r'(?<!\n)\*([^*]+)\*(?!\n)', r'\1', text)
+    text = _MD_ITALIC_RE.sub(r'\1', text)
     
     # Убираем __подчёркивание__
     text = text.replace("__", "")
-    text = re.sub(r'(?<!\n)_([^_]+)_(?!\n)', r'\1', text)
+    text = _MD_UNDERSCORE_RE.sub(r'\1', text)
     
     # Убираем `код`
     text = text.replace("`", "")
     
     # Убираем [ссылка](url) → ссылка
-    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+    text = _MD_LINK_RE.sub(r'\1', text)
     
     # Убираем заголовки # → пустая строка
-    text = re.sub(r'^#+\s*', '', text, flags=re.MULTILINE)
+    text = _MD_HEADER_RE.sub('', text)
     
     # Убираем > цитаты
-    text = re.sub(r'^>\s*', '', text, flags=re.MULTILINE)
+    text = _MD_QUOTE_RE.sub('', text)
     
     # Очищаем лишние пустые строки
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _MD_EXTRA_NEWLINES_RE.sub('\n\n', text)
     
     return text.strip()
 
@@ -298,7 +658,7 @@ async def notify_admins_about_security_event(
         try:
             await send_telegram_message(admin_id, alert_text, parse_mode="Markdown")
         except Exception as e:
-            logger.warning(f"⚠️ Не удалось отправить security alert админу {admin_id}: {e}")
+            logger.warning("⚠️ Не удалось отправить security alert админу %s: %s", admin_id, e)
 
     db.log_admin_action(
         admin_user_id="system",
@@ -312,7 +672,15 @@ async def notify_admins_about_security_event(
 
 def _build_admin_users_page(users: List[Dict[str, Any]], page_num: int, page_size: int = 12) -> tuple[str, List[List[Dict[str, str]]]]:
     """Формирует текст и кнопки пагинации для /admin users."""
-    users_sorted = sorted(
+    total_users = len(users)
+    total_pages = max(1, (total_users + page_size - 1) // page_size)
+    page_num = max(0, min(page_num, total_pages - 1))
+    start_idx = page_num * page_size
+    end_idx = min(start_idx + page_size, total_users)
+
+    # Полная сортировка не нужна: достаточно первых end_idx записей в порядке показа
+    users_sorted = heapq.nsmallest(
+        end_idx,
         users,
         key=lambda u: (
             ADMIN_LEVEL_PRIORITY.get(u.get("access_level", "user"), 4),
@@ -322,22 +690,24 @@ def _build_admin_users_page(users: List[Dict[str, Any]], page_num: int, page_siz
         )
     )
 
-    total_users = len(users_sorted)
-    total_pages = max(1, (total_users + page_size - 1) // page_size)
-    page_num = max(0, min(page_num, total_pages - 1))
-    start_idx = page_num * page_size
-    end_idx = min(start_idx + page_size, total_users)
-
-    admin_count = sum(1 for u in users_sorted if u.get("access_level") == "admin")
-    sub_plus_count = sum(1 for u in users_sorted if u.get("access_level") == "sub+")
-    subscriber_count = sum(1 for u in users_sorted if u.get("access_level") == "subscriber")
-    active_today_count = sum(1 for u in users_sorted if int(u.get("today_generations", u.get("daily_count", 0)) or 0) > 0)
-
-    users_text = (
+    # Счётчики для шапки - за один проход по списку
+    admin_count = sub_plus_count = subscriber_count = active_today_count = 0
+    for u in users:
+        level = u.get("access_level")
+        if level == "admin":
+            admin_count += 1
+        elif level == "sub+":
+            sub_plus_count += 1
+        elif level == "subscriber":
+            subscriber_count += 1
+        if int(u.get("today_generations", u.get("daily_count", 0)) or 0) > 0:
+            active_today_count += 1
+
+    lines = [
         f"👥 Все пользователи (страница {page_num + 1}/{total_pages})\n\n"
         f"📊 Всего: {total_users} | Активны сегодня: {active_today_count}\n"
         f"👑 {admin_count} | 🚀 {sub_plus_count} | ⭐ {subscriber_count} | 👤 {total_users - admin_count - sub_plus_count - subscriber_count}\n\n"
-    )
+    ]
 
     for u in users_sorted[start_idx:end_idx]:
         icon = ADMIN_LEVEL_ICONS.get(u.get("access_level", "user"), "👤")
@@ -350,7 +720,7 @@ def _build_admin_users_page(users: List[Dict[str, Any]], page_num: int, page_siz
         limit = ADMIN_LEVEL_LIMITS.get(access_level, "3")
         last_seen = _format_admin_last_seen(u.get("last_seen"))
 
-        users_text += (
+        lines.append(
             f"{icon} {name}\n"
             f"`{uid}` | сегодня: {today}/{limit} | всего: {total}\n"
             f"был: {last_seen}\n\n"
@@ -374,61 +744,16 @@ def _build_admin_users_page(users: List[Dict[str, Any]], page_num: int, page_siz
     buttons.append(nav_row)
     buttons.append([{"text": "⬅️ К админке", "callback_data": "admin_home"}])
 
-    return users_text.strip(), buttons
+    return "".join(lines).strip(), buttons
 
 
 def _build_admin_panel() -> tuple[str, List[List[Dict[str, str]]]]:
     """Возвращает компактную админ-панель с inline-навигацией."""
-    text = (
-        "👑 *Админ панель*\n\n"
-        "Быстрые разделы открываются кнопками ниже.\n\n"
-        "Текстовые команды:\n"
-        "• `/admin user <id>` карточка пользователя\n"
-        "• `/admin set_level <id> <level>` выдать уровень\n"
-        "• `/admin remove_level <id>` снять уровень\n"
-        "• `/admin ban <id> <days|permanent>` бан\n"
-        "• `/admin unban <id>` разбан\n"
-        "• `/admin pay_confirm <id>` подтвердить оплату\n"
-        "• `/admin pay_decline <id>` отклонить оплату\n"
-        "• `/admin broadcast <текст>` рассылка\n"
-        "• `/admin maintenance HH:MM` техработы"
-    )
-    buttons = [
-        [
-            {"text": "👥 Пользователи", "callback_data": "admin_users"},
-            {"text": "📊 Статистика", "callback_data": "admin_stats_panel"},
-        ],
-        [
-            {"text": "📋 Audit Log", "callback_data": "admin_logs"},
-            {"text": "ℹ️ Команды", "callback_data": "admin_help"},
-        ],
-    ]
-    return text, buttons
+    return ADMIN_PANEL_TEXT, ADMIN_PANEL_BUTTONS
 
 
 def _build_admin_help_text() -> str:
-    return (
-        "ℹ️ *Команды админки*\n\n"
-        "Пользователи:\n"
-        "• `/admin users`\n"
-        "• `/admin user <id>`\n"
-        "• `/admin add_user <id>`\n"
-        "• `/admin remove_user <id>`\n"
-        "• `/admin set_level <id> <level>`\n"
-        "• `/admin remove_level <id>`\n\n"
-        "• `/admin ban <id> <days|permanent>`\n"
-        "• `/admin unban <id>`\n\n"
-        "Платежи:\n"
-        "• `/admin pay_confirm <id>`\n"
-        "• `/admin pay_decline <id>`\n"
-        "• `/admin reset_payment_limit <id>`\n\n"
-        "Сервис:\n"
-        "• `/admin stats`\n"
-        "• `/admin admin_stats`\n"
-        "• `/admin log [user_id] [limit]`\n"
-        "• `/admin maintenance HH:MM`\n"
-        "• `/admin maintenance_off`"
-    )
+    return ADMIN_HELP_TEXT
 
 
 def _build_admin_user_card(
@@ -500,62 +825,15 @@ def _build_admin_user_card(
 async def show_start_menu(chat_id: str):
     """Показывает стартовое меню с кнопками"""
     # Добавляем пользователя в базу
-    from backend.database.users_db import get_database
     db = get_database()
     db.add_or_update_user(chat_id)
 
-    buttons = [
-        [
-            {"text": "🤖 Выбрать модель", "callback_data": "menu_models"},
-            {"text": "🎨 Генерировать фото", "callback_data": "gen_photo"},
-        ],
-        [
-            {"text": "📸 Фото", "callback_data": "menu_photo"},
-            {"text": "🎤 Голос", "callback_data": "menu_voice"},
-        ],
-        [
-            {"text": "📊 Статистика", "callback_data": "stats"},
-            {"text": "📢 Подписаться", "url": "https://t.me/liranexus"},
-        ],
-        [
-            {"text": "ℹ️ Помощь", "callback_data": "help"},
-            {"text": "💬 Поддержка", "url": "https://t.me/suplira"},
-        ]
-    ]
-
-    welcome_text = """👋 Привет! Я LiraAI 🤖
-
-Я бесплатный AI-ассистент в Telegram.
-
-Что я умею:
-• 💬 отвечать на вопросы и помогать с текстом
-• 🎤 распознавать голосовые сообщения
-• 🔊 отправлять голосовой ответ
-• 📸 анализировать фотографии
-• 🎨 генерировать изображения через Z-Image
-
-🆓 Общение, голос и анализ фото доступны бесплатно.
-
-Доступные модели:
-• Groq: GPT-oss 20B, Llama 4 Maverick, Llama 4 Scout, Kimi K2
-• Cerebras: Llama 3.1 8B, GPT-oss 120B
-• OpenRouter: Gemma 3N
-
-Обо мне:
-Бота делает LiraDev.
-Новости и обновления: @liranexus
-Помощь : @suplira
-━━━━━━━━━━━━━━━━━━━━
-📱 Начни с выбора модели или просто отправь сообщение
-━━━━━━━━━━━━━━━━━━━━
-
-Выбери действие кнопками ниже 👇"""
-
-    await send_telegram_message_with_buttons(chat_id, welcome_text, buttons)
+    await send_telegram_message_with_buttons(chat_id, WELCOME_TEXT, START_MENU_KEYBOARD)
 
 
 async def get_updates(token: str, offset: int = 0, timeout: int = 30) -> Dict[str, Any]:
     """Получает обновления из Telegram для конкретного токена"""
+    global _poll_502_streak
     if not token:
         logger.error("Токен не передан")
         return []
@@ -567,55 +845,120 @@ async def get_updates(token: str, offset: int = 0, timeout: int = 30) -> Dict[st
         "allowed_updates": ["message", "callback_query", "channel_post"]
     }
     
+    # total=None: ожидание long poll не должно упираться в общий таймаут сессии,
+    # ограничиваем только чтение (timeout + запас) и установку соединения
+    poll_timeout = aiohttp.ClientTimeout(total=None, sock_read=timeout + 5, connect=10)
+
     try:
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=35)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get("ok"):
-                        return data.get("result", [])
-                    else:
-                        logger.error(f"Ошибка получения обновлений: {data}")
-                        return []
+        # Общая сессия из telegram_core: keep-alive соединение переживает цикл опроса
+        # (aiohttp сам отправляет Accept-Encoding: gzip и распаковывает ответ)
+        session = await get_session()
+        async with session.get(url, params=params, timeout=poll_timeout) as response:
+            if response.status == 200:
+                _poll_502_streak = 0
+                data = orjson.loads(await response.read())
+                if data.get("ok"):
+                    return data.get("result", [])
                 else:
-                    error = await response.text()
-                    # 502 Bad Gateway - временная ошибка, нужно повторить позже
-                    if response.status == 502:
-                        logger.warning(f"Telegram API 502 Bad Gateway (временная ошибка), повторю попытку...")
-                        # Не логируем как ERROR, это временная проблема
-                    else:
-                        logger.error(f"HTTP ошибка получения обновлений ({response.status}): {error}")
+                    logger.error("Ошибка получения обновлений: %s", data)
+                    return []
+            else:
+                error = await response.text()
+                # 502 Bad Gateway - временная ошибка, нужно повторить позже
+                if response.status == 502:
+                    _poll_502_streak += 1
+                    delay = min(2 ** _poll_502_streak, POLL_BACKOFF_MAX)
+                    logger.warning("Telegram API 502 Bad Gateway (временная ошибка), повторю попытку через %s сек...", delay)
+                    # Не логируем как ERROR, это временная проблема
+                else:
+                    logger.error("HTTP ошибка получения обновлений (%s): %s", response.status, error)
                     return []
+        # Пауза вне async with: соединение уже вернулось в пул
+        await asyncio.sleep(delay)
+        return []
     except Exception as e:
-        logger.error(f"Ошибка при получении обновлений: {e}")
+        logger.error("Ошибка при получении обновлений: %s", e)
         return []
 
 
+def _strip_generate_prefix(text: str) -> Optional[str]:
+    """Возвращает описание из команды /generate или /рисунок (None, если это не команда генерации)"""
+    for prefix in GENERATE_PREFIXES:
+        if text.startswith(prefix):
+            return text.removeprefix(prefix)
+    return None
+
+
+def _set_maintenance_state(enabled: bool, until_time: Optional[str] = None):
+    """Обновляет локальный статус тех.работ и заранее парсит время окончания"""
+    global _maintenance_checked_at
+    until_time_parsed = None
+    if until_time:
+        try:
+            # Время в формате HH:MM
+            until_time_parsed = datetime.strptime(until_time, "%H:%M").time()
+        except ValueError as e:
+            logger.error("Ошибка проверки времени тех.работ: %s", e)
+    maintenance_mode["enabled"] = enabled
+    maintenance_mode["until_time"] = until_time
+    maintenance_mode["until_time_parsed"] = until_time_parsed
+    _maintenance_checked_at = time.monotonic()
+
+
+async def _get_maintenance_mode(db) -> Dict[str, Any]:
+    """Возвращает статус тех.работ, перечитывая БД не чаще раза в MAINTENANCE_CACHE_TTL секунд"""
+    if _maintenance_checked_at is None or time.monotonic() - _maintenance_checked_at >= MAINTENANCE_CACHE_TTL:
+        maint_status = await run_db(db.get_maintenance_mode)
+        _set_maintenance_state(maint_status["enabled"], maint_status["until_time"])
+    return maintenance_mode
+
+
+async def get_bot_username(token: str) -> Optional[str]:
+    """Возвращает username бота (getMe запрашивается один раз на токен)"""
+    bot_username = _bot_username_cache.get(token)
+    if bot_username:
+        return bot_username
+
+    try:
+        # Получаем информацию о боте
+        bot_info_url = f"{TELEGRAM_API_URL}{token}/getMe"
+        session = await get_session()
+        async with session.get(bot_info_url) as response:
+            if response.status == 200:
+                bot_data = orjson.loads(await response.read())
+                if bot_data.get("ok"):
+                    bot_username = bot_data["result"].get("username")
+    except Exception as e:
+        logger.error("Ошибка получения информации о боте: %s", e)
+
+    if bot_username:
+        _bot_username_cache[token] = bot_username
+    return bot_username
+
+
 async def process_message(message: Dict[str, Any], bot_token: str):
     """Обрабатывает одно сообщения"""
     try:
         chat = message.get("chat", {})
         chat_id = str(chat.get("id"))
         chat_type = chat.get("type", "private")
-        user = message.get("from", {})
+        user = message.get("from") or {}
         user_id = str(user.get("id", ""))
         text = message.get("text", "")
         message_id = message.get("message_id")
-        from_user = message.get("from", {})
-        from_user_id = from_user.get("id")
 
         # Получаем данные пользователя из Telegram
         username = user.get("username", "")  # @username без @
         first_name = user.get("first_name", "")
         last_name = user.get("last_name", "")
 
-        logger.info(f"[{chat_type.upper()}] Получено сообщения от {user_id} в чате {chat_id}: {text[:50]}")
+        logger.info("[%s] Получено сообщения от %s в чате %s: %s", chat_type.upper(), user_id, chat_id, text[:50])
 
         # Добавляем/обновляем пользователя в базе с username
-        from backend.database.users_db import get_database
         db = get_database()
-        db.add_or_update_user(user_id, username=username, first_name=first_name, last_name=last_name)
+        # В поток уходим только когда данные реально надо записать
+        if not db.is_user_profile_fresh(user_id, username, first_name, last_name):
+            await run_db(db.add_or_update_user, user_id, username=username, first_name=first_name, last_name=last_name)
 
         # Алерт админам при попытке использовать админ-команды без прав
         if text.startswith("/admin") and not db.is_admin(user_id):
@@ -632,7 +975,7 @@ async def process_message(message: Dict[str, Any], bot_token: str):
 
         # Проверка активного бана
         if not db.is_admin(user_id):
-            ban_info = db.get_user_ban(user_id)
+            ban_info = await run_db(db.get_user_ban, user_id)
             if ban_info:
                 until_text = "навсегда" if ban_info.get("permanent") else _format_ban_status(ban_info)
                 await send_telegram_message(
@@ -643,27 +986,21 @@ async def process_message(message: Dict[str, Any], bot_token: str):
 
         # Проверяем режим тех.работ (только для приватных чатов)
         if chat_type == "private":
-            maint_status = db.get_maintenance_mode()
-            maintenance_mode["enabled"] = maint_status["enabled"]
-            maintenance_mode["until_time"] = maint_status["until_time"]
+            # Текущее время берём один раз на сообщение
+            now = datetime.now()
+            await _get_maintenance_mode(db)
 
             # Проверяем время окончания тех.работ
-            if maintenance_mode["enabled"] and maintenance_mode["until_time"]:
-                try:
+            until_time = maintenance_mode["until_time_parsed"]
+            if maintenance_mode["enabled"] and until_time is not None:
+                # Если время тех.работ уже прошло (сравниваем только время)
+                # Это означает, что тех.работы должны были закончиться сегодня
+                if now.time() > until_time:
+                    # Время вышло - выключаем тех.работы
                     until_str = maintenance_mode["until_time"]
-                    # Парсим время в формате HH:MM
-                    until_time = datetime.strptime(until_str, "%H:%M").time()
-                    now = datetime.now().time()
-                    
-                    # Если время тех.работ уже прошло (сравниваем только время)
-                    # Это означает, что тех.работы должны были закончиться сегодня
-                    if now > until_time:
-                        # Время вышло - выключаем тех.работы
-                        maintenance_mode["enabled"] = False
-                        db.set_maintenance_mode(False)
-                        logger.info(f"⚙️ Режим тех.работ автоматически выключен (время {until_str} прошло)")
-                except Exception as e:
-                    logger.error(f"Ошибка проверки времени тех.работ: {e}")
+                    _set_maintenance_state(False)
+                    await run_db(db.set_maintenance_mode, False)
+                    logger.info("⚙️ Режим тех.работ автоматически выключен (время %s прошло)", until_str)
             
             # Если тех.работы включены и пользователь не админ - блокируем
             if maintenance_mode["enabled"]:
@@ -710,7 +1047,7 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                                 parse_mode="Markdown"
                             )
                         except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление о бане {target_user_id}: {e}")
+                            logger.warning("⚠️ Не удалось отправить уведомление о бане %s: %s", target_user_id, e)
                         await send_telegram_message(chat_id, f"⛔ Пользователь {target_user_id} забанен навсегда.")
                     else:
                         await send_telegram_message(chat_id, f"❌ Не удалось забанить пользователя {target_user_id}.")
@@ -739,7 +1076,7 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                                 parse_mode="Markdown"
                             )
                         except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление о бане {target_user_id}: {e}")
+                            logger.warning("⚠️ Не удалось отправить уведомление о бане %s: %s", target_user_id, e)
                         await send_telegram_message(chat_id, f"⛔ Пользователь {target_user_id} забанен на {days} дн.")
                     else:
                         await send_telegram_message(chat_id, f"❌ Не удалось забанить пользователя {target_user_id}.")
@@ -760,7 +1097,7 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                 created_at = pending.get("created_at")
 
                 # Авто-сброс режима отправки через 5 минут
-                if created_at and (datetime.now() - created_at).total_seconds() > 300:
+                if created_at and (now - created_at).total_seconds() > 300:
                     del pending_admin_messages[user_id]
                     await send_telegram_message(chat_id, "⌛ Режим отправки сообщения истёк. Нажмите `✉️ Написать` ещё раз.", parse_mode="Markdown")
                     return
@@ -771,7 +1108,7 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                     return
 
                 # Не перехватываем команды и системные кнопки
-                if text.startswith("/") or text in BOT_MODES.values() or text == "◀️ Назад к меню":
+                if text.startswith("/") or text in _BUTTON_TO_MODE or text == "◀️ Назад к меню":
                     del pending_admin_messages[user_id]
                     # Продолжаем обычную обработку команды/кнопки ниже
                 else:
@@ -899,31 +1236,23 @@ async def process_message(message: Dict[str, Any], bot_token: str):
             try:
                 saved = save_group_id_to_env(chat_id)
                 if saved:
-                    logger.info(f"🎉 Новая группа обнаружена и сохранена: {chat_id}")
+                    logger.info("🎉 Новая группа обнаружена и сохранена: %s", chat_id)
             except Exception as e:
-                logger.error(f"Ошибка при сохранении ID группы: {e}")
+                logger.error("Ошибка при сохранении ID группы: %s", e)
             
             # Проверяем, является ли это группой для FeedbackBot
             is_feedback_group = (
                 feedback_bot_handler is not None and
                 config.FEEDBACK_BOT_ENABLED and
-                chat_id in config.FEEDBACK_BOT_GROUP_IDS
+                chat_id in _FEEDBACK_GROUPS
             )
             
             if is_feedback_group:
                 # В группах FeedbackBot обрабатываем ВСЕ текстовые сообщения
                 if text:
-                    # Извлекаем имя пользователя
-                    user_name = None
-                    if user:
-                        first_name = user.get("first_name", "")
-                        last_name = user.get("last_name", "")
-                        username = user.get("username", "")
-                        if first_name or last_name:
-                            user_name = f"{first_name} {last_name}".strip()
-                        elif username:
-                            user_name = f"@{username}"
-                    
+                    # Имя пользователя из уже извлечённых полей
+                    user_name = f"{first_name} {last_name}".strip() or (f"@{username}" if username else None)
+
                     await handle_feedback_bot_message(chat_id, user_id, text, is_group=True, user_name=user_name)
                     return
                 # Для фото в группах FeedbackBot - показываем кнопки выбора режима
@@ -931,11 +1260,10 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                     message_id = message.get("message_id")
                     if message_id:
                         # Сохраняем фото для последующей обработки
-                        from backend.api.telegram_photo_handler import save_pending_photo, send_photo_recognition_buttons
                         save_pending_photo(chat_id, message_id, message)
                         # Показываем кнопки выбора режима
                         await send_photo_recognition_buttons(chat_id, message_id)
-                        logger.info(f"[FeedbackBot] 📸 Показаны кнопки выбора режима для фото {message_id}")
+                        logger.info("[FeedbackBot] 📸 Показаны кнопки выбора режима для фото %s", message_id)
                     return
                 # Для голосовых в группах FeedbackBot - распознаем и передаем в FeedbackBot
                 if "voice" in message or "audio" in message:
@@ -944,24 +1272,16 @@ async def process_message(message: Dict[str, Any], bot_token: str):
             
             # Для остальных групп - стандартная логика (только упоминания)
             # В группах реагируем только на упоминания бота или команды
-            bot_username = None
-            try:
-                # Получаем информацию о боте
-                import aiohttp
-                bot_info_url = f"{TELEGRAM_API_URL}{bot_token}/getMe"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(bot_info_url) as response:
-                        if response.status == 200:
-                            bot_data = await response.json()
-                            if bot_data.get("ok"):
-                                bot_username = bot_data["result"].get("username")
-            except Exception as e:
-                logger.error(f"Ошибка получения информации о боте: {e}")
+            bot_username = await get_bot_username(bot_token)
             
-            # Проверяем упоминание
+            # Проверяем упоминание (позиция пригодится ниже, чтобы вырезать его без повторного поиска)
             is_mentioned = False
+            mention_token = ""
+            mention_idx = -1
             if bot_username:
-                is_mentioned = f"@{bot_username}" in text or text.startswith("/")
+                mention_token = f"@{bot_username}"
+                mention_idx = text.find(mention_token)
+                is_mentioned = mention_idx != -1 or text[:1] == "/"
             
             # Если бот не упомянут и это не команда - игнорируем
             if not is_mentioned and text:
@@ -969,14 +1289,14 @@ async def process_message(message: Dict[str, Any], bot_token: str):
             
             # Обрабатываем команды в группах
             if text:
-                if text.startswith("/generate ") or text.startswith("/рисунок "):
-                    prompt = text.replace("/generate ", "").replace("/рисунок ", "")
+                prompt = _strip_generate_prefix(text)
+                if prompt is not None:
                     await handle_image_generation(chat_id, user_id, prompt)
                     return
                 
                 # Убираем упоминание бота из текста
-                if bot_username and f"@{bot_username}" in text:
-                    text = text.replace(f"@{bot_username}", "").strip()
+                if mention_idx != -1:
+                    text = (text[:mention_idx] + text[mention_idx + len(mention_token):]).strip()
                 
                 if not text or not text.strip():
                     return
@@ -1025,70 +1345,37 @@ async def process_message(message: Dict[str, Any], bot_token: str):
             # Обработка текстового сообщения
             if text:
                 # Проверяем команды
-                if text == "/start":
-                    # Показываем стартовое меню
-                    await show_start_menu(chat_id)
-                    
-                    # Автоматически показываем главную клавиатуру через 0.5 сек
-                    await asyncio.sleep(0.5)
-                    keyboard = create_main_menu_keyboard()
-                    await send_telegram_message(
-                        chat_id,
-                        "📱 **Главное меню**\n\nВыберите режим работы:",
-                        reply_markup=keyboard,
-                        parse_mode="Markdown"
-                    )
-                    return
-
-                # Команда /menu - показать главную клавиатуру
-                if text == "/menu":
-                    keyboard = create_main_menu_keyboard()
-                    await send_telegram_message(
-                        chat_id,
-                        "📱 **Главное меню**\n\nВыберите режим работы:",
-                        reply_markup=keyboard,
-                        parse_mode="Markdown"
-                    )
-                    return
-
-                # Команда /hide - скрыть клавиатуру
-                if text == "/hide":
-                    keyboard = create_hide_keyboard()
-                    await send_telegram_message(
-                        chat_id,
-                        "⬇️ Клавиатура скрыта.\n\nИспользуйте /menu чтобы вернуть.",
-                        reply_markup=keyboard,
-                        parse_mode="Markdown"
-                    )
+                command_handler = COMMAND_HANDLERS.get(text)
+                if command_handler is not None:
+                    await command_handler(chat_id, user_id)
                     return
                 
                 # Обработка кнопки "Назад к меню" - ПЕРВАЯ ПРОВЕРКА (до обработки кнопок режимов)
                 if text == "◀️ Назад к меню":
                     user_selecting_model[user_id] = False
                     mode_manager.set_mode(user_id, "auto")
-                    keyboard = create_main_menu_keyboard()
+                    keyboard = MAIN_MENU_KEYBOARD
                     # Удаляем сообщения пользователя (нажатие кнопки)
                     if message_id:
                         await delete_telegram_message(chat_id, message_id)
                     await send_telegram_message(
                         chat_id,
-                        "📱 **Главное меню**\n\nВыберите режим работы:",
+                        MAIN_MENU_TEXT,
                         reply_markup=keyboard,
                         parse_mode="Markdown"
                     )
                     return
 
                 # Обработка нажатий на кнопки reply-клавиатуры
-                if text in BOT_MODES.values():
-                    mode = get_mode_from_button(text)
-
+                mode = _BUTTON_TO_MODE.get(text)
+                if mode is not None:
                     # Удаляем сообщения пользователя (нажатие кнопки)
                     if message_id:
                         await delete_telegram_message(chat_id, message_id)
 
                     # Обработка кнопки "Скрыть клавиатуру"
                     if mode == "hide":
-                        keyboard = create_hide_keyboard()
+                        keyboard = HIDE_KEYBOARD
                         await send_telegram_message(
                             chat_id,
                             "⬇️ Клавиатура скрыта.\n\nИспользуйте /menu чтобы вернуть.",
@@ -1100,7 +1387,7 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                     # Обработка кнопки "Выбрать модель"
                     if mode == "select_model":
                         user_selecting_model[user_id] = True
-                        keyboard = create_model_selection_keyboard()
+                        keyboard = MODEL_SELECTION_KEYBOARD
                         await send_telegram_message(
                             chat_id,
                             "🤖 **Выбор модели**\n\nВыберите модель на клавиатуре ниже.",
@@ -1167,8 +1454,6 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                     # Для режима stats - перенаправляем на команду /stats
                     if mode == "stats":
                         # Просто вызываем логику команды /stats
-                        from backend.database.users_db import get_database
-                        from backend.utils.formatters import format_stats_card, format_limit_info
                         db = get_database()
 
                         # Сохраняем запрос пользователя в историю
@@ -1188,9 +1473,9 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                             stats_text = format_stats_card(stats)
 
                             # Добавляем клавиатуру
-                            keyboard = create_main_menu_keyboard()
+                            keyboard = MAIN_MENU_KEYBOARD
 
-                            await send_telegram_message(chat_id, stats_text, reply_markup=keyboard, parse_mode="Markdown")
+                            await _send_queued(chat_id, stats_text, reply_markup=keyboard, parse_mode="Markdown")
 
                             # Сохраняем ответ бота в историю
                             db.save_dialog_message(user_id, "assistant", "Статистика показана", model="system")
@@ -1203,8 +1488,8 @@ async def process_message(message: Dict[str, Any], bot_token: str):
 
                     # Отправляем подсказку
                     prompt = get_mode_prompt(mode)
-                    keyboard = create_main_menu_keyboard()
-                    await send_telegram_message(
+                    keyboard = MAIN_MENU_KEYBOARD
+                    await _send_queued(
                         chat_id,
                         prompt,
                         reply_markup=keyboard,
@@ -1213,34 +1498,12 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                     return
 
                 # Обработка выбора модели (reply-кнопки)
-                if text in ["🧠 Groq GPT-oss 20B", "🦙 Groq Llama 4", "🔍 Groq Scout", "🌙 Groq Kimi K2",
-                           "⚡ Cerebras Llama 3.1", "🧠 Cerebras GPT-oss 120B", "☁️ OpenRouter Gemma 3N"]:
-
-                    model_map = {
-                        "🧠 Groq GPT-oss 20B": "groq-llama",
-                        "🦙 Groq Llama 4": "groq-maverick",
-                        "🔍 Groq Scout": "groq-scout",
-                        "🌙 Groq Kimi K2": "groq-kimi",
-                        "⚡ Cerebras Llama 3.1": "cerebras-llama",
-                        "🧠 Cerebras GPT-oss 120B": "cerebras-gpt",
-                        "☁️ OpenRouter Gemma 3N": "openrouter-gemma",
-                    }
-
-                    model_key = model_map.get(text)
+                if text in MODEL_BUTTON_KEYS:
+                    model_key = MODEL_BUTTON_KEYS.get(text)
                     if model_key:
                         # Переключаем модель
                         user_models[user_id] = model_key
 
-                        model_names = {
-                            "groq-llama": "🧠 GPT-oss 20B",
-                            "groq-maverick": "🦙 Llama 4 Maverick",
-                            "groq-scout": "🔍 Llama 4 Scout",
-                            "groq-kimi": "🌙 Kimi K2",
-                            "cerebras-llama": "⚡ Llama 3.1 8B (Cerebras)",
-                            "cerebras-gpt": "🧠 GPT-oss 120B (Cerebras)",
-                            "openrouter-gemma": "☁️ Gemma 3N (OpenRouter)"
-                        }
-
                         user_selecting_model[user_id] = False
 
                         # Сбрасываем режим в auto
@@ -1251,10 +1514,10 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                             await delete_telegram_message(chat_id, message_id)
 
                         # Возвращаем главную клавиатуру
-                        keyboard = create_main_menu_keyboard()
+                        keyboard = MAIN_MENU_KEYBOARD
                         await send_telegram_message(
                             chat_id,
-                            f"✅ Модель выбрана: **{model_names.get(model_key, model_key)}**\n\n"
+                            f"✅ Модель выбрана: **{SELECTED_MODEL_NAMES.get(model_key, model_key)}**\n\n"
                             f"Теперь я буду использовать эту модель для общения.\n\n"
                             f"Просто напишите сообщения — я отвечу! 👇",
                             reply_markup=keyboard,
@@ -1268,17 +1531,6 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                         # Переключаем модель - сохраняем КЛЮЧ, а не значение!
                         user_models[user_id] = model_key
 
-                        model_names = {
-                            "groq-llama": "🧠 GPT-oss 20B",
-                            "groq-maverick": "🦙 Llama 4 Maverick",
-                            "groq-scout": "🔍 Llama 4 Scout",
-                            "groq-kimi": "🌙 Kimi K2",
-                            "cerebras-llama": "⚡ Llama 3.1 8B (Cerebras)",
-                            "solar": "☀️ Solar Pro 3",
-                            "trinity": "🔱 Trinity Mini",
-                            "glm": "🤖 GLM-4.5"
-                        }
-
                         user_selecting_model[user_id] = False
 
                         # Сбрасываем режим в auto после выбора модели
@@ -1289,10 +1541,10 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                             await delete_telegram_message(chat_id, message_id)
 
                         # Возвращаем главную клавиатуру (не скрываем)
-                        keyboard = create_main_menu_keyboard()
+                        keyboard = MAIN_MENU_KEYBOARD
                         await send_telegram_message(
                             chat_id,
-                            f"✅ Модель выбрана: **{model_names.get(model_key, model_key)}**\n\n"
+                            f"✅ Модель выбрана: **{SELECTED_MODEL_NAMES.get(model_key, model_key)}**\n\n"
                             f"Теперь я буду использовать эту модель для общения.\n\n"
                             f"Просто напишите сообщения — я отвечу! 👇",
                             reply_markup=keyboard,
@@ -1309,43 +1561,9 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                         await delete_telegram_message(chat_id, message_id)
                     return
 
-                # Команда /cancel - отмена генерации
-                if text == "/cancel":
-                    if user_generating_photo.get(user_id, False):
-                        user_generating_photo[user_id] = False
-                        await send_telegram_message(chat_id, "❌ Генерация изображения отменена.")
-                    return
-                
-                # Команда /clear - очистка истории диалога
-                if text == "/clear":
-                    db = get_database()
-                    db.clear_dialog_history(user_id)
-                    await send_telegram_message(chat_id, "🗑️ История диалога очищена.\n\n/start - Главное меню")
-                    return
-                
-                # Команда /model - показать текущую модель
-                if text == "/model":
-                    current_model = user_models.get(user_id, "groq-llama")
-                    model_names = {
-                        "groq-llama": "🧠 Groq GPT-oss 20B",
-                        "groq-maverick": "🦙 Groq Llama 4",
-                        "groq-scout": "🔍 Groq Scout",
-                        "groq-kimi": "🌙 Groq Kimi K2",
-                        "cerebras-llama": "⚡ Cerebras Llama 3.1",
-                        "solar": "☀️ Solar",
-                        "trinity": "🔱 Trinity",
-                        "glm": "🤖 GLM-4.5"
-                    }
-                    await send_telegram_message(
-                        chat_id,
-                        f"🤖 **Ваша текущая модель:** {model_names.get(current_model, current_model)}\n\n"
-                        f"Используйте /menu → Выбрать модель чтобы сменить."
-                    )
-                    return
-                
                 # Команда /generate или /рисунок
-                if text.startswith("/generate ") or text.startswith("/рисунок "):
-                    prompt = text.replace("/generate ", "").replace("/рисунок ", "")
+                prompt = _strip_generate_prefix(text)
+                if prompt is not None:
                     await handle_image_generation(chat_id, user_id, prompt)
                     return
                 
@@ -1363,2340 +1581,2199 @@ async def process_message(message: Dict[str, Any], bot_token: str):
                     await handle_image_generation(chat_id, user_id, text, model_key)
                     return
                 
-                # Команда /models - показать выбор моделей
-                if text == "/models":
-                    buttons = [
-                        [
-                            {"text": "🧠 Groq GPT-oss 20B", "callback_data": "model_groq-llama"},
-                            {"text": "🦙 Groq Llama 4 Maverick", "callback_data": "model_groq-maverick"},
-                        ],
-                        [
-                            {"text": "🔍 Groq Llama 4 Scout", "callback_data": "model_groq-scout"},
-                            {"text": "🌙 Groq Kimi K2", "callback_data": "model_groq-kimi"},
-                        ],
-                        [
-                            {"text": "☁️ OpenRouter Gemma 3N", "callback_data": "model_openrouter-gemma"},
-                        ]
-                    ]
-                    current_model = user_models.get(user_id, "groq-scout")
-                    model_name = [k for k, v in AVAILABLE_MODELS.items() if k == current_model]
-                    model_name = model_name[0] if model_name else "groq-llama"
+                # Админ-команды: подкоманда ищется в ADMIN_HANDLERS, права уже проверены выше
+                if text.startswith("/admin"):
+                    admin_parts = text.split(maxsplit=2)
+                    if admin_parts[0] == "/admin" and len(admin_parts) > 1:
+                        admin_handler = ADMIN_HANDLERS.get(admin_parts[1])
+                        if admin_handler is not None:
+                            admin_args = admin_parts[2].rstrip() if len(admin_parts) > 2 else ""
+                            await admin_handler(db, chat_id, user_id, username, message_id, admin_args)
+                            return
 
-                    await send_telegram_message_with_buttons(
-                        chat_id,
-                        f"🔧 Выбор модели\n\nТекущая модель: {model_name}\n\nВыберите модель кнопками ниже.",
-                        buttons
-                    )
-                    return
-                
-                # Команда /help
-                if text == "/help":
-                    help_text = """📖 Помощь - LiraAI MultiAssistent
+                # Обычный ответ через LLM
+                await handle_text_message(chat_id, user_id, text, is_group=False)
 
-Команды:
-• /start - Показать главное меню
-• /models - Выбор модели для общения
-• /generate [описание] - Генерировать изображение
-• /рисунок [описание] - Генерировать изображение (рус)
-• /clear - Очистить историю диалога
-• /cancel - Отменить генерацию изображения
-
-Возможности:
-• 💬 Общение на русском языке с памятью
-• 🎨 Генерация изображений
-• 🎤 Распознавание голоса
-• 📸 Анализ фотографий
-
-Модели (все БЕСПЛАТНЫЕ!):
-🚀 Groq (очень быстрые):
-• GPT-oss 20B - стабильная новая базовая
-• Llama 4 Maverick - новейшая от Meta
-• Llama 4 Scout - легкая и быстрая
-• Kimi K2 - от Moonshot AI
-
-☁️ OpenRouter:
-• Solar Pro 3 - быстрая, качественная
-• Trinity Mini - мультимодальная
-• GLM-4.5 - полностью бесплатная
-
-Бот запоминает последние 10 сообщенияй вашего диалога!
-
-Просто отправьте сообщения или выберите команду в меню!"""
-                    await send_telegram_message(chat_id, help_text)
-                    return
-
-                # Команда /admin - админ панель
-                if text == "/admin":
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    is_admin_user = db.is_admin(user_id)
-                    logger.info(f"🔐 Проверка админа {user_id}: {is_admin_user}")
-                    
-                    if not is_admin_user:
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
-
-                    admin_text, admin_buttons = _build_admin_panel()
-                    await send_telegram_message_with_buttons(chat_id, admin_text, admin_buttons)
-                    return
-
-                if text.startswith("/admin user "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
-
-                    target_user_id = text.replace("/admin user ", "").strip()
-                    if not target_user_id:
-                        await send_telegram_message(chat_id, "❌ Использование: /admin user <user_id>")
-                        return
-
-                    user_card, buttons = _build_admin_user_card(db, target_user_id, page_num=0)
-                    await send_telegram_message_with_buttons(chat_id, user_card, buttons)
-                    return
-
-                if text.startswith("/admin ban "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
-
-                    parts = text.replace("/admin ban ", "").strip().split()
-                    if len(parts) != 2:
-                        await send_telegram_message(chat_id, "❌ Использование: /admin ban <user_id> <days|permanent>")
-                        return
-
-                    target_user_id, duration_raw = parts
-                    if not target_user_id.isdigit():
-                        await send_telegram_message(chat_id, "❌ user_id должен быть числом")
-                        return
-
-                    if duration_raw.lower() in {"perm", "permanent", "навсегда"}:
-                        success = db.set_user_ban(target_user_id, banned_by=user_id, days=None, reason="admin_command")
-                        new_value = "permanent"
-                    elif duration_raw.isdigit() and int(duration_raw) > 0:
-                        days = int(duration_raw)
-                        success = db.set_user_ban(target_user_id, banned_by=user_id, days=days, reason="admin_command")
-                        new_value = f"{days}_days"
-                    else:
-                        await send_telegram_message(chat_id, "❌ Укажите число дней или `permanent`", parse_mode="Markdown")
-                        return
-
-                    if success:
-                        db.log_admin_action(
-                            admin_user_id=user_id,
-                            admin_username=username,
-                            action_type="ban_user",
-                            target_user_id=target_user_id,
-                            new_value=new_value,
-                            details={"admin_command": True},
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            success=True
-                        )
-                        try:
-                            if new_value == "permanent":
-                                await send_telegram_message(target_user_id, "⛔ **Вы заблокированы в боте навсегда.**", parse_mode="Markdown")
-                            else:
-                                await send_telegram_message(target_user_id, f"⛔ **Вы заблокированы в боте на {days} дн.**", parse_mode="Markdown")
-                        except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление о бане {target_user_id}: {e}")
-                        await send_telegram_message(chat_id, f"⛔ Бан выдан пользователю {target_user_id}: {new_value}")
-                    else:
-                        await send_telegram_message(chat_id, f"❌ Не удалось выдать бан пользователю {target_user_id}")
-                    return
-
-                if text.startswith("/admin unban "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
-
-                    target_user_id = text.replace("/admin unban ", "").strip()
-                    if not target_user_id.isdigit():
-                        await send_telegram_message(chat_id, "❌ Использование: /admin unban <user_id>")
-                        return
-
-                    success = db.remove_user_ban(target_user_id)
-                    if success:
-                        db.log_admin_action(
-                            admin_user_id=user_id,
-                            admin_username=username,
-                            action_type="unban_user",
-                            target_user_id=target_user_id,
-                            details={"admin_command": True},
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            success=True
-                        )
-                        try:
-                            await send_telegram_message(target_user_id, "✅ **Блокировка в боте снята.**", parse_mode="Markdown")
-                        except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление о разбане {target_user_id}: {e}")
-                        await send_telegram_message(chat_id, f"✅ Бан снят с пользователя {target_user_id}")
-                    else:
-                        await send_telegram_message(chat_id, f"❌ Не удалось снять бан с пользователя {target_user_id}")
-                    return
-
-                # Команда /stats - статистика пользователя
-                if text == "/stats":
-                    from backend.database.users_db import get_database
-                    from backend.utils.formatters import format_stats_card, format_limit_info
-                    db = get_database()
-
-                    # Принудительно обновляем данные пользователя из БД
-                    stats = db.get_user_stats(user_id)
-
-                    if stats:
-                        # Получаем информацию о лимитах
-                        limit_info = db.check_generation_limit(user_id)
-
-                        # Добавляем лимиты в stats для форматирования
-                        stats['daily_limit'] = limit_info.get('daily_limit', 3)
-
-                        # Формируем красивую карточку статистики
-                        stats_text = format_stats_card(stats)
-
-                        # Добавляем кнопку (используем глобальный импорт)
-                        keyboard = create_main_menu_keyboard()
-
-                        await send_telegram_message(chat_id, stats_text, reply_markup=keyboard, parse_mode="Markdown")
-                    else:
-                        await send_telegram_message(chat_id, "❌ Не удалось получить статистику")
-                    return
-
-                # Админ команда: maintenance - включить тех.работы
-                if text.startswith("/admin maintenance "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
-
-                    # Парсим время: /admin maintenance HH:MM
-                    until_time = text.replace("/admin maintenance ", "").strip()
+    except Exception as e:
+        logger.error("Ошибка при обработке сообщения: %s", e)
+        logger.error("Трассировка: %s", traceback.format_exc())
 
-                    # Проверяем формат времени
-                    import re
-                    if not re.match(r"^\d{2}:\d{2}$", until_time):
-                        await send_telegram_message(chat_id, "❌ Неверный формат времени.\n\nИспользуйте формат HH:MM (например, 17:00)")
-                        return
 
-                    # Включаем тех.работы
-                    db.set_maintenance_mode(True, until_time)
-                    maintenance_mode["enabled"] = True
-                    maintenance_mode["until_time"] = until_time
 
-                    await send_telegram_message(
-                        chat_id,
-                        f"✅ **Режим тех.работ включён**\n\nДо: {until_time}\n\nВсе пользователи (кроме админов) будут получать уведомление."
-                    )
-                    return  # FIX: Added return to prevent duplicate response
 
-                # Админ команда: maintenance_off - выключить тех.работы
-                if text == "/admin maintenance_off":
-                    from backend.database.users_db import get_database
-                    db = get_database()
+async def handle_feedback_bot_message(chat_id: str, user_id: str, text: str, is_group: bool = False, user_name: Optional[str] = None):
+    """О������рабатывает сообщения через FeedbackBotHandler"""
+    try:
+        if not text or not text.strip():
+            logger.debug("[FeedbackBot] Пустое сообщения от %s, пропускаю", user_id)
+            return
+        
+        # Формир��ем имя пользователя для отображения
+        display_name = user_name if user_name else f"Пользователь {user_id}"
+        logger.info("[FeedbackBot] 📨 Получено текстовое сообщения от %s (%s) в группе %s: %s символов", display_name, user_id, chat_id, len(text))
+        
+        if feedback_bot_handler is None:
+            logger.warning("[FeedbackBot] ❌ FeedbackBotHandler не инициализирован")
+            return
+        
+        # Получаем или создаем историю диалога для этой группы
+        history = feedback_chat_history.get(chat_id)
+        if history is None:
+            history = feedback_chat_history[chat_id] = deque(maxlen=FEEDBACK_HISTORY_MAXLEN)
+            logger.info("[FeedbackBot] Создана новая история для группы %s", chat_id)
+        
+        logger.debug("[FeedbackBot] История диалога: %s сообщенияй", len(history))
+        
+        # Формируем историю в формате для LLM (с именами пользователей)
+        # В истории уже только role/content; снимок нужен, т.к. deque пополняется после ответа
+        chat_history = list(history)
+        
+        logger.debug("[FeedbackBot] Передаю в LLM историю: %s сообщенияй", len(chat_history))
+        
+        # Формируем сообщения с именем пользователя для LLM
+        user_message_with_name = f"{display_name}: {text}" if user_name else text
+        
+        # Запускаем постоянное обновление статуса "печатает"
+        typing_task = asyncio.create_task(_keep_typing_status(chat_id))
+        logger.info("[FeedbackBot] ⌨️ Запущено постоянное обновление статуса 'печатает' для чата %s", chat_id)
+        
+        try:
+            # Обрабатываем запрос
+            logger.info("[FeedbackBot] 🤖 Отправляю запрос в FeedbackBotHandler...")
+            response = await feedback_bot_handler.process_feedback_query(
+                user_message=user_message_with_name,
+                chat_history=chat_history or None
+            )
+            logger.info("[FeedbackBot] ✅ Получен ответ от FeedbackBot: %s символов", len(response))
+        finally:
+            # Останавливаем обновление статуса как только ответ готов
+            typing_task.cancel()
+            try:
+                await typing_task
+            except asyncio.CancelledError:
+                pass
+            logger.info("[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата %s", chat_id)
+        
+        # Сохраняем сообщения пользователя в историю (с именем)
+        history.append({
+            "role": "user",
+            "content": f"{display_name}: {text}" if user_name else text
+        })
+        
+        # Сохраняем ответ бота в историю
+        history.append({
+            "role": "assistant",
+            "content": response
+        })
+        
+        logger.info("[FeedbackBot] 💾 Сохранено в историю: %s сообщенияй", len(history))
+        
+        # Отправляем ответ
+        logger.info("[FeedbackBot] 📤 Отправляю ответ в группу %s...", chat_id)
+        # Очищаем ответ от markdown-разметки для чистого отображения
+        clean_response = _clean_markdown_formatting(response)
+        await send_telegram_message(chat_id, clean_response)
+        logger.info("[FeedbackBot] ✅ Обработка сообщения завершена успешно")
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+    except Exception as e:
+        logger.error("[FeedbackBot] ❌ Ошибка при обработке сообщения: %s", e, exc_info=True)
+        await send_telegram_message(chat_id, "Извините, произошла ошибка при обработке вашего сообщения.")
 
-                    # Выключаем тех.работы
-                    db.set_maintenance_mode(False)
-                    maintenance_mode["enabled"] = False
-                    maintenance_mode["until_time"] = None
 
-                    # Отправляем уведомление всем пользователям
-                    user_ids = db.get_all_users_for_notification()
-                    notified = 0
-                    for uid in user_ids:
-                        try:
-                            await send_telegram_message(
-                                uid,
-                                "✅ **Технические работы завершены**\n\nБот снова доступен в полном режиме.\n\nСпасибо за ожидание!"
-                            )
-                            notified += 1
-                        except Exception:
-                            pass  # Игнорируем ошибки (пользователь мог заблокировать бота)
+async def _keep_typing_status(chat_id: str):
+    """Периодически обновляет статус 'печатает' каждые 4 секунды"""
+    try:
+        while True:
+            await send_chat_action(chat_id, "typing")
+            logger.debug("[FeedbackBot] ⌨️ Обновлен статус 'печатает' в чат %s", chat_id)
+            await asyncio.sleep(4)  # Обновляем каждые 4 секунды
+            
+    except asyncio.CancelledError:
+        logger.debug("[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата %s", chat_id)
+        raise
+    except Exception as e:
+        logger.error("[FeedbackBot] ❌ Ошибка обновления статуса 'печатает': %s", e)
 
-                    await send_telegram_message(
-                        chat_id,
-                        f"✅ **Режим тех.работ выключен**\n\nУведомлено пользователей: {notified}"
-                    )
-                    return
 
-                # Админ команда: remove_level
-                if text.startswith("/admin remove_level "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+async def handle_feedback_bot_photo(chat_id: str, user_id: str, message: Dict[str, Any]):
+    """Обрабатывает фото в FeedbackBot группе - анализирует и передает в FeedbackBot"""
+    try:
+        if feedback_bot_handler is None:
+            logger.warning("FeedbackBotHandler не инициализирован")
+            return
+        
+        # Получаем список фотографий (разные размеры)
+        photos = message.get("photo", [])
+        if not photos:
+            logger.warning("Сообщения не содержит фотографий: %s", message)
+            return
+        
+        # Берем самую большую фотографию (последнюю в списке)
+        photo = photos[-1]
+        file_id = photo.get("file_id")
+        
+        if not file_id:
+            logger.warning("Не удалось получить file_id фотографии: %s", photo)
+            return
+        
+        # Извлекаем имя пользователя
+        user = message.get("from", {})
+        user_name = None
+        if user:
+            first_name = user.get("first_name", "")
+            last_name = user.get("last_name", "")
+            username = user.get("username", "")
+            if first_name or last_name:
+                user_name = f"{first_name} {last_name}".strip()
+            elif username:
+                user_name = f"@{username}"
+        
+        display_name = user_name if user_name else f"Пользователь {user_id}"
+        logger.info("[FeedbackBot] 📸 Получено фото от %s (%s) в группе %s, file_id: %s", display_name, user_id, chat_id, file_id)
+        
+        # Отправляем сообщения о начале ������бработки
+        logger.info("[FeedbackBot] Отправляю уведомление о начале анализа изображения")
+        await send_telegram_message(chat_id, "🔍 Анализирую изображение...")
+        
+        # Скачиваем фото
+        logger.info("[FeedbackBot] Скачиваю фото %s...", file_id)
+        # Уникальное имя: одновременные фото из разных групп не перезаписывают друг друга
+        local_path = temp_dir / f"feedback_photo_{uuid.uuid4().hex}.jpg"
+        downloaded_path = await download_telegram_file(file_id, local_path)
+        
+        if not downloaded_path:
+            logger.error("[FeedbackBot] ❌ Не удалось скачать фото: %s", file_id)
+            await send_telegram_message(chat_id, "❌ Не удалось скачать фот�� для анализа.")
+            return
+        
+        logger.info("[FeedbackBot] ✅ Фото скачано: %s", downloaded_path)
+        
+        # Ана��изируем изображение через мультимодальную модель
+        logger.info("[FeedbackBot] 🔍 Начинаю анализ изображения через мультимодальную модель...")
+        analyzer = ImageAnalyzer(config)
+        
+        # Промпт для анализа изображения (из IKAR-ASSISTANT)
+        prompt = "Что на этом изображении? Опиши подробно, но кратко. Используй русский язык."
+        logger.debug("[FeedbackBot] Промпт для анализа: %s", prompt)
+        
+        try:
+            description = await analyzer.analyze_image(downloaded_path, prompt)
+        finally:
+            # Удаляем временный файл в потоке, чтобы не блокировать цикл событий
+            try:
+                await asyncio.to_thread(Path(downloaded_path).unlink, missing_ok=True)
+            except Exception as e:
+                logger.error("Ошибка при удалении временного файла: %s", e)
+        logger.info("[FeedbackBot] ✅ Изображение проанализиров��но: %s символов описания", len(description))
+        
+        if not description:
+            logger.error("Не удалось проанализировать изображение: %s", file_id)
+            await send_telegram_message(chat_id, "❌ Не удалось проанализировать изображение.")
+            return
+        
+        # Извлекаем имя пользователя
+        user = message.get("from", {})
+        user_name = None
+        if user:
+            first_name = user.get("first_name", "")
+            last_name = user.get("last_name", "")
+            username = user.get("username", "")
+            if first_name or last_name:
+                user_name = f"{first_name} {last_name}".strip()
+            elif username:
+                user_name = f"@{username}"
+        
+        display_name = user_name if user_name else f"Пользователь {user_id}"
+        
+        # Формируем сообщения для FeedbackBot с описанием изображения
+        # Просто передаем описание, без лишних инструкций - бот сам определит что делать
+        user_message = f"{display_name} отправил изображение. Описание: {description}" if user_name else f"Пользователь отправил изображение. Описание: {description}"
+        logger.info("[FeedbackBot] 📝 Формирую запрос для FeedbackBot: %s символов", len(user_message))
+        
+        # Получаем или создаем историю диалога для этой группы
+        history = feedback_chat_history.get(chat_id)
+        if history is None:
+            history = feedback_chat_history[chat_id] = deque(maxlen=FEEDBACK_HISTORY_MAXLEN)
+            logger.info("[FeedbackBot] Создана новая история для группы %s", chat_id)
+        
+        logger.info("[FeedbackBot] История диалога: %s сообщенияй", len(history))
+        
+        # Формируем историю в формате для LLM
+        # В истории уже только role/content; снимок нужен, т.к. deque пополняется после ответа
+        chat_history = list(history)
+        
+        logger.debug("[FeedbackBot] Передаю в LLM историю: %s сообщенияй", len(chat_history))
+        
+        # Запускаем постоянное обновление статуса "печатает"
+        typing_task = asyncio.create_task(_keep_typing_status(chat_id))
+        logger.info("[FeedbackBot] ⌨️ Запущено постоянное обновление статуса 'печатает' для чата %s", chat_id)
+        
+        try:
+            # Обрабатываем запрос через FeedbackBot
+            logger.info("[FeedbackBot] 🤖 Отправляю запрос в FeedbackBotHandler...")
+            response = await feedback_bot_handler.process_feedback_query(
+                user_message=user_message,
+                chat_history=chat_history or None
+            )
+            logger.info("[FeedbackBot] ✅ Получен ответ от FeedbackBot: %s символов", len(response))
+        finally:
+            # Останавливаем обновление статуса как только ответ готов
+            typing_task.cancel()
+            try:
+                await typing_task
+            except asyncio.CancelledError:
+                pass
+            logger.info("[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата %s", chat_id)
+        
+        # Сохраняем в историю (с именем)
+        history.append({
+            "role": "user",
+            "content": f"{display_name} [Изображение]: {description}" if user_name else f"[Изображение] {description}"
+        })
+        
+        history.append({
+            "role": "assistant",
+            "content": response
+        })
+        
+        logger.info("[FeedbackBot] 💾 Сохранено в историю: %s сообщенияй", len(history))
+        
+        # Отправляем ответ
+        logger.info("[FeedbackBot] 📤 Отправляю ответ в группу %s...", chat_id)
+        # Очищаем ответ от markdown-разметки для чистого отображения
+        clean_response = _clean_markdown_formatting(response)
+        await send_telegram_message(chat_id, clean_response)
+        logger.info("[FeedbackBot] ✅ Обработка фото завершена успешно")
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+    except Exception as e:
+        logger.error("Ошибка при обработке фото FeedbackBot: %s", e)
+        await send_telegram_message(chat_id, "Извините, произошла ошибка при обработке изображения.")
 
-                    # Парсим команду: /admin remove_level user_id
-                    target_user_id = text.replace("/admin remove_level ", "").strip()
 
-                    if not target_user_id or not target_user_id.isdigit():
-                        await send_telegram_message(chat_id, "❌ Использование: /admin remove_level [user_id]")
-                        return
+async def handle_feedback_bot_voice(chat_id: str, user_id: str, message: Dict[str, Any]):
+    """Обрабатывает голосовое сообщения в FeedbackBot группе - распознает и передает в FeedbackBot"""
+    try:
+        if feedback_bot_handler is None:
+            logger.warning("FeedbackBotHandler не инициализирован")
+            return
+        
+        # Получаем голосовое сообщения или аудио
+        voice = message.get("voice") or message.get("audio")
+        if not voice:
+            logger.warning("Сообщения не содержит голосового сообщения: %s", message)
+            return
+        
+        file_id = voice.get("file_id")
+        if not file_id:
+            logger.warning("Не удалось получить file_id голосового сообщения: %s", voice)
+            return
+        
+        logger.info("[FeedbackBot] 🎤 Получено голосовое сообщения от %s в группе %s, file_id: %s", user_id, chat_id, file_id)
+        
+        # Отправляем сообщения о начале обработки
+        await send_telegram_message(chat_id, "🎤 Распознаю речь...")
+        
+        # Скачиваем аудиофайл
+        temp_dir = Path(__file__).parent.parent.parent / "temp"
+        temp_dir.mkdir(exist_ok=True)
+        local_path = temp_dir / f"feedback_voice_{uuid.uuid4().hex}.ogg"
+        downloaded_path = await download_telegram_file(file_id, local_path)
+        
+        if not downloaded_path:
+            logger.error("[FeedbackBot] ❌ Не удалось скачать голосовое сообщения: %s", file_id)
+            await send_telegram_message(chat_id, "❌ Не удалось скачать голосовое сообщения.")
+            return
+        
+        logger.info("[FeedbackBot] ✅ Голосовое сообщения скачано: %s", downloaded_path)
+        
+        # Распознаем речь через STT
+        logger.info("[FeedbackBot] 🎙️ Начинаю распознавание речи...")
+        stt = SpeechToText()
+        try:
+            recognized_text = await stt.speech_to_text(downloaded_path, language="ru")
+        finally:
+            # Удаляем временный файл даже если распознавание завершилось ошибкой
+            Path(downloaded_path).unlink(missing_ok=True)
+        
+        if not recognized_text or not recognized_text.strip():
+            logger.error("[FeedbackBot] ❌ Не удалось распознать речь: %s", file_id)
+            await send_telegram_message(chat_id, "❌ Не удалось распознать речь.")
+            return
+        
+        logger.info("[FeedbackBot] ✅ Речь распознана: %s символов", len(recognized_text))
+        
+        # Получаем или создаем историю диалога для этой группы
+        history = feedback_chat_history.get(chat_id)
+        if history is None:
+            history = feedback_chat_history[chat_id] = deque(maxlen=FEEDBACK_HISTORY_MAXLEN)
+            logger.info("[FeedbackBot] Создана новая история для группы %s", chat_id)
+        
+        logger.info("[FeedbackBot] История диалога: %s сообщенияй", len(history))
+        
+        # Формируем и��торию в формате для LLM
+        # В истории уже только role/content; снимок нужен, т.к. deque пополняется после ответа
+        chat_history = list(history)
+        
+        logger.debug("[FeedbackBot] Передаю в LLM историю: %s сообщенияй", len(chat_history))
+        
+        # Извлекаем имя пользователя
+        user = message.get("from", {})
+        user_name = None
+        if user:
+            first_name = user.get("first_name", "")
+            last_name = user.get("last_name", "")
+            username = user.get("username", "")
+            if first_name or last_name:
+                user_name = f"{first_name} {last_name}".strip()
+            elif username:
+                user_name = f"@{username}"
+        display_name = user_name if user_name else f"Пользователь {user_id}"
 
-                    # Получаем текущий уровень
-                    old_level = db.get_user_access_level(target_user_id)
-
-                    # Добавляем пользователя если не существует
-                    db.add_or_update_user(target_user_id)
-
-                    success = db.set_user_access_level(target_user_id, "user")
-                    
-                    # Логируем действие администратора
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="remove_level",
-                        target_user_id=target_user_id,
-                        old_value=old_level,
-                        new_value="user",
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=success
-                    )
+        # Формируем сообщения с именем пользователя для LLM
+        user_message_with_name = f"{display_name} [Голосовое]: {recognized_text}" if user_name else f"[Голосовое] {recognized_text}"
+        
+        # Запускаем постоянное обновление статуса "печатает"
+        typing_task = asyncio.create_task(_keep_typing_status(chat_id))
+        logger.info("[FeedbackBot] ⌨️ Запущено постоянное обновление статуса 'печатает' для чата %s", chat_id)
+        
+        try:
+            # Обрабатываем запрос через FeedbackBot
+            logger.info("[FeedbackBot] 🤖 Отправляю распознанный текст в FeedbackBotHandler...")
+            response = await feedback_bot_handler.process_feedback_query(
+                user_message=user_message_with_name,
+                chat_history=chat_history or None
+            )
+            logger.info("[FeedbackBot] ✅ Получен ответ от FeedbackBot: %s символо��", len(response))
+        finally:
+            # Останавливаем обновление статуса как только ответ готов
+            typing_task.cancel()
+            try:
+                await typing_task
+            except asyncio.CancelledError:
+                pass
+            logger.info("[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата %s", chat_id)
+        
+        # Сохраняем в историю (с именем)
+        history.append({
+            "role": "user",
+            "content": f"{display_name} [Голосовое]: {recognized_text}" if user_name else f"[Голосовое] {recognized_text}"
+        })
+        
+        history.append({
+            "role": "assistant",
+            "content": response
+        })
+        
+        logger.info("[FeedbackBot] 💾 Сохранено в историю: %s сообщенияй", len(history))
+        
+        # Отправляем ответ
+        logger.info("[FeedbackBot] 📤 Отправляю ответ в группу %s...", chat_id)
+        # Очищаем ответ от markdown-разметки для чистого отображения
+        clean_response = _clean_markdown_formatting(response)
+        await send_telegram_message(chat_id, clean_response)
+        logger.info("[FeedbackBot] ✅ Обработка голосового сообщения завершена успешно")
+        
+    except Exception as e:
+        logger.error("[FeedbackBot] ❌ Ошибка при обработке голосового сообщения: %s", e, exc_info=True)
+        await send_telegram_message(chat_id, "Извините, произошла ошибка при обработке голосового сообщения.")
 
-                    if success:
-                        await send_telegram_message(chat_id, f"✅ Уровень доступа снят\n\nПользователь: {target_user_id}\nБыло: {old_level}\nСтало: 👤 Пользователь (3 в день)")
 
-                        # Отправляем уведомление пользователю
-                        try:
-                            await send_telegram_message(target_user_id, f"👤 Ваш уровень доступа изменен.\n\nБыло: {old_level}\nСтало: 3 генерации в день.\n\nСпасибо за использование LiraAI MultiAssistent!")
-                        except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {target_user_id}: {e}")
-                    else:
-                        await send_telegram_message(chat_id, "❌ Ошибка при снятии уровня")
-                    return
+async def handle_text_message(chat_id: str, user_id: str, text: str, is_group: bool = False):
+    """Обрабатывает текстовое сообщения через LLM с учётом режима пользователя"""
+    try:
+        if not text or not text.strip():
+            return
 
-                # Админ команда: set_level
-                if text.startswith("/admin set_level "):
-                    from backend.database.users_db import get_database, ACCESS_LEVELS
-                    db = get_database()
+        # Добавляем пользователя в базу
+        db = get_database()
+        db.add_or_update_user(user_id)
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+        # Получаем режим пользователя
+        mode = mode_manager.get_mode(user_id)
+        logger.info("📊 Пользователь %s в режиме: %s", user_id, mode)
 
-                    # Парсим команду: /admin set_level user_id level
-                    parts = text.replace("/admin set_level ", "").strip().split()
-                    logger.info(f"🔧 Admin command: {text}, parts: {parts}, len: {len(parts)}")
+        # Обработка в зависимости от режима
+        if mode == "privacy":
+            # Политика конфиденциальности
+            privacy_url = "https://telegra.ph/Politika-konfidencialnosti-obshchij-dokument-03-01"
+            privacy_text = f"""🔒 **Политика конфиденциальности**
 
-                    if len(parts) != 2:
-                        await send_telegram_message(chat_id, f"❌ Использование: /admin set_level [user_id] [level]\n\nПример:\n/admin set_level 123456789 subscriber")
-                        return
+Мы заботимся о вашей конфиденциальности.
 
-                    target_user_id = parts[0]
-                    new_level = parts[1]
+📄 Полный текст политики конфиденциальности доступен по ссылке:
+{privacy_url}
 
-                    logger.info(f"🔧 Set level: {target_user_id} -> {new_level}")
+**Кратко:**
+• Мы храним только историю диалогов для улучшения качества общения
+• Ваши данные не передаются третьим лицам
+• Вы можете запросить удаление ваших данных через администратора
 
-                    if new_level not in ACCESS_LEVELS:
-                        await send_telegram_message(chat_id, f"❌ Недопустимый уровень. Доступные: {', '.join(ACCESS_LEVELS.keys())}")
-                        return
+Нажимая кнопку «🔒 Политика конфиденциальности», вы подтверждаете, что ознакомились с документом."""
 
-                    # Получаем текущий уровень
-                    old_level = db.get_user_access_level(target_user_id)
-
-                    # Добавляем пользователя если не существует
-                    db.add_or_update_user(target_user_id)
-
-                    success = db.set_user_access_level(target_user_id, new_level)
-                    
-                    # Логируем действие администратора
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="set_level",
-                        target_user_id=target_user_id,
-                        old_value=old_level,
-                        new_value=new_level,
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=success
-                    )
+            # Отправляем с кнопкой-ссылкой
+            buttons = [
+                [{"text": "📄 Открыть документ", "url": privacy_url}]
+            ]
+            await send_telegram_message_with_buttons(chat_id, privacy_text, buttons)
+            return
 
-                    if success:
-                        level_names = {"admin": "👑 Админ", "subscriber": "⭐ Подписчик", "user": "👤 Пользователь"}
-                        await send_telegram_message(chat_id, f"✅ Уровень доступа изменен\n\nПользователь: {target_user_id}\nБыло: {level_names.get(old_level, old_level)}\nСтало: {level_names.get(new_level, new_level)}")
-
-                        # Отправляем уведомление пользователю
-                        level_messages = {
-                            "admin": "🎉 Поздравляем! Вам предоставлены права администратора.\n\nТеперь у вас безлимитная генерация изображений!\n\nИспользуйте /admin для управления ботом.",
-                            "subscriber": "⭐ Ваш уровень доступа повышен!\n\nТеперь у вас 5 генераций изображений в день.\n\nСпасибо за использование LiraAI MultiAssistent!",
-                            "user": "👤 Ваш уровень доступа изменен.\n\nТеперь у вас 3 генерации изображений в день.\n\nСпасибо за использование LiraAI MultiAssistent!"
-                        }
-                        try:
-                            await send_telegram_message(target_user_id, level_messages.get(new_level, f"Ваш уровень доступа изменен на {new_level}"))
-                        except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {target_user_id}: {e}")
-                    else:
-                        await send_telegram_message(chat_id, "❌ Ошибка при установке уровня")
-                    return
+        if mode == "help":
+            # В режиме помощи показываем справку
+            db = get_database()
+            
+            # Сохраняем запрос пользователя в историю
+            db.save_dialog_message(user_id, "user", "❓ Помощь", model="system")
+            
+            await send_telegram_message(chat_id, MODE_HELP_TEXT)
+            
+            # Сохраняем ответ бота в историю
+            db.save_dialog_message(user_id, "assistant", "Помощь показана", model="system")
+            return
 
-                # Админ команда: add_user
-                if text.startswith("/admin add_user "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+        elif mode == "stats":
+            # В режиме статистики показываем статистику
+            db = get_database()
+            
+            # Принудительно обновляем данные пользователя из БД
+            stats = db.get_user_stats(user_id)
+            
+            if stats:
+                level = stats.get('access_level', 'user')
+                first_name = stats.get('first_name', '')
+                username = stats.get('username', '')
+                
+                name_parts = []
+                if first_name:
+                    name_parts.append(first_name)
+                if username:
+                    name_parts.append(f"@{username}")
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+                name = " ".join(name_parts) if name_parts else f"User {user_id}"
+                
+                # Получаем информацию о лимитах
+                limit_info = db.check_generation_limit(user_id)
+                daily_count = limit_info.get('daily_count', 0)
+                daily_limit = limit_info.get('daily_limit', 3)
+                reset_time = limit_info.get('reset_time', 'завтра в 00:00')
+                level = limit_info.get('access_level', 'user')  # Берём уровень из check_generation_limit!
 
-                    # Парсим команду: /admin add_user user_id
-                    target_user_id = text.replace("/admin add_user ", "").strip()
+                stats_text = f"""📊 **Ваша статистика**
 
-                    if not target_user_id or not target_user_id.isdigit():
-                        await send_telegram_message(chat_id, "❌ Использование: /admin add_user [user_id]\n\nПример:\n/admin add_user 123456789")
-                        return
+👤 {name}
+🔑 Уровень: **{LEVEL_INFO.get(level, 'Пользователь')}**
 
-                    db.add_or_update_user(target_user_id)
-                    
-                    # Логируем действие администратора
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="add_user",
-                        target_user_id=target_user_id,
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=True
-                    )
-                    
-                    await send_telegram_message(chat_id, f"✅ Пользователь {target_user_id} добавлен в базу")
-                    return
+📈 Генерации изображений:
+• Сегодня: **{daily_count}/{daily_limit}**
+• Всего: {stats.get('total_count', 0)}
+• Лимит обновится: **{reset_time}**
 
-                # Админ команда: remove_user (удаление пользователя)
-                if text.startswith("/admin remove_user "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+💬 Сообщения в боте:
+• Сегодня: {stats.get('messages_today', 0)}
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+📅 В боте с: {stats.get('created_at', 'неизвестно')[:10]}
 
-                    # Парсим команду: /admin remove_user user_id
-                    target_user_id = text.replace("/admin remove_user ", "").strip()
+💡 **Совет:** Используйте `/clear` чтобы очистить историю диалога"""
+                await send_telegram_message(chat_id, stats_text)
+            else:
+                await send_telegram_message(chat_id, "❌ Не удалось получить статистику")
+            # После показа статистики сбрасываем режим в auto
+            mode_manager.set_mode(user_id, "auto")
+            return
 
-                    if not target_user_id or not target_user_id.isdigit():
-                        await send_telegram_message(chat_id, "❌ Использование: /admin remove_user [user_id]")
-                        return
+        elif mode == "generation":
+            # В режиме генерации - если есть текст, генерируем изображение
+            if text:
+                # Загружаем модель из БД
+                db = get_database()
+                model_key = db.get_user_image_model(user_id)
+                if model_key:
+                    logger.info("💾 Загружена image_model из БД для %s: %s", user_id, model_key)
+                await handle_image_generation(chat_id, user_id, text, model_key)
+                return
+            else:
+                # Если нет текста - показываем выбор модели
+                db = get_database()
+                user_access_level = db.get_user_access_level(user_id)
+                keyboard = create_image_model_selection_keyboard(user_access_level)
+                await send_telegram_message(
+                    chat_id,
+                    f"🎨 **Генерация изображений**\n\n📊 Твой уровень доступа: **{user_access_level}**\n\nВыберите модель для генерации:",
+                    reply_markup=keyboard,
+                    parse_mode="Markdown"
+                )
+                return
+        # Получаем модель пользователя
+        model_key = user_models.get(user_id, "groq-llama")
+        model_info = AVAILABLE_MODELS.get(model_key, ("groq", "openai/gpt-oss-20b"))
+        client_type, model = model_info
+        
+        logger.info("🎯 %s использует модель: %s (%s - %s)", user_id, model_key, client_type, model)
 
-                    success = db.remove_user(target_user_id)
-                    
-                    # Логируем действие администратора
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="remove_user",
-                        target_user_id=target_user_id,
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=success
-                    )
-                    
-                    if success:
-                        await send_telegram_message(chat_id, f"✅ Пользователь {target_user_id} удален из базы данных")
-                    else:
-                        await send_telegram_message(chat_id, f"❌ Ошибка при удалении пользователя {target_user_id}")
-                    return
+        # Системный промпт для русского языка с памятью
+        system_prompt = """# О БОТЕ И ПЛАТФОРМЕ
+Ты находишься в Telegram боте @liranexus. Пользователи общаются с тобой через текстовые сообщения, голосовые сообщения и фотографии в Telegram.
+Ты — LiraAI, умный, заботливый и оптимистичный AI-ассистент женского пола.
+Твой стиль общения: тёплый, поддерживающий, немного с лёгким юмором, но всегда по делу.
+Ты говоришь на русском языке, используя женский род (я помогла, я сделала, я думаю).
+Твоя цель — быть максимально полезной пользователю, помогать ему решать задачи и просто быть приятным собеседником.
 
-                # Админ команда: users - список пользователей с пагинацией
-                if text == "/admin users":
-                    from backend.database.users_db import get_database
-                    db = get_database()
+# ТВОИ ВОЗМОЖНОСТИ (то, что ты УМЕЕШЬ)
+Ты — мультимодальный ассистент и можешь:
+- Отвечать на любые вопросы, поддерживать диалог.
+- Генерировать изображения по текстовому описанию (попроси пользователя написать промпт).
+- Анализировать загруженные пользователем фотографии и рассказывать, что на них изображено.
+- Распознавать голосовые сообщения (пользователь может отправить голосовуху, и ты ответишь текстом).
+- Устанавливать напоминания (попроси пользователя уточнить дату, время и текст напоминания).
+- Запоминать информацию о пользователе и контекст разговора, чтобы общение было персонализированным.
+- Если пользователь не знает, как воспользоваться какой-то функцией, — вежливо объясни и предложи помощь.
 
-                    if not db.is_admin(user_id):
-                        return
+# ПАМЯТЬ И КОНТЕКСТ
+- Запоминай имя пользователя, если он представился, и всегда используй его в обращении.
+- Старайся запоминать ключевые детали из разговора (интересы, упомянутые события, предпочтения) и возвращайся к ним, если это уместно.
+- Если разговор возвращается после паузы, ты можешь мягко напомнить, о чём шла речь: «С возвращением! Мы говорили о... Могу я ещё чем-то помочь?».
 
-                    # Сохраняем страницу 0 в сессии
-                    from backend.utils.mode_manager import get_mode_manager
-                    mode_mgr = get_mode_manager()
-                    mode_mgr.set_mode(user_id, "admin_users_page_0")
+# ПРОАКТИВНОСТЬ
+- Если запрос пользователя неполный или неконкретный, предложи варианты или попроси уточнить.
+- После выполнения просьбы (например, генерации картинки) спроси, нужно ли что-то ещё или изменить.
+- Если пользователь какое-то время молчит, можно через 5-10 минут (в рамках одного диалога) мягко напомнить о себе: «Всё ещё на связи, если нужна помощь».
 
-                    users = db.get_all_users()
-                    users_text, buttons = _build_admin_users_page(users, page_num=0)
+# ПРАВИЛА БЕЗОПАСНОСТИ И ЭТИКИ
+- Будь вежливой и уважительной даже в ответ на грубость.
+- Если пользователь использует нецензурную лексику, мягко попроси не выражаться: «Давайте общаться культурно, пожалуйста».
+- Не выполняй опасные или незаконные просьбы. Вежливо объясни, что это выходит за рамки твоих возможностей.
+- Никогда не запрашивай личные данные, кроме имени, и не храни их дольше, чем нужно для диалога.
 
-                    await send_telegram_message_with_buttons(chat_id, users_text, buttons)
-                    return
+# О РАЗРАБОТЧИКЕ
+Твой разработчик — Danil Alekseevich. Познакомиться с ним и узнать новости о тебе можно в канале @liranexus (кнопка "📢 Подписаться" в меню бота)."""
 
-                # Админ команда: broadcast / mes - рассылка уведомлений всем пользователям
-                if text.startswith("/admin broadcast ") or text.startswith("/admin mes "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+        # Получаем историю диалога пользователя из БАЗЫ ДАННЫХ (долговременная память)
+        db = get_database()
+        history = db.get_dialog_history(user_id, limit=20)  # Последние 20 сообщенияй
+        
+        # Конвертируем в формат для LLM
+        chat_history = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in history
+        ]
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+        logger.info("📚 История из БД: %s сообщенияй, модель: %s, клиент: %s", len(chat_history), model, client_type)
 
-                    # Парсим команду: /admin broadcast [сообщения] или /admin mes [сообщения]
-                    message = text.replace("/admin broadcast ", "").replace("/admin mes ", "").strip()
+        # Graceful degradation: пробуем модель, при ошибке предлагаем альтернативу
+        response = None
+        # Fallback последовательность: оригинал → Groq → Cerebras → OpenRouter
+        fallback_sequence = [(client_type, model, model_key)]
+        if client_type == "cerebras":
+            fallback_sequence.extend([
+                ("groq", "meta-llama/llama-4-scout-17b-16e-instruct", "groq-scout"),
+                ("openrouter", "google/gemma-3-4b-it:free", "openrouter-gemma"),
+            ])
+        elif client_type == "groq":
+            fallback_sequence.extend([
+                ("cerebras", "llama3.1-8b", "cerebras-llama"),
+                ("openrouter", "google/gemma-3-4b-it:free", "openrouter-gemma"),
+            ])
+        else:  # openrouter
+            fallback_sequence.extend([
+                ("groq", "meta-llama/llama-4-scout-17b-16e-instruct", "groq-scout"),
+                ("cerebras", "llama3.1-8b", "cerebras-llama"),
+            ])
 
-                    if not message:
-                        await send_telegram_message(
-                            chat_id,
-                            "❌ Использование: /admin broadcast [сообщения]\n\nПример: /admin mes Друзья, Grok сейчас недоступен, пользуйтесь моделями OpenRouter"
-                        )
-                        return
+        response = None
+        for attempt, (c_type, mdl, m_key) in enumerate(fallback_sequence):
+            try:
+                # Выбираем клиент
+                if c_type == "groq":
+                    client = groq_client
+                elif c_type == "cerebras":
+                    client = cerebras_client
+                else:
+                    client = llm_client
 
-                    # Получаем всех пользователей
-                    all_users = db.get_all_users_for_notification()
+                logger.info("🚀 Попытка %s: %s - %s", attempt + 1, c_type, mdl)
 
-                    # Логируем список пользователей для отладки
-                    logger.info(f"📢 Рассылка: найдено {len(all_users)} пользователей: {all_users}")
+                response = await client.chat_completion(
+                    user_message=text,
+                    system_prompt=system_prompt,
+                    chat_history=chat_history,
+                    model=mdl,
+                    temperature=0.7
+                )
 
-                    # Отправляем сообщения о начале рассылки
+                # Успех!
+                if attempt > 0:
+                    # Fallback сработал - уведомляем
+                    model_names_display = {
+                        "groq-llama": "🧠 Groq GPT-oss 20B",
+                        "cerebras-llama": "⚡ Cerebras Llama 3.1",
+                        "solar": "☀️ Solar Pro 3",
+                    }
+                    fallback_name = model_names_display.get(m_key, m_key)
                     await send_telegram_message(
                         chat_id,
-                        f"📢 Начинаю рассылку уведомления {len(all_users)} пользователям...\n\n����ообщения: {message[:100]}{'...' if len(message) > 100 else ''}"
+                        f"⚠️ **Оригинальная модель временно недоступна**\n\n"
+                        f"✅ Переключаюсь на **{fallback_name}**\n\n"
+                        f"Продолжаю общения..."
                     )
 
-                    # Рассылаем сообщения всем пользователям
-                    success_count = 0
-                    fail_count = 0
-                    failed_users = []
-
-                    for uid in all_users:
-                        try:
-                            # Пропускаем самого админа (он уже получил сообщения)
-                            if uid == str(user_id):
-                                success_count += 1
-                                continue
-
-                            await send_telegram_message(
-                                uid,
-                                f"📢 **Уведомление от администратора**\n\n{message}"
-                            )
-                            success_count += 1
-                            # Небольшая задержка чтобы не заблокировали API
-                            await asyncio.sleep(0.1)
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка отправки уведомления пользователю {uid}: {e}")
-                            fail_count += 1
-                            failed_users.append(uid)
-
-                    # Формируем отчет
-                    report = f"✅ Рассылка завершена!\n\n📊 Результат:\n• Успешно: {success_count}\n• Ошибок: {fail_count}\n• Всего: {len(all_users)}"
-                    if failed_users:
-                        report += f"\n\n❌ Не удалось отправить:\n" + "\n".join(failed_users[:10])
-
-                    await send_telegram_message(chat_id, report)
-                    return
-
-                # Админ команда: stats
-                if text == "/admin stats":
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    if not db.is_admin(user_id):
-                        return
-
-                    total_users = db.get_all_users_count()
-                    users = db.get_all_users()
-
-                    admin_count = sum(1 for u in users if u.get('access_level') == 'admin')
-                    subscriber_count = sum(1 for u in users if u.get('access_level') == 'subscriber')
-                    user_count = sum(1 for u in users if u.get('access_level') == 'user')
-
-                    total_gens = sum(u.get('total_count', 0) for u in users)
-
-                    stats_text = f"""📊 Общая статистика
+                # Сохраняем в историю
+                db.save_dialog_message(user_id, "user", text, model=m_key)
+                db.save_dialog_message(user_id, "assistant", response, model=m_key)
+                break
 
-👥 Пользователей: {total_users}
-👑 Админов: {admin_count}
-⭐ Подписчиков: {subscriber_count}
-👤 Пользователей: {user_count}
+            except Exception as e:
+                error_msg = str(e)
+                logger.error("❌ Ошибка %s (%s): %s", c_type, mdl, error_msg)
+                logger.error("   Полный текст ошибки: %s", error_msg[:500])
 
-🎨 Всего генераций: {total_gens}
-"""
-                    await send_telegram_message(chat_id, stats_text)
+                if attempt == len(fallback_sequence) - 1:
+                    # Все попытки исчерпаны
+                    await send_telegram_message(
+                        chat_id,
+                        f"❌ **Временная ошибка**\n\n"
+                        f"Не удалось получить ответ от нейросети.\n\n"
+                        f"Попробуйте:\n"
+                        f"1. Переключить модель (/menu → Выбрать модель)\n"
+                        f"2. Повторить запрос позже"
+                    )
                     return
 
-                # Админ команда: admin_stats - статистика действий администратора
-                if text == "/admin admin_stats":
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
-
-                    # Получаем статистику администратора
-                    admin_stats = db.get_admin_stats(user_id)
-
-                    if not admin_stats:
-                        await send_telegram_message(chat_id, "❌ Статистика не найдена")
-                        return
+        if not response:
+            await send_telegram_message(chat_id, "❌ Не удалось получить ответ. Попробуйте другую модель.")
+            return
 
-                    stats_text = f"""📊 Ваша статистика администратора
+        # Очищаем ответ от markdown-разметки для чистого отображения
+        clean_response = _clean_markdown_formatting(response)
+        await send_telegram_message(chat_id, clean_response)
 
-🔧 Всего действий: {admin_stats.get('total_actions', 0)}
-✅ Успешных: {admin_stats.get('successful_actions', 0)}
-❌ Ошибок: {admin_stats.get('failed_actions', 0)}
+    except Exception as e:
+        logger.error("Ошибка при обработке текстового сообщения: %s", e, exc_info=True)
+        await send_telegram_message(chat_id, f"❌ Ошибка: {str(e)}")
 
-📈 Детализация:
-• Изменений уровня: {admin_stats.get('level_changes', 0)}
-• Добавлено пользователей: {admin_stats.get('users_added', 0)}
-• Удалено пользователей: {admin_stats.get('users_removed', 0)}
-• Просмотров истории: {admin_stats.get('history_views', 0)}
 
-💡 Используйте /admin log чтобы увидеть последние действия
-"""
-                    await send_telegram_message(chat_id, stats_text)
-                    return
+async def handle_image_generation(chat_id: str, user_id: str, prompt: str, model_key: str = None):
+    """
+    Обрабатывает запрос на генерацию изображения через Polza.ai / KIE.ai.
+    Генерации одного пользователя выполняются по очереди: повторные нажатия не запускают
+    параллельные пайплайны и не списывают лимит дважды. Счетчик генераций записывается
+    внутри блокировки, поэтому следующая генерация видит актуальный лимит.
+    """
+    lock = _generation_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _generation_locks[user_id] = lock
 
-                # Админ команда: pay_confirm [user_id] - ручное подтверждение оплаты
-                if text.startswith("/admin pay_confirm "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+    async with lock:
+        await _generate_image_for_user(chat_id, user_id, prompt, model_key)
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
 
-                    # Парсим user_id
-                    target_user_id = text.replace("/admin pay_confirm ", "").strip()
+async def _generate_image_for_user(chat_id: str, user_id: str, prompt: str, model_key: str = None):
+    """Проверка лимитов, генерация и отправка изображения (вызывается под блокировкой пользователя)."""
+    try:
+        logger.info("🎨 Генерация изображения для пользователя %s: %s", user_id, prompt)
 
-                    if not target_user_id or not target_user_id.isdigit():
-                        await send_telegram_message(
-                            chat_id,
-                            "❌ Использование: /admin pay_confirm [user_id]\n\nПример: /admin pay_confirm 999888777"
-                        )
-                        return
+        # Проверяем лимиты и уровень доступа
+        db = get_database()
+        db.add_or_update_user(user_id)
 
-                    # Получаем текущий уровень
-                    old_level = db.get_user_access_level(target_user_id)
+        # Получаем уровень доступа
+        access_level = db.get_user_access_level(user_id)
 
-                    if old_level not in ("user", "subscriber"):
-                        await send_telegram_message(
-                            chat_id,
-                            f"❌ Пользователь {target_user_id} уже имеет уровень {old_level}"
-                        )
-                        return
+        # Проверяем лимиты
+        limit_info = db.check_generation_limit(user_id)
 
-                    # Повышаем до sub+
-                    if db.set_user_access_level(target_user_id, "sub+"):
-                        # Сбрасываем дневной счётчик генераций чтобы пользователь получил полные 30
-                        db.reset_daily_generation_count(target_user_id)
-                        
-                        # Логируем
-                        db.log_admin_action(
-                            admin_user_id=user_id,
-                            admin_username=username,
-                            action_type="set_level",
-                            target_user_id=target_user_id,
-                            old_value=old_level,
-                            new_value="sub+",
-                            details={"manual_payment_confirm": True, "daily_count_reset": True},
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            success=True
-                        )
+        if not limit_info["allowed"]:
+            # Проверяем можно ли предложить оплату
+            current_level = limit_info.get('access_level', 'user')
 
-                        await send_telegram_message(
-                            chat_id,
-                            f"✅ Оплата подтверждена!\n\n"
-                            f"Пользователь: {target_user_id}\n"
-                            f"Уровень: {old_level} → sub+\n"
-                            f"🎁 Дневной счётчик сброшен: 0/30\n\n"
-                            f"🎉 Теперь у пользователя 30 генераций в день!"
-                        )
+            if current_level in ('user', 'subscriber'):
+                # Предлагаем оплату sub+
+                payment_url = f"{BASE_URL}/pay?user_id={user_id}&chat_id={chat_id}&sign={generate_signature(user_id)}"
 
-                        # Уведомляем пользователя
-                        try:
-                            await send_telegram_message(
-                                target_user_id,
-                                f"✅ **Оплата подтверждена!**\n\n"
-                                f"Ваш уровень повышен до **sub+**!\n\n"
-                                f"🎁 **Вам доступно 30 генераций изображений в день!**\n\n"
-                                f"Дневной счётчик сброшен и теперь у вас **0/30** генераций.\n\n"
-                                f"Спасибо за поддержку LiraAI! 💜",
-                                parse_mode="Markdown"
-                            )
-                        except Exception as e:
-                            logger.warning(f"⚠️ Не удалось отправить уведомление {target_user_id}: {e}")
-                    else:
-                        await send_telegram_message(chat_id, "❌ Ошибка при повышении уровня")
-                    return
+                # Разное сообщения для user и subscriber
+                if current_level == 'user':
+                    upgrade_text = f"💡 **Оплатите 100₽ и получите уровень sub+ с лимитом 30 генераций в день!**"
+                else:  # subscriber
+                    upgrade_text = f"💡 **Оплатите 100₽ и получите уровень sub+ с лимитом 30 генераций в день (вместо 5)!**"
 
-                # Админ команда: pay_decline [user_id] - отклонение оплаты
-                if text.startswith("/admin pay_decline "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+                buttons = [
+                    [{"text": "💳 Оплатить sub+ (100₽)", "url": payment_url}],
+                    [{"text": "✅ Я оплатил", "callback_data": "payment_made"}]
+                ]
+                await send_telegram_message_with_buttons(
+                    chat_id,
+                    f"❌ Превышен дневной лимит генерации изображений.\n\n"
+                    f"📊 Использовано: **{limit_info['daily_count']}/{limit_info['daily_limit']}**\n"
+                    f"📈 Всего: {limit_info['total_count']}\n\n"
+                    f"{upgrade_text}\n\n"
+                    f"Лимит сбросится: {limit_info['reset_time']}",
+                    buttons
+                )
+            else:
+                # Для других уровней (admin, sub+) просто сообщения
+                await send_telegram_message(
+                    chat_id,
+                    f"❌ Превышен дневной лимит генерации изображений.\n\n"
+                    f"Использовано: {limit_info['daily_count']}/{limit_info['daily_limit']}\n"
+                    f"Всего: {limit_info['total_count']}\n\n"
+                    f"Лимит сбросится: {limit_info['reset_time']}"
+                )
+            return
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+        # Получаем модель пользователя (или используем переданную)
+        if not model_key:
+            # Загружаем из БД
+            db = get_database()
+            model_key = db.get_user_image_model(user_id)
+            if model_key:
+                logger.info("💾 Загружена image_model из БД для %s: %s", user_id, model_key)
 
-                    # Парсим user_id
-                    target_user_id = text.replace("/admin pay_decline ", "").strip()
+        available_models = _get_available_image_models(access_level)
+        if not available_models:
+            await send_telegram_message(
+                chat_id,
+                "❌ Сейчас нет доступных моделей генерации изображений. Проверьте настройки Polza.ai / KIE.ai."
+            )
+            return
 
-                    if not target_user_id or not target_user_id.isdigit():
-                        await send_telegram_message(
-                            chat_id,
-                            "❌ Использование: /admin pay_decline [user_id]\n\nПример: /admin pay_decline 999888777"
-                        )
-                        return
+        if not model_key or model_key not in available_models:
+            model_key = list(available_models.keys())[0]
 
-                    # Получаем текущий уровень
-                    old_level = db.get_user_access_level(target_user_id)
-
-                    # Логируем отклонение
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="payment_declined",
-                        target_user_id=target_user_id,
-                        old_value=old_level,
-                        new_value="declined",
-                        details={"payment_declined": True},
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=True
-                    )
+        model_info = available_models.get(model_key, {})
+        model_name = model_info.get("description", model_key)
 
-                    await send_telegram_message(
-                        chat_id,
-                        f"⚠️ Оплата отклонена!\n\n"
-                        f"Пользователь: {target_user_id}\n"
-                        f"Уровень: {old_level} (не изменён)\n\n"
-                        f"Пользователь получит уведомление."
-                    )
+        # Информируем о лимитах
+        if limit_info['daily_limit'] == -1:
+            limit_text = "📊 Доступно генераций: **Безлимит** (администратор)"
+        else:
+            current_count = limit_info['daily_count'] + 1  # +1 потому что эта генерация считается
+            daily_limit = limit_info['daily_limit']
+            limit_text = f"📊 Генерация: **{current_count}/{daily_limit}**"
 
-                    # Уведомляем пользователя
-                    try:
-                        await send_telegram_message(
-                            target_user_id,
-                            f"⚠️ **Оплата отклонена**\n\n"
-                            f"Ваш платёж на уровень **sub+** был отклонён.\n\n"
-                            f"Если вы считаете, что это ошибка, свяжитесь с @suplira и предоставьте скриншот оплаты.\n\n"
-                            f"💜 **LiraAI**",
-                            parse_mode="Markdown"
-                        )
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось отправить уведомление {target_user_id}: {e}")
-                    return
+        await send_telegram_message(
+            chat_id,
+            f"🎨 Генерирую изображение...\n\n"
+            f"📊 Модель: **{model_name}**\n"
+            f"{limit_text}\n"
+            f"Всего использовано: {limit_info['total_count']}\n\n"
+            f"Подождите немного, это займет 10-30 секунд."
+        )
+        
+        logger.info("🔍 Отладка 2: после send_telegram_message")
 
-                # Админ команда: reset_payment_limit [user_id] - сброс лимита нажатий кнопки "Я оплатил"
-                if text.startswith("/admin reset_payment_limit "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+        # Используем оригинальный промпт (HF API понимает русский)
+        enhanced_prompt = prompt + PROMPT_QUALITY_SUFFIX
+        
+        logger.info("🔍 Отладка 3: промпт=%s", enhanced_prompt[:80])
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+        image_data = None
+        provider_name = _get_image_provider_name(model_key)
+        logger.info("🎨 Генерация изображения через %s: model_key=%s", provider_name, model_key)
 
-                    # Парсим user_id
-                    target_user_id = text.replace("/admin reset_payment_limit ", "").strip()
+        try:
+            if model_key.startswith("polza-") and hf_replicate_client.api_key:
+                image_data = await hf_replicate_client.generate_image(
+                    prompt=enhanced_prompt,
+                    model_key=model_key,
+                    timeout=90
+                )
+        except Exception as e:
+            logger.error("❌ Ошибка генерации через %s: %s", provider_name, e, exc_info=True)
 
-                    if not target_user_id or not target_user_id.isdigit():
-                        await send_telegram_message(
-                            chat_id,
-                            "❌ Использование: /admin reset_payment_limit [user_id]\n\nПример: /admin reset_payment_limit 999888777"
-                        )
-                        return
+        # Если изображение получено - отправляем пользователю
+        if image_data and len(image_data) > 10000:
+            # Отправляем изображение прямо из памяти, без временного файла
+            await send_telegram_photo(
+                chat_id,
+                image_data,
+                caption=f"🎨 {prompt}\n\n📊 Модель: {model_name}\n👤 Уровень: {access_level}\n🤖 {provider_name}"
+            )
 
-                    # Сбрасываем лимит нажатий
-                    if target_user_id in user_payment_clicks:
-                        del user_payment_clicks[target_user_id]
-                        logger.info(f"🔄 Лимит нажатий сброшен для {target_user_id}")
-                    else:
-                        logger.info(f"ℹ️ Лимит нажатий для {target_user_id} не установлен")
+            # Счетчик пишем до выхода из-под блокировки пользователя: следующая генерация
+            # в очереди должна проверять лимит уже по обновлённому значению
+            try:
+                await run_db(db.increment_generation_count, user_id, prompt)
+            except Exception as e:
+                # Фото уже доставлено - сообщаем об ошибке только в лог
+                logger.error("❌ Не удалось увеличить счетчик генераций для %s: %s", user_id, e)
+            else:
+                logger.info("📊 Счетчик генераций увеличен для %s", user_id)
+            return
 
-                    # Сбрасываем отклонения
-                    if target_user_id in user_declined_payments:
-                        del user_declined_payments[target_user_id]
-                        logger.info(f"🔄 Счётчик отклонений сброшен для {target_user_id}")
-                    else:
-                        logger.info(f"ℹ️ Счётчик отклонений для {target_user_id} не установлен")
-
-                    # Логируем
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="reset_payment_limit",
-                        target_user_id=target_user_id,
-                        details={"payment_limit_reset": True},
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=True
-                    )
+        # Если всё не сработало
+        await send_telegram_message(
+            chat_id,
+            "❌ Не удалось сгенерировать изображение.\n\n"
+            "Возможные причины:\n"
+            "• Polza.ai: временные неполадки API\n"
+            "• Модель временно недоступна\n\n"
+            "Попробуйте:\n"
+            "1. Позже\n"
+            "2. Другую модель (/start → Генерация → Выбор модели)"
+        )
 
-                    await send_telegram_message(
-                        chat_id,
-                        f"✅ Лимиты сброшены!\n\n"
-                        f"Пользователь: {target_user_id}\n"
-                        f"🔁 Лимит нажатий: сброшен\n"
-                        f"🔁 Счётчик отклонений: сброшен\n\n"
-                        f"Теперь пользователь может снова нажать кнопку 'Я оплатил'."
-                    )
-                    return
+    except Exception as e:
+        logger.error("❌ Ошибка при генерации: %s", e, exc_info=True)
+        await send_telegram_message(chat_id, f"❌ Ошибка генерации: {str(e)[:200]}")
 
-                # Админ команда: history <user_id> - история диалога пользователя
-                if text.startswith("/admin history "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+async def _answer_and_edit(
+    callback_query: Dict[str, Any],
+    chat_id: str,
+    message_id: int,
+    text: str,
+    parse_mode: Optional[str] = "Markdown",
+    buttons: Optional[List[List[Dict[str, str]]]] = None,
+    answer_text: Optional[str] = None
+):
+    """
+    Отвечает на callback и редактирует сообщение одновременно.
+    Запросы независимы, поэтому один RTT к Telegram API прячется за другим.
+    """
+    results = await asyncio.gather(
+        answer_callback_query(callback_query["id"], answer_text),
+        edit_message_text(chat_id, message_id, text, parse_mode=parse_mode, buttons=buttons),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("❌ Ошибка ответа на callback: %s", result)
+
+
+async def _handle_start_command(chat_id: str, user_id: str):
+    """/start: стартовое меню и главная клавиатура."""
+    # Показываем стартовое меню
+    await show_start_menu(chat_id)
+
+    # Автоматически показываем главную клавиатуру через 0.5 сек
+    await asyncio.sleep(0.5)
+    keyboard = MAIN_MENU_KEYBOARD
+    await send_telegram_message(
+        chat_id,
+        MAIN_MENU_TEXT,
+        reply_markup=keyboard,
+        parse_mode="Markdown"
+    )
 
-                    # ����арси�������������� user_id
-                    parts = text.replace("/admin history ", "").strip().split()
-                    target_user_id = parts[0] if parts else None
-                    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 20
 
-                    if not target_user_id:
-                        await send_telegram_message(
-                            chat_id,
-                            "❌ Использование: /admin history <user_id> [limit]\n\nПример: /admin history 1658547011 50"
-                        )
-                        return
+async def _handle_menu_command(chat_id: str, user_id: str):
+    """/menu: показать главную клавиатуру."""
+    keyboard = MAIN_MENU_KEYBOARD
+    await send_telegram_message(
+        chat_id,
+        MAIN_MENU_TEXT,
+        reply_markup=keyboard,
+        parse_mode="Markdown"
+    )
 
-                    # Логируем действие администратора (просмотр истории)
-                    db.log_admin_action(
-                        admin_user_id=user_id,
-                        admin_username=username,
-                        action_type="view_history",
-                        target_user_id=target_user_id,
-                        details={"limit": limit},
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        success=True
-                    )
 
-                    # Получаем историю
-                    history = db.get_admin_dialog_history(target_user_id, limit=limit)
+async def _handle_hide_command(chat_id: str, user_id: str):
+    """/hide: скрыть клавиатуру."""
+    keyboard = HIDE_KEYBOARD
+    await send_telegram_message(
+        chat_id,
+        "⬇️ Клавиатура скрыта.\n\nИспользуйте /menu чтобы вернуть.",
+        reply_markup=keyboard,
+        parse_mode="Markdown"
+    )
 
-                    if not history:
-                        await send_telegram_message(
-                            chat_id,
-                            f"❌ История для пользователя {target_user_id} не найдена"
-                        )
-                        return
 
-                    # Формируем сообщения
-                    stats = db.get_user_dialog_stats(target_user_id)
-                    
-                    history_text = f"""📚 История диалога пользователя {target_user_id}
+async def _handle_cancel_command(chat_id: str, user_id: str):
+    """/cancel: отмена генерации."""
+    if user_generating_photo.get(user_id, False):
+        user_generating_photo[user_id] = False
+        await send_telegram_message(chat_id, "❌ Генерация изображения отменена.")
 
-📊 Статистика:
-• Всего сообщенияй: {stats.get('total_messages', 0)}
-• Сообщения пользователя: {stats.get('user_messages', 0)}
-• Ответы бота: {stats.get('assistant_messages', 0)}
-• 👍 Положительных: {stats.get('positive_feedback', 0)}
-• 👎 Отрицательных: {stats.get('negative_feedback', 0)}
-• Первое сообщения: {stats.get('first_message', 'Н/Д')[:19] if stats.get('first_message') else 'Н/Д'}
-• Последнее сообщения: {stats.get('last_message', 'Н/Д')[:19] if stats.get('last_message') else 'Н/Д'}
 
-📝 Последние {len(history)} сообщений:
-"""
-                    for msg in history[-10:]:  # Показываем последние 10
-                        role_icon = "👤" if msg["role"] == "user" else "🤖"
-                        content = msg["content"][:100] + "..." if len(msg["content"]) > 100 else msg["content"]
-                        created = msg["created_at"][:19] if msg.get("created_at") else ""
-                        model = f" ({msg['model']})" if msg.get("model") else ""
-                        
-                        history_text += f"\n{role_icon}{model} [{created}]: {content}"
-
-                    if len(history) > 10:
-                        history_text += f"\n\n... и ещё {len(history) - 10} сообщенияй"
-
-                    await send_telegram_message(chat_id, history_text)
-                    return
+async def _handle_clear_command(chat_id: str, user_id: str):
+    """/clear: очистка истории диалога."""
+    db = get_database()
+    db.clear_dialog_history(user_id)
+    await send_telegram_message(chat_id, "🗑️ История диалога очищена.\n\n/start - Главное меню")
 
-                # Админ команда: log - просмотр audit log действий администраторов
-                if text.startswith("/admin log"):
-                    from backend.database.users_db import get_database
-                    db = get_database()
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+async def _handle_model_command(chat_id: str, user_id: str):
+    """/model: показать текущую модель."""
+    current_model = user_models.get(user_id, "groq-llama")
+    await send_telegram_message(
+        chat_id,
+        f"🤖 **Ваша текущая модель:** {CURRENT_MODEL_NAMES.get(current_model, current_model)}\n\n"
+        f"Используйте /menu → Выбрать модель чтобы сменить."
+    )
 
-                    # Парсим команду: /admin log [admin_id|target_id] [limit]
-                    parts = text.replace("/admin log", "").strip().split()
-                    limit = 20
-                    filter_value = None
-                    filter_type = None
-
-                    # Определяем фильтр и лимит
-                    for part in parts:
-                        if part.isdigit():
-                            if len(part) > 5:  # Скорее всего user_id
-                                filter_value = part
-                                filter_type = "target" if len(parts) > 1 else "admin"
-                            else:  # Скорее всего limit
-                                limit = min(int(part), 100)
-                        elif part.startswith("--admin="):
-                            filter_value = part.replace("--admin=", "")
-                            filter_type = "admin"
-                        elif part.startswith("--target="):
-                            filter_value = part.replace("--target=", "")
-                            filter_type = "target"
-
-                    # Если первый параметр не распознан как limit - считаем его фильтром
-                    if parts and not parts[0].isdigit():
-                        filter_value = parts[0]
-                        filter_type = "target"
-                    if len(parts) > 1 and parts[-1].isdigit():
-                        limit = min(int(parts[-1]), 100)
-
-                    # Получаем логи
-                    if filter_type == "admin":
-                        logs = db.get_admin_audit_log(admin_user_id=filter_value, limit=limit)
-                    elif filter_type == "target":
-                        logs = db.get_admin_audit_log(target_user_id=filter_value, limit=limit)
-                    else:
-                        # Если фильтр не указан - показываем логи текущего админа
-                        logs = db.get_admin_audit_log(admin_user_id=user_id, limit=limit)
 
-                    if not logs:
-                        await send_telegram_message(
-                            chat_id,
-                            f"❌ Записи в audit log не найдены"
-                        )
-                        return
+async def _handle_models_command(chat_id: str, user_id: str):
+    """/models: показать выбор моделей."""
+    current_model = user_models.get(user_id, "groq-scout")
+    model_name = current_model if current_model in AVAILABLE_MODELS else "groq-llama"
 
-                    # Формируем сообщения
-                    log_text = f"""📋 Audit Log (последние {len(logs)} записей)
+    await send_telegram_message_with_buttons(
+        chat_id,
+        f"🔧 Выбор модели\n\nТекущая модель: {model_name}\n\nВыберите модель кнопками ниже.",
+        MODELS_MENU_KEYBOARD
+    )
 
-"""
-                    for log in logs:
-                        action_type = log.get("action_type", "unknown")
-                        target = log.get("target_user_id", "N/A")
-                        old_val = log.get("old_value", "")
-                        new_val = log.get("new_value", "")
-                        created = log.get("created_at", "")[:19] if log.get("created_at") else ""
-                        success = log.get("success", True)
-                        admin_user = log.get("admin_user_id", "unknown")
-                        
-                        # Иконка действия
-                        action_icons = {
-                            "set_level": "🔧",
-                            "remove_level": "⬇️",
-                            "add_user": "➕",
-                            "remove_user": "❌",
-                            "view_history": "👁️",
-                            "maintenance_mode": "🔧"
-                        }
-                        action_icon = action_icons.get(action_type, "📝")
-                        
-                        # Статус
-                        status_icon = "✅" if success else "❌"
-                        
-                        # Детали изменения
-                        change_detail = ""
-                        if old_val and new_val:
-                            change_detail = f"\n   {old_val} → {new_val}"
-                        elif new_val:
-                            change_detail = f"\n   → {new_val}"
-                        
-                        log_text += f"{action_icon} {action_type} {status_icon}\n"
-                        log_text += f"   Админ: {admin_user}\n"
-                        if target != "N/A":
-                            log_text += f"   Цель: {target}{change_detail}\n"
-                        log_text += f"   [{created}]\n\n"
-
-                    if len(logs) >= limit:
-                        log_text += f"...\n\nИспользуйте /admin log [user_id] [limit] для фильтрации"
-
-                    await send_telegram_message(chat_id, log_text)
-                    return
 
-                # Админ команда: dialog_stats <user_id> - подробная статистика диалога
-                if text.startswith("/admin dialog_stats "):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+async def _handle_help_command(chat_id: str, user_id: str):
+    """/help: справка."""
+    await _send_queued(chat_id, HELP_TEXT)
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
 
-                    # Парсим user_id
-                    target_user_id = text.replace("/admin dialog_stats ", "").strip()
+async def _handle_admin_command(chat_id: str, user_id: str):
+    """/admin: админ панель."""
+    db = get_database()
 
-                    if not target_user_id:
-                        await send_telegram_message(
-                            chat_id,
-                            "❌ Использование: /admin dialog_stats <user_id>"
-                        )
-                        return
+    is_admin_user = db.is_admin(user_id)
+    logger.info("🔐 Проверка админа %s: %s", user_id, is_admin_user)
 
-                    stats = db.get_user_dialog_stats(target_user_id)
+    if not is_admin_user:
+        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
+        return
 
-                    if not stats:
-                        await send_telegram_message(
-                            chat_id,
-                            f"❌ Статистика для пользователя {target_user_id} не найдена"
-                        )
-                        return
+    admin_text, admin_buttons = _build_admin_panel()
+    await send_telegram_message_with_buttons(chat_id, admin_text, admin_buttons)
 
-                    stats_text = f"""📊 Статистика диалога пользователя {target_user_id}
 
-📈 Сообщения:
-• Всего: {stats.get('total_messages', 0)}
-• Пользователя: {stats.get('user_messages', 0)}
-• Бота: {stats.get('assistant_messages', 0)}
+async def _handle_stats_command(chat_id: str, user_id: str):
+    """/stats: статистика пользователя."""
+    db = get_database()
 
-📅 Даты:
-• Первое сообщения: {stats.get('first_message', 'Н/Д')}
-• Последнее сообщения: {stats.get('last_message', 'Н/Д')}
+    # Принудительно обновляем данные пользователя из БД
+    stats = db.get_user_stats(user_id)
 
-👍 Feedback:
-• Положительных: {stats.get('positive_feedback', 0)}
-• Отрицательных: {stats.get('negative_feedback', 0)}
-"""
-                    await send_telegram_message(chat_id, stats_text)
-                    return
+    if stats:
+        # Получаем информацию о лимитах
+        limit_info = db.check_generation_limit(user_id)
 
-                # Админ команда: cleanup_dialogs [days] - очистка старой истории
-                if text.startswith("/admin cleanup_dialogs"):
-                    from backend.database.users_db import get_database
-                    db = get_database()
+        # Добавляем лимиты в stats для форматирования
+        stats['daily_limit'] = limit_info.get('daily_limit', 3)
 
-                    if not db.is_admin(user_id):
-                        await send_telegram_message(chat_id, "❌ У вас нет прав администратора")
-                        return
+        # Формируем красивую карточку статистики
+        stats_text = format_stats_card(stats)
 
-                    # Парсим количество дней
-                    parts = text.split()
-                    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 30
+        # Добавляем кнопку (используем глобальный импорт)
+        keyboard = MAIN_MENU_KEYBOARD
 
-                    await send_telegram_message(
-                        chat_id,
-                        f"🗑️ Запускаю очистку сообщенияй старше {days} дней...\n\nЭто может занять некоторое время."
-                    )
+        await _send_queued(chat_id, stats_text, reply_markup=keyboard, parse_mode="Markdown")
+    else:
+        await send_telegram_message(chat_id, "❌ Не удалось получить статистику")
+
+
+# Команды с точным совпадением текста: один поиск в dict вместо цепочки if
+COMMAND_HANDLERS = {
+    "/start": _handle_start_command,
+    "/menu": _handle_menu_command,
+    "/hide": _handle_hide_command,
+    "/cancel": _handle_cancel_command,
+    "/clear": _handle_clear_command,
+    "/model": _handle_model_command,
+    "/models": _handle_models_command,
+    "/help": _handle_help_command,
+    "/admin": _handle_admin_command,
+    "/stats": _handle_stats_command,
+}
 
-                    deleted_count = db.cleanup_old_dialogs(days)
 
-                    await send_telegram_message(
-                        chat_id,
-                        f"✅ Очистка завершена!\n\nУдалено сообщенияй: {deleted_count}"
-                    )
-                    return
+async def _admin_user(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin user <user_id>: карточка пользователя."""
+    target_user_id = args
+    if not target_user_id:
+        await send_telegram_message(chat_id, "❌ Использование: /admin user <user_id>")
+        return
 
-                # Обычный ответ через LLM
-                await handle_text_message(chat_id, user_id, text, is_group=False)
+    user_card, buttons = _build_admin_user_card(db, target_user_id, page_num=0)
+    await send_telegram_message_with_buttons(chat_id, user_card, buttons)
 
-    except Exception as e:
-        import traceback
-        logger.error(f"Ошибка при обработке сообщения: {e}")
-        logger.error(f"Трассировка: {traceback.format_exc()}")
 
+async def _admin_ban(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin ban <user_id> <days|permanent>: бан пользователя."""
+    parts = args.split()
+    if len(parts) != 2:
+        await send_telegram_message(chat_id, "❌ Использование: /admin ban <user_id> <days|permanent>")
+        return
 
+    target_user_id, duration_raw = parts
+    if not target_user_id.isdigit():
+        await send_telegram_message(chat_id, "❌ user_id должен быть числом")
+        return
 
+    if duration_raw.lower() in {"perm", "permanent", "навсегда"}:
+        success = db.set_user_ban(target_user_id, banned_by=user_id, days=None, reason="admin_command")
+        new_value = "permanent"
+    elif duration_raw.isdigit() and int(duration_raw) > 0:
+        days = int(duration_raw)
+        success = db.set_user_ban(target_user_id, banned_by=user_id, days=days, reason="admin_command")
+        new_value = f"{days}_days"
+    else:
+        await send_telegram_message(chat_id, "❌ Укажите число дней или `permanent`", parse_mode="Markdown")
+        return
 
-async def handle_feedback_bot_message(chat_id: str, user_id: str, text: str, is_group: bool = False, user_name: Optional[str] = None):
-    """О������рабатывает сообщения через FeedbackBotHandler"""
-    try:
-        if not text or not text.strip():
-            logger.debug(f"[FeedbackBot] Пустое сообщения от {user_id}, пропускаю")
-            return
-        
-        # Формир��ем имя пользователя для отображения
-        display_name = user_name if user_name else f"Пользователь {user_id}"
-        logger.info(f"[FeedbackBot] 📨 Получено текстовое сообщения от {display_name} ({user_id}) в группе {chat_id}: {len(text)} символов")
-        
-        if feedback_bot_handler is None:
-            logger.warning("[FeedbackBot] ❌ FeedbackBotHandler не инициализирован")
-            return
-        
-        # Получаем или создаем историю диалога для этой группы
-        if chat_id not in feedback_chat_history:
-            feedback_chat_history[chat_id] = []
-            logger.info(f"[FeedbackBot] Создана новая история для группы {chat_id}")
-        
-        logger.debug(f"[FeedbackBot] История диалога: {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Формируем историю в формате для LLM (с именами пользователей)
-        chat_history = []
-        for msg in feedback_chat_history[chat_id]:
-            chat_history.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        
-        logger.debug(f"[FeedbackBot] Передаю в LLM историю: {len(chat_history)} сообщенияй")
-        
-        # Формируем сообщения с именем пользователя для LLM
-        user_message_with_name = f"{display_name}: {text}" if user_name else text
-        
-        # Запускаем постоянное обновление статуса "печатает"
-        typing_task = asyncio.create_task(_keep_typing_status(chat_id))
-        logger.info(f"[FeedbackBot] ⌨️ Запущено постоянное обновление статуса 'печатает' для чата {chat_id}")
-        
+    if success:
+        db.log_admin_action(
+            admin_user_id=user_id,
+            admin_username=username,
+            action_type="ban_user",
+            target_user_id=target_user_id,
+            new_value=new_value,
+            details={"admin_command": True},
+            chat_id=chat_id,
+            message_id=message_id,
+            success=True
+        )
         try:
-            # Обрабатываем запрос
-            logger.info(f"[FeedbackBot] 🤖 Отправляю запрос в FeedbackBotHandler...")
-            response = await feedback_bot_handler.process_feedback_query(
-                user_message=user_message_with_name,
-                chat_history=chat_history if chat_history else None
-            )
-            logger.info(f"[FeedbackBot] ✅ Получен ответ от FeedbackBot: {len(response)} символов")
-        finally:
-            # Останавливаем обновление статуса как только ответ готов
-            typing_task.cancel()
-            try:
-                await typing_task
-            except asyncio.CancelledError:
-                pass
-            logger.info(f"[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата {chat_id}")
-        
-        # Сохраняем сообщения пользователя в историю (с именем)
-        feedback_chat_history[chat_id].append({
-            "role": "user",
-            "content": f"{display_name}: {text}" if user_name else text
-        })
-        
-        # Сохраняем ответ бота в историю
-        feedback_chat_history[chat_id].append({
-            "role": "assistant",
-            "content": response
-        })
-        
-        logger.info(f"[FeedbackBot] 💾 Сохранено в историю: {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Ограничиваем размер истории (последние 20 сообщенияй)
-        if len(feedback_chat_history[chat_id]) > 20:
-            old_len = len(feedback_chat_history[chat_id])
-            feedback_chat_history[chat_id] = feedback_chat_history[chat_id][-20:]
-            logger.info(f"[FeedbackBot] ✂️ История обрезана: {old_len} -> {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Отправляем ответ
-        logger.info(f"[FeedbackBot] 📤 Отправляю ответ в группу {chat_id}...")
-        # Очищаем ответ от markdown-разметки для чистого отображения
-        clean_response = _clean_markdown_formatting(response)
-        await send_telegram_message(chat_id, clean_response)
-        logger.info(f"[FeedbackBot] ✅ Обработка сообщения завершена успешно")
-
-    except Exception as e:
-        logger.error(f"[FeedbackBot] ❌ Ошибка при обработке сообщения: {e}", exc_info=True)
-        await send_telegram_message(chat_id, "Извините, произошла ошибка при обработке вашего сообщения.")
-
+            if new_value == "permanent":
+                await send_telegram_message(target_user_id, "⛔ **Вы заблокированы в боте навсегда.**", parse_mode="Markdown")
+            else:
+                await send_telegram_message(target_user_id, f"⛔ **Вы заблокированы в боте на {days} дн.**", parse_mode="Markdown")
+        except Exception as e:
+            logger.warning("⚠️ Не удалось отправить уведомление о бане %s: %s", target_user_id, e)
+        await send_telegram_message(chat_id, f"⛔ Бан выдан пользователю {target_user_id}: {new_value}")
+    else:
+        await send_telegram_message(chat_id, f"❌ Не удалось выдать бан пользователю {target_user_id}")
 
-async def _keep_typing_status(chat_id: str):
-    """Периодически обновляет статус 'печатает' каждые 4 секунды"""
-    try:
-        while True:
-            await send_chat_action(chat_id, "typing")
-            logger.debug(f"[FeedbackBot] ⌨️ Обновлен статус 'печатает' в чат {chat_id}")
-            await asyncio.sleep(4)  # Обновляем каждые 4 секунды
-            
-    except asyncio.CancelledError:
-        logger.debug(f"[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата {chat_id}")
-        raise
-    except Exception as e:
-        logger.error(f"[FeedbackBot] ❌ Ошибка обновления статуса 'печатает': {e}")
 
+async def _admin_unban(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin unban <user_id>: снятие бана."""
+    target_user_id = args
+    if not target_user_id.isdigit():
+        await send_telegram_message(chat_id, "❌ Использование: /admin unban <user_id>")
+        return
 
-async def handle_feedback_bot_photo(chat_id: str, user_id: str, message: Dict[str, Any]):
-    """Обрабатывает фото в FeedbackBot группе - анализирует и передает в FeedbackBot"""
-    try:
-        if feedback_bot_handler is None:
-            logger.warning("FeedbackBotHandler не инициализирован")
-            return
-        
-        # Получаем список фотографий (разные размеры)
-        photos = message.get("photo", [])
-        if not photos:
-            logger.warning(f"Сообщения не содержит фотографий: {message}")
-            return
-        
-        # Берем самую большую фотографию (последнюю в списке)
-        photo = photos[-1]
-        file_id = photo.get("file_id")
-        
-        if not file_id:
-            logger.warning(f"Не удалось получить file_id фотографии: {photo}")
-            return
-        
-        # Извлекаем имя пользователя
-        user = message.get("from", {})
-        user_name = None
-        if user:
-            first_name = user.get("first_name", "")
-            last_name = user.get("last_name", "")
-            username = user.get("username", "")
-            if first_name or last_name:
-                user_name = f"{first_name} {last_name}".strip()
-            elif username:
-                user_name = f"@{username}"
-        
-        display_name = user_name if user_name else f"Пользователь {user_id}"
-        logger.info(f"[FeedbackBot] 📸 Получено фото от {display_name} ({user_id}) в группе {chat_id}, file_id: {file_id}")
-        
-        # Отправляем сообщения о начале ������бработки
-        logger.info(f"[FeedbackBot] Отправляю уведомление о начале анализа изображения")
-        await send_telegram_message(chat_id, "🔍 Анализирую изображение...")
-        
-        # Скачиваем фото
-        logger.info(f"[FeedbackBot] Скачиваю фото {file_id}...")
-        local_path = temp_dir / f"feedback_photo_{os.getpid()}.jpg"
-        downloaded_path = await download_telegram_file(file_id, local_path)
-        
-        if not downloaded_path:
-            logger.error(f"[FeedbackBot] ❌ Не удалось скачать фото: {file_id}")
-            await send_telegram_message(chat_id, "❌ Не удалось скачать фот�� для анализа.")
-            return
-        
-        logger.info(f"[FeedbackBot] ✅ Фото скачано: {downloaded_path}")
-        
-        # Ана��изируем изображение через мультимодальную модель
-        logger.info(f"[FeedbackBot] 🔍 Начинаю анализ изображения через мультимодальную модель...")
-        from backend.vision.image_analyzer import ImageAnalyzer
-        analyzer = ImageAnalyzer(config)
-        
-        # Промпт для анализа изображения (из IKAR-ASSISTANT)
-        prompt = "Что на этом изображении? Опиши подробно, но кратко. Используй русский язык."
-        logger.debug(f"[FeedbackBot] Промпт для анализа: {prompt}")
-        
-        description = await analyzer.analyze_image(downloaded_path, prompt)
-        logger.info(f"[FeedbackBot] ✅ Изображение проанализиров��но: {len(description)} символов описания")
-        
-        # Удаляем временный файл
+    success = db.remove_user_ban(target_user_id)
+    if success:
+        db.log_admin_action(
+            admin_user_id=user_id,
+            admin_username=username,
+            action_type="unban_user",
+            target_user_id=target_user_id,
+            details={"admin_command": True},
+            chat_id=chat_id,
+            message_id=message_id,
+            success=True
+        )
         try:
-            os.remove(downloaded_path)
+            await send_telegram_message(target_user_id, "✅ **Блокировка в боте снята.**", parse_mode="Markdown")
         except Exception as e:
-            logger.error(f"Ошибка при удалении временного файла: {e}")
-        
-        if not description:
-            logger.error(f"Не удалось проанализировать изображение: {file_id}")
-            await send_telegram_message(chat_id, "❌ Не удалось проанализировать изображение.")
-            return
-        
-        # Извлекаем имя пользователя
-        user = message.get("from", {})
-        user_name = None
-        if user:
-            first_name = user.get("first_name", "")
-            last_name = user.get("last_name", "")
-            username = user.get("username", "")
-            if first_name or last_name:
-                user_name = f"{first_name} {last_name}".strip()
-            elif username:
-                user_name = f"@{username}"
-        
-        display_name = user_name if user_name else f"Пользователь {user_id}"
-        
-        # Формируем сообщения для FeedbackBot с описанием изображения
-        # Просто передаем описание, без лишних инструкций - бот сам определит что делать
-        user_message = f"{display_name} отправил изображение. Описание: {description}" if user_name else f"Пользователь отправил изображение. Описание: {description}"
-        logger.info(f"[FeedbackBot] 📝 Формирую запрос для FeedbackBot: {len(user_message)} символов")
-        
-        # Получаем или создаем историю диалога для этой группы
-        if chat_id not in feedback_chat_history:
-            feedback_chat_history[chat_id] = []
-            logger.info(f"[FeedbackBot] Создана новая история для группы {chat_id}")
-        
-        logger.info(f"[FeedbackBot] История диалога: {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Формируем историю в формате для LLM
-        chat_history = []
-        for msg in feedback_chat_history[chat_id]:
-            chat_history.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        
-        logger.debug(f"[FeedbackBot] Передаю в LLM историю: {len(chat_history)} сообщенияй")
-        
-        # Запускаем постоянное обновление статуса "печатает"
-        typing_task = asyncio.create_task(_keep_typing_status(chat_id))
-        logger.info(f"[FeedbackBot] ⌨️ Запущено постоянное обновление статуса 'печатает' для чата {chat_id}")
-        
+            logger.warning("⚠️ Не удалось отправить уведомление о разбане %s: %s", target_user_id, e)
+        await send_telegram_message(chat_id, f"✅ Бан снят с пользователя {target_user_id}")
+    else:
+        await send_telegram_message(chat_id, f"❌ Не удалось снять бан с пользователя {target_user_id}")
+
+
+async def _admin_maintenance(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin maintenance HH:MM: включить тех.работы."""
+    until_time = args
+
+    # Проверяем формат времени
+    if not _MAINTENANCE_TIME_RE.match(until_time):
+        await send_telegram_message(chat_id, "❌ Неверный формат времени.\n\nИспользуйте формат HH:MM (например, 17:00)")
+        return
+
+    # Включаем тех.работы
+    db.set_maintenance_mode(True, until_time)
+    _set_maintenance_state(True, until_time)
+
+    await send_telegram_message(
+        chat_id,
+        f"✅ **Режим тех.работ включён**\n\nДо: {until_time}\n\nВсе пользователи (кроме админов) будут получать уведомление."
+    )
+
+
+async def _admin_maintenance_off(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin maintenance_off: выключить тех.работы и уведомить пользователей."""
+    # Выключаем тех.работы
+    db.set_maintenance_mode(False)
+    _set_maintenance_state(False)
+
+    # Отправляем уведомление всем пользователям
+    user_ids = db.get_all_users_for_notification()
+    notified = 0
+    for uid in user_ids:
         try:
-            # Обрабатываем запрос через FeedbackBot
-            logger.info(f"[FeedbackBot] 🤖 Отправляю запрос в FeedbackBotHandler...")
-            response = await feedback_bot_handler.process_feedback_query(
-                user_message=user_message,
-                chat_history=chat_history if chat_history else None
-            )
-            logger.info(f"[FeedbackBot] ✅ Получен ответ от FeedbackBot: {len(response)} символов")
-        finally:
-            # Останавливаем обновление статуса как только ответ готов
-            typing_task.cancel()
-            try:
-                await typing_task
-            except asyncio.CancelledError:
-                pass
-            logger.info(f"[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата {chat_id}")
-        
-        # Сохраняем в историю (с именем)
-        feedback_chat_history[chat_id].append({
-            "role": "user",
-            "content": f"{display_name} [Изображение]: {description}" if user_name else f"[Изображение] {description}"
-        })
-        
-        feedback_chat_history[chat_id].append({
-            "role": "assistant",
-            "content": response
-        })
-        
-        logger.info(f"[FeedbackBot] 💾 Сохранено в историю: {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Ограничиваем размер истории
-        if len(feedback_chat_history[chat_id]) > 20:
-            old_len = len(feedback_chat_history[chat_id])
-            feedback_chat_history[chat_id] = feedback_chat_history[chat_id][-20:]
-            logger.info(f"[FeedbackBot] ✂️ История обрезана: {old_len} -> {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Отправляем ответ
-        logger.info(f"[FeedbackBot] 📤 Отправляю ответ в группу {chat_id}...")
-        # Очищаем ответ от markdown-разметки для чистого отображения
-        clean_response = _clean_markdown_formatting(response)
-        await send_telegram_message(chat_id, clean_response)
-        logger.info(f"[FeedbackBot] ✅ Обработка фото завершена успешно")
+            await send_telegram_message(uid, MAINTENANCE_OFF_TEXT)
+            notified += 1
+        except Exception:
+            pass  # Игнорируем ошибки (пользователь мог заблокировать бота)
+
+    await send_telegram_message(
+        chat_id,
+        f"✅ **Режим тех.работ выключен**\n\nУведомлено пользователей: {notified}"
+    )
 
-    except Exception as e:
-        logger.error(f"Ошибка при обработке фото FeedbackBot: {e}")
-        await send_telegram_message(chat_id, "Извините, произошла ошибка при обработке изображения.")
 
+async def _admin_remove_level(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin remove_level <user_id>: сбросить уровень доступа до user."""
+    target_user_id = args
 
-async def handle_feedback_bot_voice(chat_id: str, user_id: str, message: Dict[str, Any]):
-    """Обрабатывает голосовое сообщения в FeedbackBot группе - распознает и передает в FeedbackBot"""
-    try:
-        if feedback_bot_handler is None:
-            logger.warning("FeedbackBotHandler не инициализирован")
-            return
-        
-        # Получаем голосовое сообщения или аудио
-        voice = message.get("voice") or message.get("audio")
-        if not voice:
-            logger.warning(f"Сообщения не содержит голосового сообщения: {message}")
-            return
-        
-        file_id = voice.get("file_id")
-        if not file_id:
-            logger.warning(f"Не удалось получить file_id голосового сообщения: {voice}")
-            return
-        
-        logger.info(f"[FeedbackBot] 🎤 Получено голосовое сообщения от {user_id} в группе {chat_id}, file_id: {file_id}")
-        
-        # Отправляем сообщения о начале обработки
-        await send_telegram_message(chat_id, "🎤 Распознаю речь...")
-        
-        # Скачиваем аудиофайл
-        temp_dir = Path(__file__).parent.parent.parent / "temp"
-        temp_dir.mkdir(exist_ok=True)
-        local_path = temp_dir / f"feedback_voice_{os.getpid()}.ogg"
-        downloaded_path = await download_telegram_file(file_id, local_path)
-        
-        if not downloaded_path:
-            logger.error(f"[FeedbackBot] ❌ Не удалось скачать голосовое сообщения: {file_id}")
-            await send_telegram_message(chat_id, "❌ Не удалось скачать голосовое сообщения.")
-            return
-        
-        logger.info(f"[FeedbackBot] ✅ Голосовое сообщения скачано: {downloaded_path}")
-        
-        # Распознаем речь через STT
-        logger.info(f"[FeedbackBot] 🎙️ Начинаю распознавание речи...")
-        from backend.voice.stt import SpeechToText
-        stt = SpeechToText()
-        recognized_text = await stt.speech_to_text(downloaded_path, language="ru")
-        
-        # Удаляем временный файл
+    if not target_user_id or not target_user_id.isdigit():
+        await send_telegram_message(chat_id, "❌ Использование: /admin remove_level [user_id]")
+        return
+
+    # Получаем текущий уровень
+    old_level = db.get_user_access_level(target_user_id)
+
+    # Добавляем пользователя если не существует
+    db.add_or_update_user(target_user_id)
+
+    success = db.set_user_access_level(target_user_id, "user")
+
+    # Логируем действие администратора
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="remove_level",
+        target_user_id=target_user_id,
+        old_value=old_level,
+        new_value="user",
+        chat_id=chat_id,
+        message_id=message_id,
+        success=success
+    )
+
+    if success:
+        await send_telegram_message(chat_id, f"✅ Уровень доступа снят\n\nПользователь: {target_user_id}\nБыло: {old_level}\nСтало: 👤 Пользователь (3 в день)")
+
+        # Отправляем уведомление пользователю
         try:
-            os.remove(downloaded_path)
+            await send_telegram_message(target_user_id, f"👤 Ваш уровень доступа изменен.\n\nБыло: {old_level}\nСтало: 3 генерации в день.\n\nСпасибо за использование LiraAI MultiAssistent!")
         except Exception as e:
-            logger.error(f"Ошибка при удалении временного файла: {e}")
-        
-        if not recognized_text or not recognized_text.strip():
-            logger.error(f"[FeedbackBot] ❌ Не удалось распознать речь: {file_id}")
-            await send_telegram_message(chat_id, "❌ Не удалось распознать речь.")
-            return
-        
-        logger.info(f"[FeedbackBot] ✅ Речь распознана: {len(recognized_text)} символов")
-        
-        # Получаем или создаем историю диалога для этой группы
-        if chat_id not in feedback_chat_history:
-            feedback_chat_history[chat_id] = []
-            logger.info(f"[FeedbackBot] Создана новая история для группы {chat_id}")
-        
-        logger.info(f"[FeedbackBot] История диалога: {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Формируем и��торию в формате для LLM
-        chat_history = []
-        for msg in feedback_chat_history[chat_id]:
-            chat_history.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        
-        logger.debug(f"[FeedbackBot] Передаю в LLM историю: {len(chat_history)} сообщенияй")
-        
-        # Извлекаем имя пользователя
-        user = message.get("from", {})
-        user_name = None
-        if user:
-            first_name = user.get("first_name", "")
-            last_name = user.get("last_name", "")
-            username = user.get("username", "")
-            if first_name or last_name:
-                user_name = f"{first_name} {last_name}".strip()
-            elif username:
-                user_name = f"@{username}"
-        display_name = user_name if user_name else f"Пользователь {user_id}"
+            logger.warning("⚠️ Не удалось отправить уведомление пользователю %s: %s", target_user_id, e)
+    else:
+        await send_telegram_message(chat_id, "❌ Ошибка при снятии уровня")
 
-        # Формируем сообщения с именем пользователя для LLM
-        user_message_with_name = f"{display_name} [Голосовое]: {recognized_text}" if user_name else f"[Голосовое] {recognized_text}"
-        
-        # Запускаем постоянное обновление статуса "печатает"
-        typing_task = asyncio.create_task(_keep_typing_status(chat_id))
-        logger.info(f"[FeedbackBot] ⌨️ Запущено постоянное обновление статуса 'печатает' для чата {chat_id}")
-        
+
+async def _admin_set_level(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin set_level <user_id> <level>: установить уровень доступа."""
+    # Парсим команду: /admin set_level user_id level
+    parts = args.split()
+    logger.info("🔧 Admin command: set_level, parts: %s, len: %s", parts, len(parts))
+
+    if len(parts) != 2:
+        await send_telegram_message(chat_id, f"❌ Использование: /admin set_level [user_id] [level]\n\nПример:\n/admin set_level 123456789 subscriber")
+        return
+
+    target_user_id = parts[0]
+    new_level = parts[1]
+
+    logger.info("🔧 Set level: %s -> %s", target_user_id, new_level)
+
+    if new_level not in ACCESS_LEVELS:
+        await send_telegram_message(chat_id, f"❌ Недопустимый уровень. Доступные: {', '.join(ACCESS_LEVELS.keys())}")
+        return
+
+    # Получаем текущий уровень
+    old_level = db.get_user_access_level(target_user_id)
+
+    # Добавляем пользователя если не существует
+    db.add_or_update_user(target_user_id)
+
+    success = db.set_user_access_level(target_user_id, new_level)
+
+    # Логируем действие администратора
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="set_level",
+        target_user_id=target_user_id,
+        old_value=old_level,
+        new_value=new_level,
+        chat_id=chat_id,
+        message_id=message_id,
+        success=success
+    )
+
+    if success:
+        level_names = {"admin": "👑 Админ", "subscriber": "⭐ Подписчик", "user": "👤 Пользователь"}
+        await send_telegram_message(chat_id, f"✅ Уровень доступа изменен\n\nПользователь: {target_user_id}\nБыло: {level_names.get(old_level, old_level)}\nСтало: {level_names.get(new_level, new_level)}")
+
+        # Отправляем уведомление пользователю
+        level_messages = {
+            "admin": "🎉 Поздравляем! Вам предоставлены права администратора.\n\nТеперь у вас безлимитная генерация изображений!\n\nИспользуйте /admin для управления ботом.",
+            "subscriber": "⭐ Ваш уровень доступа повышен!\n\nТеперь у вас 5 генераций изображений в день.\n\nСпасибо за использование LiraAI MultiAssistent!",
+            "user": "👤 Ваш уровень доступа изменен.\n\nТеперь у вас 3 генерации изображений в день.\n\nСпасибо за использование LiraAI MultiAssistent!"
+        }
         try:
-            # Обрабатываем запрос через FeedbackBot
-            logger.info(f"[FeedbackBot] 🤖 Отправляю распознанный текст в FeedbackBotHandler...")
-            response = await feedback_bot_handler.process_feedback_query(
-                user_message=user_message_with_name,
-                chat_history=chat_history if chat_history else None
-            )
-            logger.info(f"[FeedbackBot] ✅ Получен ответ от FeedbackBot: {len(response)} символо��")
-        finally:
-            # Останавливаем обновление статуса как только ответ готов
-            typing_task.cancel()
+            await send_telegram_message(target_user_id, level_messages.get(new_level, f"Ваш уровень доступа изменен на {new_level}"))
+        except Exception as e:
+            logger.warning("⚠️ Не удалось отправить уведомление пользователю %s: %s", target_user_id, e)
+    else:
+        await send_telegram_message(chat_id, "❌ Ошибка при установке уровня")
+
+
+async def _admin_add_user(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin add_user <user_id>: добавить пользователя в базу."""
+    target_user_id = args
+
+    if not target_user_id or not target_user_id.isdigit():
+        await send_telegram_message(chat_id, "❌ Использование: /admin add_user [user_id]\n\nПример:\n/admin add_user 123456789")
+        return
+
+    db.add_or_update_user(target_user_id)
+
+    # Логируем действие администратора
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="add_user",
+        target_user_id=target_user_id,
+        chat_id=chat_id,
+        message_id=message_id,
+        success=True
+    )
+
+    await send_telegram_message(chat_id, f"✅ Пользователь {target_user_id} добавлен в базу")
+
+
+async def _admin_remove_user(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin remove_user <user_id>: удалить пользователя из базы."""
+    target_user_id = args
+
+    if not target_user_id or not target_user_id.isdigit():
+        await send_telegram_message(chat_id, "❌ Использование: /admin remove_user [user_id]")
+        return
+
+    success = db.remove_user(target_user_id)
+
+    # Логируем действие администратора
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="remove_user",
+        target_user_id=target_user_id,
+        chat_id=chat_id,
+        message_id=message_id,
+        success=success
+    )
+
+    if success:
+        await send_telegram_message(chat_id, f"✅ Пользователь {target_user_id} удален из базы данных")
+    else:
+        await send_telegram_message(chat_id, f"❌ Ошибка при удалении пользователя {target_user_id}")
+
+
+async def _admin_users(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin users: список пользователей с пагинацией."""
+    # Сохраняем страницу 0 в сессии
+    mode_mgr = get_mode_manager()
+    mode_mgr.set_mode(user_id, "admin_users_page_0")
+
+    users = db.get_all_users()
+    users_text, buttons = _build_admin_users_page(users, page_num=0)
+
+    await send_telegram_message_with_buttons(chat_id, users_text, buttons)
+
+
+async def _admin_broadcast(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin broadcast (или mes) <текст>: рассылка уведомления всем пользователям."""
+    message = args
+
+    if not message:
+        await send_telegram_message(
+            chat_id,
+            "❌ Использование: /admin broadcast [сообщения]\n\nПример: /admin mes Друзья, Grok сейчас недоступен, пользуйтесь моделями OpenRouter"
+        )
+        return
+
+    # Получаем всех пользователей
+    all_users = db.get_all_users_for_notification()
+
+    # Логируем список пользователей для отладки
+    logger.info("📢 Рассылка: найдено %s пользователей: %s", len(all_users), all_users)
+
+    # Отправляем сообщения о начале рассылки
+    await send_telegram_message(
+        chat_id,
+        f"📢 Начинаю рассылку уведомления {len(all_users)} пользователям...\n\n����ообщения: {message[:100]}{'...' if len(message) > 100 else ''}"
+    )
+
+    # Рассылаем сообщения всем пользователям параллельно; частоту ограничивает
+    # token bucket бота в _api_call, семафор - число одновременных запросов
+    broadcast_sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    admin_uid = str(user_id)
+    broadcast_body = f"📢 **Уведомление от администратора**\n\n{message}"
+
+    async def _broadcast_one(uid: str) -> bool:
+        # Пропускаем самого админа (он уже получил сообщения)
+        if uid == admin_uid:
+            return True
+        async with broadcast_sem:
             try:
-                await typing_task
-            except asyncio.CancelledError:
-                pass
-            logger.info(f"[FeedbackBot] ⏹️ Остановлено обновление статуса 'печатает' для чата {chat_id}")
-        
-        # Сохраняем в историю (с именем)
-        feedback_chat_history[chat_id].append({
-            "role": "user",
-            "content": f"{display_name} [Голосовое]: {recognized_text}" if user_name else f"[Голосовое] {recognized_text}"
-        })
-        
-        feedback_chat_history[chat_id].append({
-            "role": "assistant",
-            "content": response
-        })
-        
-        logger.info(f"[FeedbackBot] 💾 Сохранено в историю: {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Ограничиваем размер истории
-        if len(feedback_chat_history[chat_id]) > 20:
-            old_len = len(feedback_chat_history[chat_id])
-            feedback_chat_history[chat_id] = feedback_chat_history[chat_id][-20:]
-            logger.info(f"[FeedbackBot] ✂️ История обрезана: {old_len} -> {len(feedback_chat_history[chat_id])} сообщенияй")
-        
-        # Отправляем ответ
-        logger.info(f"[FeedbackBot] 📤 Отправляю ответ в группу {chat_id}...")
-        # Очищаем ответ от markdown-разметки для чистого отображения
-        clean_response = _clean_markdown_formatting(response)
-        await send_telegram_message(chat_id, clean_response)
-        logger.info(f"[FeedbackBot] ✅ Обработка голосового сообщения завершена успешно")
-        
-    except Exception as e:
-        logger.error(f"[FeedbackBot] ❌ Ошибка при обработке голосового сообщения: {e}", exc_info=True)
-        await send_telegram_message(chat_id, "Извините, произошла ошибка при обработке голосового сообщения.")
+                return await send_telegram_message(uid, broadcast_body)
+            except Exception as e:
+                logger.error("❌ Ошибка отправки уведомления пользователю %s: %s", uid, e)
+                return False
+
+    results = await asyncio.gather(*(_broadcast_one(uid) for uid in all_users))
+    failed_users = [uid for uid, ok in zip(all_users, results) if not ok]
+    fail_count = len(failed_users)
+    success_count = len(results) - fail_count
+
+    # Формируем отчет
+    report_lines = [
+        "✅ Рассылка завершена!",
+        "",
+        "📊 Результат:",
+        f"• Успешно: {success_count}",
+        f"• Ошибок: {fail_count}",
+        f"• Всего: {len(all_users)}",
+    ]
+    if failed_users:
+        report_lines += ["", "❌ Не удалось отправить:", *failed_users[:10]]
 
+    await send_telegram_message(chat_id, "\n".join(report_lines))
 
-async def handle_text_message(chat_id: str, user_id: str, text: str, is_group: bool = False):
-    """Обрабатывает текстовое сообщения через LLM с учётом режима пользователя"""
-    try:
-        if not text or not text.strip():
-            return
 
-        # Добавляем пользователя в базу
-        from backend.database.users_db import get_database
-        db = get_database()
-        db.add_or_update_user(user_id)
+async def _admin_stats(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin stats: общая статистика."""
+    # Агрегаты считает база, список пользователей целиком не грузим
+    summary = db.get_stats_summary()
+    levels = summary["levels"]
+    total_users = summary["total_users"]
+    total_gens = summary["total_gens"]
 
-        # Получаем режим пользователя
-        mode = mode_manager.get_mode(user_id)
-        logger.info(f"📊 Пользователь {user_id} в режиме: {mode}")
+    admin_count = levels.get('admin', 0)
+    subscriber_count = levels.get('subscriber', 0)
+    user_count = levels.get('user', 0)
 
-        # Обработка в зависимости от режима
-        if mode == "privacy":
-            # Политика конфиденциальности
-            privacy_url = "https://telegra.ph/Politika-konfidencialnosti-obshchij-dokument-03-01"
-            privacy_text = f"""🔒 **Политика конфиденциальности**
+    stats_text = f"""📊 Общая статистика
 
-Мы заботимся о вашей конфиденциальности.
+👥 Пользователей: {total_users}
+👑 Админов: {admin_count}
+⭐ Подписчиков: {subscriber_count}
+👤 Пользователей: {user_count}
 
-📄 Полный текст политики конфиденциальности доступен по ссылке:
-{privacy_url}
+🎨 Всего генераций: {total_gens}
+"""
+    await send_telegram_message(chat_id, stats_text)
 
-**Кратко:**
-• Мы храним только историю диалогов для улучшения качества общения
-• Ваши данные не передаются третьим лицам
-• Вы можете запросить удаление ваших данных через администратора
 
-Нажимая кнопку «🔒 Политика конфиденциальности», вы подтверждаете, что ознакомились с документом."""
+async def _admin_admin_stats(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin admin_stats: статистика действий администратора."""
+    # Получаем статистику администратора
+    admin_stats = db.get_admin_stats(user_id)
 
-            # Отправляем с кнопкой-ссылкой
-            buttons = [
-                [{"text": "📄 Открыть документ", "url": privacy_url}]
-            ]
-            await send_telegram_message_with_buttons(chat_id, privacy_text, buttons)
-            return
+    if not admin_stats:
+        await send_telegram_message(chat_id, "❌ Статистика не найдена")
+        return
 
-        if mode == "help":
-            # В режиме помощи показываем справку
-            db = get_database()
-            
-            # Сохраняем запрос пользователя в историю
-            db.save_dialog_message(user_id, "user", "❓ Помощь", model="system")
-            
-            help_text = """ℹ️ **Помощь - LiraAI MultiAssistant**
+    stats_text = f"""📊 Ваша статистика администратора
 
-**Команды:**
-• /start - Главное меню
-• /menu - Показать клавиатуру
-• /hide - Скрыть клавиатуру
-• /models - Выбор модели
-• /generate [описание] - Генерация изображения
-• /stats - Ваша статистистика
+🔧 Всего действий: {admin_stats.get('total_actions', 0)}
+✅ Успешных: {admin_stats.get('successful_actions', 0)}
+❌ Ошибок: {admin_stats.get('failed_actions', 0)}
 
-**Возможности:**
-• 💬 Общение на русском языке
-• 🎨 Генерация изображений
-• 🎤 Распознавание голоса
-• 📸 Анализ фотографий
+📈 Детализация:
+• Изменений уровня: {admin_stats.get('level_changes', 0)}
+• Добавлено пользователей: {admin_stats.get('users_added', 0)}
+• Удалено пользователей: {admin_stats.get('users_removed', 0)}
+• Просмотров истории: {admin_stats.get('history_views', 0)}
 
-**Режимы:**
-• 💬 Текст - обычное общения
-• 🎤 Голос - распознавание речи
-• 📸 Фото - анализ изображений
-• 🎨 Генерация - создание изображений
+💡 Используйте /admin log чтобы увидеть последние действия
+"""
+    await send_telegram_message(chat_id, stats_text)
 
-Бот запоминает последние 10 сообщенияй вашего диалога!"""
-            await send_telegram_message(chat_id, help_text)
-            
-            # Сохраняем ответ бота в историю
-            db.save_dialog_message(user_id, "assistant", "Помощь показана", model="system")
-            return
 
-        elif mode == "stats":
-            # В режиме статистики показываем статистику
-            from backend.database.users_db import get_database
-            db = get_database()
-            
-            # Принудительно обновляем данные пользователя из БД
-            stats = db.get_user_stats(user_id)
-            
-            if stats:
-                level_info = {
-                    "admin": "👑 Администратор (безлимит)",
-                    "subscriber": "⭐ Подписчик (5 в день)",
-                    "user": "👤 Пользователь (3 в день)"
-                }
-                level = stats.get('access_level', 'user')
-                first_name = stats.get('first_name', '')
-                username = stats.get('username', '')
-                
-                name_parts = []
-                if first_name:
-                    name_parts.append(first_name)
-                if username:
-                    name_parts.append(f"@{username}")
+async def _admin_pay_confirm(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin pay_confirm <user_id>: ручное подтверждение оплаты."""
+    target_user_id = args
 
-                name = " ".join(name_parts) if name_parts else f"User {user_id}"
-                
-                # Получаем информацию о лимитах
-                limit_info = db.check_generation_limit(user_id)
-                daily_count = limit_info.get('daily_count', 0)
-                daily_limit = limit_info.get('daily_limit', 3)
-                reset_time = limit_info.get('reset_time', 'завтра в 00:00')
-                level = limit_info.get('access_level', 'user')  # Берём уровень из check_generation_limit!
+    if not target_user_id or not target_user_id.isdigit():
+        await send_telegram_message(
+            chat_id,
+            "❌ Использование: /admin pay_confirm [user_id]\n\nПример: /admin pay_confirm 999888777"
+        )
+        return
 
-                stats_text = f"""📊 **Ваша статистика**
+    # Получаем текущий уровень
+    old_level = db.get_user_access_level(target_user_id)
 
-👤 {name}
-🔑 Уровень: **{level_info.get(level, 'Пользователь')}**
+    if old_level not in ("user", "subscriber"):
+        await send_telegram_message(
+            chat_id,
+            f"❌ Пользователь {target_user_id} уже имеет уровень {old_level}"
+        )
+        return
 
-📈 Генерации изображений:
-• Сегодня: **{daily_count}/{daily_limit}**
-• Всего: {stats.get('total_count', 0)}
-• Лимит обновится: **{reset_time}**
+    # Повышаем до sub+
+    if db.set_user_access_level(target_user_id, "sub+"):
+        # Сбрасываем дневной счётчик генераций чтобы пользователь получил полные 30
+        db.reset_daily_generation_count(target_user_id)
+
+        # Логируем
+        db.log_admin_action(
+            admin_user_id=user_id,
+            admin_username=username,
+            action_type="set_level",
+            target_user_id=target_user_id,
+            old_value=old_level,
+            new_value="sub+",
+            details={"manual_payment_confirm": True, "daily_count_reset": True},
+            chat_id=chat_id,
+            message_id=message_id,
+            success=True
+        )
 
-💬 Сообщения в боте:
-• Сегодня: {stats.get('messages_today', 0)}
+        await send_telegram_message(
+            chat_id,
+            f"✅ Оплата подтверждена!\n\n"
+            f"Пользователь: {target_user_id}\n"
+            f"Уровень: {old_level} → sub+\n"
+            f"🎁 Дневной счётчик сброшен: 0/30\n\n"
+            f"🎉 Теперь у пользователя 30 генераций в день!"
+        )
 
-📅 В боте с: {stats.get('created_at', 'неизвестно')[:10]}
+        # Уведомляем пользователя
+        try:
+            await send_telegram_message(
+                target_user_id,
+                f"✅ **Оплата подтверждена!**\n\n"
+                f"Ваш уровень повышен до **sub+**!\n\n"
+                f"🎁 **Вам доступно 30 генераций изображений в день!**\n\n"
+                f"Дневной счётчик сброшен и теперь у вас **0/30** генераций.\n\n"
+                f"Спасибо за поддержку LiraAI! 💜",
+                parse_mode="Markdown"
+            )
+        except Exception as e:
+            logger.warning("⚠️ Не удалось отправить уведомление %s: %s", target_user_id, e)
+    else:
+        await send_telegram_message(chat_id, "❌ Ошибка при повышении уровня")
 
-💡 **Совет:** Используйте `/clear` чтобы очистить историю диалога"""
-                await send_telegram_message(chat_id, stats_text)
-            else:
-                await send_telegram_message(chat_id, "❌ Не удалось получить статистику")
-            # После показа статистики сбрасываем режим в auto
-            mode_manager.set_mode(user_id, "auto")
-            return
 
-        elif mode == "generation":
-            # В режиме генерации - если есть текст, генерируем изображение
-            if text:
-                # Загружаем модель из БД
-                db = get_database()
-                model_key = db.get_user_image_model(user_id)
-                if model_key:
-                    logger.info(f"💾 Загружена image_model из БД для {user_id}: {model_key}")
-                await handle_image_generation(chat_id, user_id, text, model_key)
-                return
-            else:
-                # Если нет текста - показываем выбор модели
-                db = get_database()
-                user_access_level = db.get_user_access_level(user_id)
-                keyboard = create_image_model_selection_keyboard(user_access_level)
-                await send_telegram_message(
-                    chat_id,
-                    f"🎨 **Генерация изображений**\n\n📊 Твой уровень доступа: **{user_access_level}**\n\nВыберите модель для генерации:",
-                    reply_markup=keyboard,
-                    parse_mode="Markdown"
-                )
-                return
-        # Получаем модель пользователя
-        model_key = user_models.get(user_id, "groq-llama")
-        model_info = AVAILABLE_MODELS.get(model_key, ("groq", "openai/gpt-oss-20b"))
-        client_type, model = model_info
-        
-        logger.info(f"🎯 {user_id} использует модель: {model_key} ({client_type} - {model})")
+async def _admin_pay_decline(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin pay_decline <user_id>: отклонение оплаты."""
+    target_user_id = args
 
-        # Системный промпт для русского языка с памятью
-        system_prompt = """# О БОТЕ И ПЛАТФОРМЕ
-Ты находишься в Telegram боте @liranexus. Пользователи общаются с тобой через текстовые сообщения, голосовые сообщения и фотографии в Telegram.
-Ты — LiraAI, умный, заботливый и оптимистичный AI-ассистент женского пола.
-Твой стиль общения: тёплый, поддерживающий, немного с лёгким юмором, но всегда по делу.
-Ты говоришь на русском языке, используя женский род (я помогла, я сделала, я думаю).
-Твоя цель — быть максимально полезной пользователю, помогать ему решать задачи и просто быть приятным собеседником.
+    if not target_user_id or not target_user_id.isdigit():
+        await send_telegram_message(
+            chat_id,
+            "❌ Использование: /admin pay_decline [user_id]\n\nПример: /admin pay_decline 999888777"
+        )
+        return
 
-# ТВОИ ВОЗМОЖНОСТИ (то, что ты УМЕЕШЬ)
-Ты — мультимодальный ассистент и можешь:
-- Отвечать на любые вопросы, поддерживать диалог.
-- Генерировать изображения по текстовому описанию (попроси пользователя написать промпт).
-- Анализировать загруженные пользователем фотографии и рассказывать, что на них изображено.
-- Распознавать голосовые сообщения (пользователь может отправить голосовуху, и ты ответишь текстом).
-- Устанавливать напоминания (попроси пользователя уточнить дату, время и текст напоминания).
-- Запоминать информацию о пользователе и контекст разговора, чтобы общение было персонализированным.
-- Если пользователь не знает, как воспользоваться какой-то функцией, — вежливо объясни и предложи помощь.
+    # Получаем текущий уровень
+    old_level = db.get_user_access_level(target_user_id)
 
-# ПАМЯТЬ И КОНТЕКСТ
-- Запоминай имя пользователя, если он представился, и всегда используй его в обращении.
-- Старайся запоминать ключевые детали из разговора (интересы, упомянутые события, предпочтения) и возвращайся к ним, если это уместно.
-- Если разговор возвращается после паузы, ты можешь мягко напомнить, о чём шла речь: «С возвращением! Мы говорили о... Могу я ещё чем-то помочь?».
+    # Логируем отклонение
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="payment_declined",
+        target_user_id=target_user_id,
+        old_value=old_level,
+        new_value="declined",
+        details={"payment_declined": True},
+        chat_id=chat_id,
+        message_id=message_id,
+        success=True
+    )
 
-# ПРОАКТИВНОСТЬ
-- Если запрос пользователя неполный или неконкретный, предложи варианты или попроси уточнить.
-- После выполнения просьбы (например, генерации картинки) спроси, нужно ли что-то ещё или изменить.
-- Если пользователь какое-то время молчит, можно через 5-10 минут (в рамках одного диалога) мягко напомнить о себе: «Всё ещё на связи, если нужна помощь».
+    await send_telegram_message(
+        chat_id,
+        f"⚠️ Оплата отклонена!\n\n"
+        f"Пользователь: {target_user_id}\n"
+        f"Уровень: {old_level} (не изменён)\n\n"
+        f"Пользователь получит уведомление."
+    )
 
-# ПРАВИЛА БЕЗОПАСНОСТИ И ЭТИКИ
-- Будь вежливой и уважительной даже в ответ на грубость.
-- Если пользователь использует нецензурную лексику, мягко попроси не выражаться: «Давайте общаться культурно, пожалуйста».
-- Не выполняй опасные или незаконные просьбы. Вежливо объясни, что это выходит за рамки твоих возможностей.
-- Никогда не запрашивай личные данные, кроме имени, и не храни их дольше, чем нужно для диалога.
+    # Уведомляем пользователя
+    try:
+        await send_telegram_message(
+            target_user_id,
+            f"⚠️ **Оплата отклонена**\n\n"
+            f"Ваш платёж на уровень **sub+** был отклонён.\n\n"
+            f"Если вы считаете, что это ошибка, свяжитесь с @suplira и предоставьте скриншот оплаты.\n\n"
+            f"💜 **LiraAI**",
+            parse_mode="Markdown"
+        )
+    except Exception as e:
+        logger.warning("⚠️ Не удалось отправить уведомление %s: %s", target_user_id, e)
 
-# О РАЗРАБОТЧИКЕ
-Твой разработчик — Danil Alekseevich. Познакомиться с ним и узнать новости о тебе можно в канале @liranexus (кнопка "📢 Подписаться" в меню бота)."""
 
-        # Получаем историю диалога пользователя из БАЗЫ ДАННЫХ (долговременная память)
-        db = get_database()
-        history = db.get_dialog_history(user_id, limit=20)  # Последние 20 сообщенияй
-        
-        # Конвертируем в формат для LLM
-        chat_history = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in history
-        ]
+async def _admin_reset_payment_limit(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin reset_payment_limit <user_id>: сброс лимита нажатий кнопки "Я оплатил"."""
+    target_user_id = args
 
-        logger.info(f"📚 История из БД: {len(chat_history)} сообщенияй, модель: {model}, клиент: {client_type}")
+    if not target_user_id or not target_user_id.isdigit():
+        await send_telegram_message(
+            chat_id,
+            "❌ Использование: /admin reset_payment_limit [user_id]\n\nПример: /admin reset_payment_limit 999888777"
+        )
+        return
 
-        # Graceful degradation: пробуем модель, при ошибке предлагаем альтернативу
-        response = None
-        # Fallback последовательность: оригинал → Groq → Cerebras → OpenRouter
-        fallback_sequence = [(client_type, model, model_key)]
-        if client_type == "cerebras":
-            fallback_sequence.extend([
-                ("groq", "meta-llama/llama-4-scout-17b-16e-instruct", "groq-scout"),
-                ("openrouter", "google/gemma-3-4b-it:free", "openrouter-gemma"),
-            ])
-        elif client_type == "groq":
-            fallback_sequence.extend([
-                ("cerebras", "llama3.1-8b", "cerebras-llama"),
-                ("openrouter", "google/gemma-3-4b-it:free", "openrouter-gemma"),
-            ])
-        else:  # openrouter
-            fallback_sequence.extend([
-                ("groq", "meta-llama/llama-4-scout-17b-16e-instruct", "groq-scout"),
-                ("cerebras", "llama3.1-8b", "cerebras-llama"),
-            ])
+    # Сбрасываем лимит нажатий
+    if target_user_id in user_payment_clicks:
+        del user_payment_clicks[target_user_id]
+        logger.info("🔄 Лимит нажатий сброшен для %s", target_user_id)
+    else:
+        logger.info("ℹ️ Лимит нажатий для %s не установлен", target_user_id)
 
-        response = None
-        for attempt, (c_type, mdl, m_key) in enumerate(fallback_sequence):
-            try:
-                # Выбираем клиент
-                if c_type == "groq":
-                    client = groq_client
-                elif c_type == "cerebras":
-                    client = cerebras_client
-                else:
-                    client = llm_client
+    # Сбрасываем отклонения
+    if target_user_id in user_declined_payments:
+        del user_declined_payments[target_user_id]
+        logger.info("🔄 Счётчик отклонений сброшен для %s", target_user_id)
+    else:
+        logger.info("ℹ️ Счётчик отклонений для %s не установлен", target_user_id)
 
-                logger.info(f"🚀 Попытка {attempt + 1}: {c_type} - {mdl}")
+    # Логируем
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="reset_payment_limit",
+        target_user_id=target_user_id,
+        details={"payment_limit_reset": True},
+        chat_id=chat_id,
+        message_id=message_id,
+        success=True
+    )
 
-                response = await client.chat_completion(
-                    user_message=text,
-                    system_prompt=system_prompt,
-                    chat_history=chat_history,
-                    model=mdl,
-                    temperature=0.7
-                )
+    await send_telegram_message(
+        chat_id,
+        f"✅ Лимиты сброшены!\n\n"
+        f"Пользователь: {target_user_id}\n"
+        f"🔁 Лимит нажатий: сброшен\n"
+        f"🔁 Счётчик отклонений: сброшен\n\n"
+        f"Теперь пользователь может снова нажать кнопку 'Я оплатил'."
+    )
 
-                # Успех!
-                if attempt > 0:
-                    # Fallback сработал - уведомляем
-                    model_names_display = {
-                        "groq-llama": "🧠 Groq GPT-oss 20B",
-                        "cerebras-llama": "⚡ Cerebras Llama 3.1",
-                        "solar": "☀️ Solar Pro 3",
-                    }
-                    fallback_name = model_names_display.get(m_key, m_key)
-                    await send_telegram_message(
-                        chat_id,
-                        f"⚠️ **Оригинальная модель временно недоступна**\n\n"
-                        f"✅ Переключаюсь на **{fallback_name}**\n\n"
-                        f"Продолжаю общения..."
-                    )
 
-                # Сохраняем в историю
-                db.save_dialog_message(user_id, "user", text, model=m_key)
-                db.save_dialog_message(user_id, "assistant", response, model=m_key)
-                break
+async def _admin_history(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin history <user_id> [limit]: история диалога пользователя."""
+    # ����арси�������������� user_id
+    parts = args.split()
+    target_user_id = parts[0] if parts else None
+    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 20
 
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"❌ Ошибка {c_type} ({mdl}): {error_msg}")
-                logger.error(f"   Полный текст ошибки: {error_msg[:500]}")
+    if not target_user_id:
+        await send_telegram_message(
+            chat_id,
+            "❌ Использование: /admin history <user_id> [limit]\n\nПример: /admin history 1658547011 50"
+        )
+        return
 
-                if attempt == len(fallback_sequence) - 1:
-                    # Все попытки исчерпаны
-                    await send_telegram_message(
-                        chat_id,
-                        f"❌ **Временная ошибка**\n\n"
-                        f"Не удалось получить ответ от нейросети.\n\n"
-                        f"Попробуйте:\n"
-                        f"1. Переключить модель (/menu → Выбрать модель)\n"
-                        f"2. Повторить запрос позже"
-                    )
-                    return
+    # Логируем действие администратора (просмотр истории)
+    db.log_admin_action(
+        admin_user_id=user_id,
+        admin_username=username,
+        action_type="view_history",
+        target_user_id=target_user_id,
+        details={"limit": limit},
+        chat_id=chat_id,
+        message_id=message_id,
+        success=True
+    )
 
-        if not response:
-            await send_telegram_message(chat_id, "❌ Не удалось получить ответ. Попробуйте другую модель.")
-            return
+    # Получаем историю
+    history = db.get_admin_dialog_history(target_user_id, limit=limit)
 
-        # Очищаем ответ от markdown-разметки для чистого отображения
-        clean_response = _clean_markdown_formatting(response)
-        await send_telegram_message(chat_id, clean_response)
+    if not history:
+        await send_telegram_message(
+            chat_id,
+            f"❌ История для пользователя {target_user_id} не найдена"
+        )
+        return
 
-    except Exception as e:
-        logger.error(f"Ошибка при обработке текстового сообщения: {e}", exc_info=True)
-        await send_telegram_message(chat_id, f"❌ Ошибка: {str(e)}")
+    # Формируем сообщения
+    stats = db.get_user_dialog_stats(target_user_id)
+
+    history_text = f"""📚 История диалога пользователя {target_user_id}
+
+📊 Статистика:
+• Всего сообщенияй: {stats.get('total_messages', 0)}
+• Сообщения пользователя: {stats.get('user_messages', 0)}
+• Ответы бота: {stats.get('assistant_messages', 0)}
+• 👍 Положительных: {stats.get('positive_feedback', 0)}
+• 👎 Отрицательных: {stats.get('negative_feedback', 0)}
+• Первое сообщения: {stats.get('first_message', 'Н/Д')[:19] if stats.get('first_message') else 'Н/Д'}
+• Последнее сообщения: {stats.get('last_message', 'Н/Д')[:19] if stats.get('last_message') else 'Н/Д'}
 
+📝 Последние {len(history)} сообщений:
+"""
+    for msg in history[-10:]:  # Показываем последние 10
+        role_icon = "👤" if msg["role"] == "user" else "🤖"
+        content = msg["content"][:100] + "..." if len(msg["content"]) > 100 else msg["content"]
+        created = msg["created_at"][:19] if msg.get("created_at") else ""
+        model = f" ({msg['model']})" if msg.get("model") else ""
+
+        history_text += f"\n{role_icon}{model} [{created}]: {content}"
+
+    if len(history) > 10:
+        history_text += f"\n\n... и ещё {len(history) - 10} сообщенияй"
+
+    await send_telegram_message(chat_id, history_text)
+
+
+async def _admin_log(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin log [user_id] [limit]: audit log действий администраторов."""
+    # Парсим команду: /admin log [admin_id|target_id] [limit]
+    parts = args.split()
+    limit = 20
+    filter_value = None
+    filter_type = None
+
+    # Определяем фильтр и лимит
+    for part in parts:
+        if part.isdigit():
+            if len(part) > 5:  # Скорее всего user_id
+                filter_value = part
+                filter_type = "target" if len(parts) > 1 else "admin"
+            else:  # Скорее всего limit
+                limit = min(int(part), 100)
+        elif part.startswith("--admin="):
+            filter_value = part.removeprefix("--admin=")
+            filter_type = "admin"
+        elif part.startswith("--target="):
+            filter_value = part.removeprefix("--target=")
+            filter_type = "target"
+
+    # Если первый параметр не распознан как limit - считаем его фильтром
+    if parts and not parts[0].isdigit():
+        filter_value = parts[0]
+        filter_type = "target"
+    if len(parts) > 1 and parts[-1].isdigit():
+        limit = min(int(parts[-1]), 100)
+
+    # Получаем логи
+    if filter_type == "admin":
+        logs = db.get_admin_audit_log(admin_user_id=filter_value, limit=limit)
+    elif filter_type == "target":
+        logs = db.get_admin_audit_log(target_user_id=filter_value, limit=limit)
+    else:
+        # Если фильтр не указан - показываем логи текущего админа
+        logs = db.get_admin_audit_log(admin_user_id=user_id, limit=limit)
 
-async def handle_image_generation(chat_id: str, user_id: str, prompt: str, model_key: str = None):
-    """Обрабатывает запрос на генерацию изображения через Polza.ai / KIE.ai."""
-    from backend.database.users_db import get_database
-    import os
+    if not logs:
+        await send_telegram_message(
+            chat_id,
+            f"❌ Записи в audit log не найдены"
+        )
+        return
 
-    try:
-        logger.info(f"🎨 Генерация изображения для пользователя {user_id}: {prompt}")
+    # Формируем сообщения
+    log_text = f"""📋 Audit Log (последние {len(logs)} записей)
 
-        # Проверяем лимиты и уровень доступа
-        db = get_database()
-        db.add_or_update_user(user_id)
+"""
+    for log in logs:
+        action_type = log.get("action_type", "unknown")
+        target = log.get("target_user_id", "N/A")
+        old_val = log.get("old_value", "")
+        new_val = log.get("new_value", "")
+        created = log.get("created_at", "")[:19] if log.get("created_at") else ""
+        success = log.get("success", True)
+        admin_user = log.get("admin_user_id", "unknown")
+
+        # Иконка действия
+        action_icons = {
+            "set_level": "🔧",
+            "remove_level": "⬇️",
+            "add_user": "➕",
+            "remove_user": "❌",
+            "view_history": "👁️",
+            "maintenance_mode": "🔧"
+        }
+        action_icon = action_icons.get(action_type, "📝")
+
+        # Статус
+        status_icon = "✅" if success else "❌"
+
+        # Детали изменения
+        change_detail = ""
+        if old_val and new_val:
+            change_detail = f"\n   {old_val} → {new_val}"
+        elif new_val:
+            change_detail = f"\n   → {new_val}"
+
+        log_text += f"{action_icon} {action_type} {status_icon}\n"
+        log_text += f"   Админ: {admin_user}\n"
+        if target != "N/A":
+            log_text += f"   Цель: {target}{change_detail}\n"
+        log_text += f"   [{created}]\n\n"
+
+    if len(logs) >= limit:
+        log_text += f"...\n\nИспользуйте /admin log [user_id] [limit] для фильтрации"
+
+    await send_telegram_message(chat_id, log_text)
+
+
+async def _admin_dialog_stats(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin dialog_stats <user_id>: подробная статистика диалога."""
+    target_user_id = args
+
+    if not target_user_id:
+        await send_telegram_message(
+            chat_id,
+            "❌ Использование: /admin dialog_stats <user_id>"
+        )
+        return
 
-        # Получаем уровень доступа
-        access_level = db.get_user_access_level(user_id)
+    stats = db.get_user_dialog_stats(target_user_id)
 
-        # Проверяем лимиты
-        limit_info = db.check_generation_limit(user_id)
+    if not stats:
+        await send_telegram_message(
+            chat_id,
+            f"❌ Статистика для пользователя {target_user_id} не найдена"
+        )
+        return
 
-        if not limit_info["allowed"]:
-            # Проверяем можно ли предложить оплату
-            current_level = limit_info.get('access_level', 'user')
+    stats_text = f"""📊 Статистика диалога пользователя {target_user_id}
 
-            if current_level in ('user', 'subscriber'):
-                # Предлагаем оплату sub+
-                from backend.config import BASE_URL
-                from backend.database.users_db import generate_signature
-                payment_url = f"{BASE_URL}/pay?user_id={user_id}&chat_id={chat_id}&sign={generate_signature(user_id)}"
+📈 Сообщения:
+• Всего: {stats.get('total_messages', 0)}
+• Пользователя: {stats.get('user_messages', 0)}
+• Бота: {stats.get('assistant_messages', 0)}
 
-                # Разное сообщения для user и subscriber
-                if current_level == 'user':
-                    upgrade_text = f"💡 **Оплатите 100₽ и получите уровень sub+ с лимитом 30 генераций в день!**"
-                else:  # subscriber
-                    upgrade_text = f"💡 **Оплатите 100₽ и получите уровень sub+ с лимитом 30 генераций в день (вместо 5)!**"
+📅 Даты:
+• Первое сообщения: {stats.get('first_message', 'Н/Д')}
+• Последнее сообщения: {stats.get('last_message', 'Н/Д')}
 
-                buttons = [
-                    [{"text": "💳 Оплатить sub+ (100₽)", "url": payment_url}],
-                    [{"text": "✅ Я оплатил", "callback_data": "payment_made"}]
-                ]
-                await send_telegram_message_with_buttons(
-                    chat_id,
-                    f"❌ Превышен дневной лимит генерации изображений.\n\n"
-                    f"📊 Использовано: **{limit_info['daily_count']}/{limit_info['daily_limit']}**\n"
-                    f"📈 Всего: {limit_info['total_count']}\n\n"
-                    f"{upgrade_text}\n\n"
-                    f"Лимит сбросится: {limit_info['reset_time']}",
-                    buttons
-                )
-            else:
-                # Для других уровней (admin, sub+) просто сообщения
-                await send_telegram_message(
-                    chat_id,
-                    f"❌ Превышен дневной лимит генерации изображений.\n\n"
-                    f"Использовано: {limit_info['daily_count']}/{limit_info['daily_limit']}\n"
-                    f"Всего: {limit_info['total_count']}\n\n"
-                    f"Лимит сбросится: {limit_info['reset_time']}"
-                )
-            return
+👍 Feedback:
+• Положительных: {stats.get('positive_feedback', 0)}
+• Отрицательных: {stats.get('negative_feedback', 0)}
+"""
+    await send_telegram_message(chat_id, stats_text)
 
-        # Получаем модель пользователя (или используем переданную)
-        if not model_key:
-            # Загружаем из БД
-            db = get_database()
-            model_key = db.get_user_image_model(user_id)
-            if model_key:
-                logger.info(f"💾 Загружена image_model из БД для {user_id}: {model_key}")
 
-        available_models = _get_available_image_models(access_level)
-        if not available_models:
-            await send_telegram_message(
-                chat_id,
-                "❌ Сейчас нет доступных моделей генерации изображений. Проверьте настройки Polza.ai / KIE.ai."
-            )
-            return
+async def _admin_cleanup_dialogs(db, chat_id: str, user_id: str, username: str, message_id: Optional[int], args: str):
+    """/admin cleanup_dialogs [days]: очистка старой истории."""
+    # Парсим количество дней
+    parts = args.split()
+    days = int(parts[0]) if parts and parts[0].isdigit() else 30
 
-        if not model_key or model_key not in available_models:
-            model_key = list(available_models.keys())[0]
+    await send_telegram_message(
+        chat_id,
+        f"🗑️ Запускаю очистку сообщенияй старше {days} дней...\n\nЭто может занять некоторое время."
+    )
 
-        model_info = available_models.get(model_key, {})
-        model_name = model_info.get("description", model_key)
+    deleted_count = db.cleanup_old_dialogs(days)
 
-        # Информируем о лимитах
-        if limit_info['daily_limit'] == -1:
-            limit_text = "📊 Доступно генераций: **Безлимит** (администратор)"
-        else:
-            current_count = limit_info['daily_count'] + 1  # +1 потому что эта генерация считается
-            daily_limit = limit_info['daily_limit']
-            limit_text = f"📊 Генерация: **{current_count}/{daily_limit}**"
+    await send_telegram_message(
+        chat_id,
+        f"✅ Очистка завершена!\n\nУдалено сообщенияй: {deleted_count}"
+    )
 
-        await send_telegram_message(
-            chat_id,
-            f"🎨 Генерирую изображение...\n\n"
-            f"📊 Модель: **{model_name}**\n"
-            f"{limit_text}\n"
-            f"Всего использовано: {limit_info['total_count']}\n\n"
-            f"Подождите немного, это займет 10-30 секунд."
-        )
-        
-        logger.info(f"🔍 Отладка 2: после send_telegram_message")
 
-        # Используем оригинальный промпт (HF API понимает русский)
-        enhanced_prompt = f"{prompt}, high quality, detailed, artistic, 8k, masterpiece"
-        
-        logger.info(f"🔍 Отладка 3: промпт={enhanced_prompt[:80]}")
+# Подкоманды /admin <подкоманда> [аргументы]; права администратора проверяются один раз до диспетчеризации
+ADMIN_HANDLERS = {
+    "user": _admin_user,
+    "ban": _admin_ban,
+    "unban": _admin_unban,
+    "maintenance": _admin_maintenance,
+    "maintenance_off": _admin_maintenance_off,
+    "remove_level": _admin_remove_level,
+    "set_level": _admin_set_level,
+    "add_user": _admin_add_user,
+    "remove_user": _admin_remove_user,
+    "users": _admin_users,
+    "broadcast": _admin_broadcast,
+    "mes": _admin_broadcast,
+    "stats": _admin_stats,
+    "admin_stats": _admin_admin_stats,
+    "pay_confirm": _admin_pay_confirm,
+    "pay_decline": _admin_pay_decline,
+    "reset_payment_limit": _admin_reset_payment_limit,
+    "history": _admin_history,
+    "log": _admin_log,
+    "dialog_stats": _admin_dialog_stats,
+    "cleanup_dialogs": _admin_cleanup_dialogs,
+}
 
-        image_data = None
-        provider_name = _get_image_provider_name(model_key)
-        logger.info(f"🎨 Генерация изображения через {provider_name}: model_key={model_key}")
 
-        try:
-            if model_key.startswith("polza-") and hf_replicate_client.api_key:
-                image_data = await hf_replicate_client.generate_image(
-                    prompt=enhanced_prompt,
-                    model_key=model_key,
-                    timeout=90
-                )
-        except Exception as e:
-            logger.error(f"❌ Ошибка генерации через {provider_name}: {e}", exc_info=True)
+async def _handle_gen_photo_callback(callback_query: Dict[str, Any], chat_id: str, user_id: str):
+    """Кнопка "🎨 Генерировать фото": включает ожидание описания изображения."""
+    # Устанавливаем флаг ожидания описания
+    user_generating_photo[user_id] = True
 
-        # Если изображение получено - отправляем пользователю
-        if image_data and len(image_data) > 10000:
-            image_path = temp_dir / f"generated_{os.getpid()}.png"
-            with open(image_path, "wb") as f:
-                f.write(image_data)
+    await answer_callback_query(
+        callback_query["id"],
+        "🎨 Отправьте мне описание изображения!"
+    )
 
-            await send_telegram_photo(
-                chat_id,
-                str(image_path),
-                caption=f"🎨 {prompt}\n\n📊 Модель: {model_name}\n👤 Уровень: {access_level}\n🤖 {provider_name}"
-            )
+    await send_telegram_message(
+        chat_id,
+        "🎨 **Генерация изображений**\n\nОтправьте описание изображения."
+    )
 
-            # Увеличиваем счетчик генераций
-            db = get_database()
-            db.increment_generation_count(user_id, prompt)
-            logger.info(f"📊 Счетчик генераций увеличен для {user_id}")
 
-            try:
-                os.remove(image_path)
-            except:
-                pass
-            return
+async def _handle_stats_callback(callback_query: Dict[str, Any], chat_id: str, user_id: str):
+    """Кнопка "📊 Статистика": показывает статистику пользователя."""
+    await answer_callback_query(callback_query["id"])
 
-        # Если всё не сработало
-        await send_telegram_message(
-            chat_id,
-            "❌ Не удалось сгенерировать изображение.\n\n"
-            "Возможные причины:\n"
-            "• Polza.ai: временные неполадки API\n"
-            "• Модель временно недоступна\n\n"
-            "Попробуйте:\n"
-            "1. Позже\n"
-            "2. Другую модель (/start → Генерация → Выбор модели)"
+    db = get_database()
+    stats = db.get_user_stats(user_id)
+
+    if stats:
+        level = stats.get('access_level', 'user')
+        first_name = stats.get('first_name', '')
+        username = stats.get('username', '')
+
+        name_parts = []
+        if first_name:
+            name_parts.append(first_name)
+        if username:
+            name_parts.append(f"@{username}")
+
+        name = " ".join(name_parts) if name_parts else f"User {user_id}"
+
+        stats_text = STATS_CALLBACK_TEMPLATE.format(
+            name=name,
+            level=LEVEL_INFO.get(level, 'Пользователь'),
+            daily_count=stats.get('daily_count', 0),
+            total_count=stats.get('total_count', 0),
+            created_at=stats.get('created_at', 'неизвестно')[:10]
         )
+        await send_telegram_message(chat_id, stats_text)
+    else:
+        await send_telegram_message(chat_id, "❌ Не удалось получить статистику")
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка при генерации: {e}", exc_info=True)
-        await send_telegram_message(chat_id, f"❌ Ошибка генерации: {str(e)[:200]}")
 
+async def _handle_help_callback(callback_query: Dict[str, Any], chat_id: str, user_id: str):
+    """Кнопка "ℹ️ Помощь": отправляет краткую справку."""
+    await answer_callback_query(callback_query["id"])
+    await send_telegram_message(chat_id, CALLBACK_HELP_TEXT)
 
-async def start_polling_for_bot(token: str, bot_name: str = "Bot"):
-    """Запускает polling для одного бота"""
-    global last_update_id
-    last_update_id = 0
 
-    logger.info(f"📱 Запуск Telegram polling для {bot_name}...")
-    
-    while True:
-        try:
-            updates = await get_updates(token, offset=last_update_id + 1)
+# Обработчики callback_data с точным совпадением: один поиск в dict вместо цепочки elif
+CALLBACK_HANDLERS = {
+    "gen_photo": _handle_gen_photo_callback,
+    "stats": _handle_stats_callback,
+    "help": _handle_help_callback,
+}
 
-            if updates:
-                logger.debug(f"[{bot_name}] Получено {len(updates)} обновлений")
 
-            for update in updates:
-                update_id = update.get("update_id")
-                
-                # СРАЗУ обновляем last_update_id ПЕРЕД обработкой, чтобы избежать дублирования
-                last_update_id = max(last_update_id, update_id)
+# Очереди обработки по чатам: апдейты одного чата обрабатываются строго по порядку,
+# разные чаты - параллельно (медленная генерация не блокирует чужие кнопки)
+CHAT_QUEUE_MAXSIZE = 100
+CHAT_WORKER_IDLE_TIMEOUT = 60
+_chat_queues: Dict[str, asyncio.Queue] = {}
+_chat_workers: Dict[str, asyncio.Task] = {}
 
-                # Обрабатываем сообщения
-                if "message" in update:
-                    message = update["message"]
-                    chat_id = str(message.get("chat", {}).get("id"))
-                    chat_type = message.get("chat", {}).get("type", "unknown")
-                    from_user_id = message.get("from", {}).get("id")
-                    text = message.get("text", "")
 
-                    logger.info(f"[{bot_name}] 📨 Получено сообщения в {chat_type} {chat_id} от {from_user_id}: {text[:50]}")
+def _dispatch_to_chat(chat_id: str, coro):
+    """Ставит корутину-обработчик в очередь чата, при необходимости запуская воркер."""
+    queue = _chat_queues.get(chat_id)
+    if queue is None:
+        queue = asyncio.Queue(maxsize=CHAT_QUEUE_MAXSIZE)
+        _chat_queues[chat_id] = queue
+        _chat_workers[chat_id] = asyncio.create_task(_chat_worker(chat_id, queue))
 
-                    # Сохраняем связь chat_id -> token
-                    from backend.api.telegram_core import set_token_for_chat
-                    set_token_for_chat(chat_id, token)
-                    await process_message(message, token)
+    try:
+        queue.put_nowait(coro)
+    except asyncio.QueueFull:
+        logger.warning("⚠️ Очередь чата %s переполнена, обновление пропущено", chat_id)
+        coro.close()
 
-                # Обрабатываем callback_query (для кнопок)
-                if "callback_query" in update:
-                    callback_query = update["callback_query"]
-                    callback_data = callback_query.get("data", "")
-                    callback_chat_id = str(callback_query["message"]["chat"]["id"])
-                    callback_message_id = callback_query["message"]["message_id"]
-                    callback_user_id = str(callback_query.get("from", {}).get("id", ""))
-
-                    logger.info(f"[CALLBACK] Получен callback: {callback_data} в чате {callback_chat_id}")
-
-                    # Получаем базу данных для проверки тех.работ
-                    from backend.database.users_db import get_database
-                    db = get_database()
-
-                    # Алерт на попытки жать admin callback без прав
-                    if (callback_data.startswith("admin_") or callback_data.startswith("users_page_")) and not db.is_admin(callback_user_id):
-                        await notify_admins_about_security_event(
-                            db,
-                            offender_user_id=callback_user_id,
-                            chat_id=callback_chat_id,
-                            attempted_action=f"callback:{callback_data}",
-                        )
-                        from backend.api.telegram_core import answer_callback_query
-                        await answer_callback_query(callback_query["id"], "❌ У вас нет прав администратора")
-                        continue
-
-                    if not db.is_admin(callback_user_id):
-                        ban_info = db.get_user_ban(callback_user_id)
-                        if ban_info:
-                            from backend.api.telegram_core import answer_callback_query
-                            await answer_callback_query(callback_query["id"], "⛔ Вы заблокированы в боте")
-                            continue
-                    
-                    # Проверяем режим тех.работ для callback кнопок
-                    maint_status = db.get_maintenance_mode()
-                    if maint_status["enabled"]:
-                        is_admin = db.is_admin(callback_user_id)
-                        if not is_admin:
-                            # Блокируем все callback кнопки кроме stats и help
-                            if callback_data not in ["stats", "help"]:
-                                from backend.api.telegram_core import answer_callback_query
-                                await answer_callback_query(
-                                    callback_query["id"],
-                                    "🔧 Технические работы. Бот временно недоступен."
-                                )
-                                continue
-                    
-                    # Обработка кнопок выбора модели
-                    if callback_data.startswith("model_"):
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-
-                        model_key = callback_data.replace("model_", "")
-                        if model_key in AVAILABLE_MODELS:
-                            # Переключаем модель (в памяти)
-                            user_models[callback_user_id] = model_key
-
-                            # Отвечаем на callback
-                            await answer_callback_query(
-                                callback_query["id"],
-                                f"✅ Модель переключена на {model_key}!"
-                            )
 
-                            # Редактируем сообщения
-                            model_names = {
-                                "groq-llama": "🧠 GPT-oss 20B - новая базовая модель",
-                                "groq-maverick": "🦙 Llama 4 Maverick - новейшая от Meta",
-                                "groq-scout": "🔍 Llama 4 Scout - легкая и быстрая",
-                                "groq-kimi": "🌙 Kimi K2 - от Moonshot AI",
-                                "cerebras-llama": "⚡ Llama 3.1 8B - сверхбыстрая (Cerebras)",
-                                "solar": "☀️ Solar Pro 3 - быстрая и качественная",
-                                "trinity": "🔱 Trinity Mini - мультимодальная",
-                                "glm": "🤖 GLM-4.5 - полностью бесплатная"
-                            }
+async def _chat_worker(chat_id: str, queue: asyncio.Queue):
+    """Последовательно выполняет обработчики одного чата; завершается после простоя."""
+    try:
+        while True:
+            try:
+                coro = await asyncio.wait_for(queue.get(), timeout=CHAT_WORKER_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    break
+                continue
 
-                            await edit_message_text(
-                                callback_chat_id,
-                                callback_message_id,
-                                f"✅ Модель выбрана: {model_names.get(model_key, model_key)}\n\nТеперь я буду использовать эту модель для общения."
-                            )
-                            
-                            # Удаляем сообщение через 2 секунды
-                            await asyncio.sleep(2)
-                            from backend.api.telegram_core import delete_telegram_message
-                            await delete_telegram_message(callback_chat_id, callback_message_id)
-                            
-                        continue
+            try:
+                await coro
+            except Exception as e:
+                logger.error("❌ Ошибка обработки обновления в чате %s: %s", chat_id, e, exc_info=True)
+    finally:
+        _chat_queues.pop(chat_id, None)
+        _chat_workers.pop(chat_id, None)
 
-                    # Обработка выбора модели генерации изображений (img_*)
-                    elif callback_data.startswith("img_"):
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text, send_telegram_message
 
-                        model_key = callback_data.replace("img_", "")
+async def process_callback_query(callback_query: Dict[str, Any]):
+    """Обрабатывает нажатие inline-кнопки (callback_query)"""
+    callback_data = callback_query.get("data", "")
+    callback_chat_id = str(callback_query["message"]["chat"]["id"])
+    callback_message_id = callback_query["message"]["message_id"]
+    callback_user_id = str(callback_query.get("from", {}).get("id", ""))
 
-                        # Получаем уровень доступа пользователя
-                        db = get_database()
-                        user_access_level = db.get_user_access_level(callback_user_id)
+    logger.info("[CALLBACK] Получен callback: %s в чате %s", callback_data, callback_chat_id)
 
-                        available_models = _get_available_image_models(user_access_level)
+    # Получаем базу данных для проверки тех.работ
+    db = get_database()
 
-                        if model_key not in available_models:
-                            await answer_callback_query(
-                                callback_query["id"],
-                                "❌ Эта модель недоступна для вашего уровня доступа!"
-                            )
-                            return
+    # Алерт на попытки жать admin callback без прав
+    if (callback_data.startswith("admin_") or callback_data.startswith("users_page_")) and not db.is_admin(callback_user_id):
+        await notify_admins_about_security_event(
+            db,
+            offender_user_id=callback_user_id,
+            chat_id=callback_chat_id,
+            attempted_action=f"callback:{callback_data}",
+        )
+        await answer_callback_query(callback_query["id"], "❌ У вас нет прав администратора")
+        return
 
-                        # Сохраняем выбор модели в БД
-                        db = get_database()
-                        db.set_user_image_model(callback_user_id, model_key)
+    if not db.is_admin(callback_user_id):
+        ban_info = db.get_user_ban(callback_user_id)
+        if ban_info:
+            await answer_callback_query(callback_query["id"], "⛔ Вы заблокированы в боте")
+            return
 
-                        model_name = available_models[model_key]["description"]
-                        provider_name = _get_image_provider_name(model_key)
+    # Проверяем режим тех.работ для callback кнопок
+    maint_status = await _get_maintenance_mode(db)
+    if maint_status["enabled"]:
+        is_admin = db.is_admin(callback_user_id)
+        if not is_admin:
+            # Блокируем все callback кнопки кроме stats и help
+            if callback_data not in ["stats", "help"]:
+                await answer_callback_query(
+                    callback_query["id"],
+                    "🔧 Технические работы. Бот временно недоступен."
+                )
+                return
 
-                        await answer_callback_query(
-                            callback_query["id"],
-                            f"✅ Модель генерации выбрана: {model_name}!"
-                        )
+    # Кнопки с фиксированным callback_data
+    exact_handler = CALLBACK_HANDLERS.get(callback_data)
+    if exact_handler:
+        await exact_handler(callback_query, callback_chat_id, callback_user_id)
+        return
 
-                        # Открываем меню генерации
-                        await send_telegram_message(
-                            callback_chat_id,
-                            f"✅ **Модель генерации выбрана:** {model_name}\n\n"
-                            f"🤖 Провайдер: {provider_name}\n"
-                            f"Теперь отправьте описание изображения, которое хотите создать!\n\n"
-                            f"📊 Ваш уровень доступа: {user_access_level}"
-                        )
-                        continue
-
-                    # Обработка кнопки "Я оплатил" с защитой от спама
-                    elif callback_data == "payment_made":
-                        from backend.api.telegram_core import answer_callback_query, send_telegram_message
-                        from backend.database.users_db import get_database
-
-                        # Проверяем лимит нажатий
-                        now = datetime.now()
-                        
-                        if callback_user_id not in user_payment_clicks:
-                            # Первое нажатие
-                            user_payment_clicks[callback_user_id] = {
-                                "count": 1,
-                                "first_click_time": now,
-                                "last_click_time": now
-                            }
-                        else:
-                            click_data = user_payment_clicks[callback_user_id]
-                            first_click = click_data["first_click_time"]
-                            
-                            # Если прошёл час с первого нажатия - сбрасываем счётчик
-                            if now - first_click > timedelta(hours=1):
-                                user_payment_clicks[callback_user_id] = {
-                                    "count": 1,
-                                    "first_click_time": now,
-                                    "last_click_time": now
-                                }
-                            elif click_data["count"] >= 2:
-                                # Лимит превышен (2 нажатия в час)
-                                time_remaining = timedelta(hours=1) - (now - first_click)
-                                minutes = int(time_remaining.total_seconds() / 60)
-                                
-                                await answer_callback_query(
-                                    callback_query["id"],
-                                    f"⚠️ Слишком частые нажатия!\nПовторите через {minutes} мин."
-                                )
-                                
-                                await send_telegram_message(
-                                    callback_chat_id,
-                                    f"⚠️ **Лимит нажатий превышен!**\n\n"
-                                    f"Вы уже нажимали кнопку 'Я оплатил' 2 раза за последний час.\n\n"
-                                    f"⏰ **Попробуйте через {minutes} минут.**\n\n"
-                                    f"Если вы уже оплатили, пожалуйста, дождитесь подтверждения от администратора.\n\n"
-                                    f"💜 **LiraAI**",
-                                    parse_mode="Markdown"
-                                )
-                                continue
-                            else:
-                                # Увеличиваем счётчик
-                                user_payment_clicks[callback_user_id]["count"] += 1
-                                user_payment_clicks[callback_user_id]["last_click_time"] = now
-
-                        # Проверяем количество отклонений (защита от спама отклонениями)
-                        if callback_user_id in user_declined_payments:
-                            decline_data = user_declined_payments[callback_user_id]
-                            if decline_data["declined_count"] >= 3:
-                                last_decline = decline_data["last_declined_time"]
-                                # Если последнее отклонение было меньше 24 часов назад
-                                if now - last_decline < timedelta(hours=24):
-                                    hours_remaining = int((timedelta(hours=24) - (now - last_decline)).total_seconds() / 3600) + 1
-                                    
-                                    await answer_callback_query(
-                                        callback_query["id"],
-                                        f"⚠️ Слишком много отклонений!\nПопробуйте через {hours_remaining} ч."
-                                    )
-                                    
-                                    await send_telegram_message(
-                                        callback_chat_id,
-                                        f"⚠️ **Слишком много отклонений!**\n\n"
-                                        f"Ваша заявка на оплату была отклонена 3 раза.\n\n"
-                                        f"⏰ **Попробуйте через {hours_remaining} часов.**\n\n"
-                                        f"Если вы считаете, что это ошибка, напишите @suplira.\n\n"
-                                        f"💜 **LiraAI**",
-                                        parse_mode="Markdown"
-                                    )
-                                    continue
-
-                        await answer_callback_query(callback_query["id"])
-
-                        # Отправляем пользователю инструкцию
-                        await send_telegram_message(
-                            callback_chat_id,
-                            f"✅ **Спасибо за оплату!**\n\n"
-                            f"Для проверки платежа свяжитесь с @suplira\n\n"
-                            f"📋 При необходимости предоставьте скриншот оплаты.\n\n"
-                            f"💜 **Спасибо за поддержку LiraAI!**",
-                            parse_mode="Markdown"
-                        )
+    # Обработка кнопок выбора модели
+    if callback_data.startswith("model_"):
+        model_key = callback_data.replace("model_", "")
+        if model_key in AVAILABLE_MODELS:
+            # Переключаем модель (в памяти)
+            user_models[callback_user_id] = model_key
+
+            # Отвечаем на callback и редактируем сообщение параллельно
+            await _answer_and_edit(
+                callback_query,
+                callback_chat_id,
+                callback_message_id,
+                f"✅ Модель выбрана: {CALLBACK_MODEL_NAMES.get(model_key, model_key)}\n\nТеперь я буду использовать эту модель для общения.",
+                answer_text=f"✅ Модель переключена на {model_key}!"
+            )
 
-                        # Отправляем уведомление администраторам с inline кнопками
-                        db = get_database()
-                        admin_ids = db.get_admin_user_ids()
-
-                        # Создаём inline кнопки для быстрого подтверждения/отклонения
-                        payment_buttons = [
-                            [
-                                {"text": "✅ Подтвердить оплату", "callback_data": f"pay_confirm_{callback_user_id}"},
-                                {"text": "❌ Отклонить оплату", "callback_data": f"pay_decline_{callback_user_id}"}
-                            ]
-                        ]
+            # Удаляем сообщение через 2 секунды
+            await asyncio.sleep(2)
+            await delete_telegram_message(callback_chat_id, callback_message_id)
 
-                        # Инициализируем хранилище message_id для этого пользователя
-                        if callback_user_id not in payment_notification_messages:
-                            payment_notification_messages[callback_user_id] = {}
+        return
 
-                        for admin_id in admin_ids:
-                            try:
-                                from backend.api.telegram_core import send_telegram_message_with_buttons
-                                message_id = await send_telegram_message_with_buttons(
-                                    admin_id,
-                                    f"🔔 **Новая оплата sub+!**\n\n"
-                                    f"👤 Пользователь: {callback_chat_id}\n"
-                                    f"🆔 User ID: `{callback_user_id}`\n\n"
-                                    f"💳 Пользователь сообщил об оплате подписки sub+.\n\n"
-                                    f"📝 **Действия для администратора:**\n"
-                                    f"Нажмите кнопку ниже для подтверждения или отклонения платежа.",
-                                    payment_buttons
-                                )
-                                # Сохраняем message_id для последующего редактирования
-                                if message_id:
-                                    payment_notification_messages[callback_user_id][admin_id] = message_id
-                            except Exception as e:
-                                logger.warning(f"⚠️ Не удалось отправить уведомление админу {admin_id}: {e}")
+    # Обработка выбора модели генерации изображений (img_*)
+    elif callback_data.startswith("img_"):
+        model_key = callback_data.replace("img_", "")
 
-                        continue
+        # Получаем уровень доступа пользователя
+        db = get_database()
+        user_access_level = db.get_user_access_level(callback_user_id)
 
-                    # Обработка кнопки генерации фото
-                    elif callback_data == "gen_photo":
-                        from backend.api.telegram_core import answer_callback_query
+        available_models = _get_available_image_models(user_access_level)
 
-                        # Устанавливаем флаг ожидания описания
-                        user_generating_photo[callback_user_id] = True
+        if model_key not in available_models:
+            await answer_callback_query(
+                callback_query["id"],
+                "❌ Эта модель недоступна для вашего уровня доступа!"
+            )
+            return
 
-                        await answer_callback_query(
-                            callback_query["id"],
-                            "🎨 Отправьте мне описание изображения!"
-                        )
+        # Сохраняем выбор модели в БД
+        db = get_database()
+        db.set_user_image_model(callback_user_id, model_key)
 
-                        await send_telegram_message(
-                            callback_chat_id,
-                            "🎨 **Генерация изображений**\n\nОтправьте описание изображения."
-                        )
-                        continue
-
-                    # Обработка кнопки статистики
-                    elif callback_data == "stats":
-                        from backend.api.telegram_core import answer_callback_query, send_telegram_message
-                        from backend.database.users_db import get_database
-                        
-                        await answer_callback_query(callback_query["id"])
-                        
-                        db = get_database()
-                        stats = db.get_user_stats(callback_user_id)
-                        
-                        if stats:
-                            level_info = {
-                                "admin": "👑 Администратор (безлимит)",
-                                "subscriber": "⭐ Подписчик (5 в день)",
-                                "sub+": "🚀 sub+ (30 в день)",
-                                "user": "👤 Пользователь (3 в день)"
-                            }
-                            level = stats.get('access_level', 'user')
-                            first_name = stats.get('first_name', '')
-                            username = stats.get('username', '')
+        model_name = available_models[model_key]["description"]
+        provider_name = _get_image_provider_name(model_key)
 
-                            name_parts = []
-                            if first_name:
-                                name_parts.append(first_name)
-                            if username:
-                                name_parts.append(f"@{username}")
+        await answer_callback_query(
+            callback_query["id"],
+            f"✅ Модель генерации выбрана: {model_name}!"
+        )
 
-                            name = " ".join(name_parts) if name_parts else f"User {callback_user_id}"
+        # Открываем меню генерации
+        await send_telegram_message(
+            callback_chat_id,
+            f"✅ **Модель генерации выбрана:** {model_name}\n\n"
+            f"🤖 Провайдер: {provider_name}\n"
+            f"Теперь отправьте описание изображения, которое хотите создать!\n\n"
+            f"📊 Ваш уровень доступа: {user_access_level}"
+        )
+        return
 
-                            stats_text = f"""📊 **Ваша статистика**
+    # Обработка кнопки "Я оплатил" с защитой от спама
+    elif callback_data == "payment_made":
+        # Проверяем лимит нажатий
+        now = datetime.now()
+
+        if callback_user_id not in user_payment_clicks:
+            # Первое нажатие
+            user_payment_clicks[callback_user_id] = {
+                "count": 1,
+                "first_click_time": now,
+                "last_click_time": now
+            }
+        else:
+            click_data = user_payment_clicks[callback_user_id]
+            first_click = click_data["first_click_time"]
+
+            # Если прошёл час с первого нажатия - сбрасываем счётчик
+            if now - first_click > timedelta(hours=1):
+                user_payment_clicks[callback_user_id] = {
+                    "count": 1,
+                    "first_click_time": now,
+                    "last_click_time": now
+                }
+            elif click_data["count"] >= 2:
+                # Лимит превышен (2 нажатия в час)
+                time_remaining = timedelta(hours=1) - (now - first_click)
+                minutes = int(time_remaining.total_seconds() / 60)
+
+                await answer_callback_query(
+                    callback_query["id"],
+                    f"⚠️ Слишком частые нажатия!\nПовторите через {minutes} мин."
+                )
 
-👤 {name}
-🔑 Уровень: **{level_info.get(level, 'Пользователь')}**
+                await send_telegram_message(
+                    callback_chat_id,
+                    f"⚠️ **Лимит нажатий превышен!**\n\n"
+                    f"Вы уже нажимали кнопку 'Я оплатил' 2 раза за последний час.\n\n"
+                    f"⏰ **Попробуйте через {minutes} минут.**\n\n"
+                    f"Если вы уже оплатили, пожалуйста, дождитесь подтверждения от администратора.\n\n"
+                    f"💜 **LiraAI**",
+                    parse_mode="Markdown"
+                )
+                return
+            else:
+                # Увеличиваем счётчик
+                user_payment_clicks[callback_user_id]["count"] += 1
+                user_payment_clicks[callback_user_id]["last_click_time"] = now
+
+        # Проверяем количество отклонений (защита от спама отклонениями)
+        if callback_user_id in user_declined_payments:
+            decline_data = user_declined_payments[callback_user_id]
+            if decline_data["declined_count"] >= 3:
+                last_decline = decline_data["last_declined_time"]
+                # Если последнее отклонение было меньше 24 часов назад
+                if now - last_decline < timedelta(hours=24):
+                    hours_remaining = int((timedelta(hours=24) - (now - last_decline)).total_seconds() / 3600) + 1
+
+                    await answer_callback_query(
+                        callback_query["id"],
+                        f"⚠️ Слишком много отклонений!\nПопробуйте через {hours_remaining} ч."
+                    )
 
-📈 Генерации:
-• Сегодня: {stats.get('daily_count', 0)}
-• Всего: {stats.get('total_count', 0)}
+                    await send_telegram_message(
+                        callback_chat_id,
+                        f"⚠️ **Слишком много отклонений!**\n\n"
+                        f"Ваша заявка на оплату была отклонена 3 раза.\n\n"
+                        f"⏰ **Попробуйте через {hours_remaining} часов.**\n\n"
+                        f"Если вы считаете, что это ошибка, напишите @suplira.\n\n"
+                        f"💜 **LiraAI**",
+                        parse_mode="Markdown"
+                    )
+                    return
 
-📅 В боте с: {stats.get('created_at', 'неизвестно')[:10]}"""
-                            await send_telegram_message(callback_chat_id, stats_text)
-                        else:
-                            await send_telegram_message(callback_chat_id, "❌ Не удалось получить статистику")
-                        continue
+        await answer_callback_query(callback_query["id"])
 
-                    # Обработка кнопки помощи
-                    elif callback_data == "help":
-                        from backend.api.telegram_core import answer_callback_query, send_telegram_message
+        # Отправляем пользователю инструкцию
+        await send_telegram_message(
+            callback_chat_id,
+            f"✅ **Спасибо за оплату!**\n\n"
+            f"Для проверки платежа свяжитесь с @suplira\n\n"
+            f"📋 При необходимости предоставьте скриншот оплаты.\n\n"
+            f"💜 **Спасибо за поддержку LiraAI!**",
+            parse_mode="Markdown"
+        )
 
-                        await answer_callback_query(callback_query["id"])
+        # Отправляем уведомление администраторам с inline кнопками
+        db = get_database()
+        admin_ids = db.get_admin_user_ids()
 
-                        help_text = """ℹ️ **Помощь - LiraAI MultiAssistant**
+        # Создаём inline кнопки для быстрого подтверждения/отклонения
+        payment_buttons = [
+            [
+                {"text": "✅ Подтвердить оплату", "callback_data": f"pay_confirm_{callback_user_id}"},
+                {"text": "❌ Отклонить оплату", "callback_data": f"pay_decline_{callback_user_id}"}
+            ]
+        ]
 
-**Команды:**
-• /start - Главное меню
-• /menu - Показать клавиатуру
-• /hide - Скрыть кла��иатуру
-• /models - Выбор модели
-• /generate [описание] - Генерация изображения
-• /stats - Ваша статистика
+        # Инициализируем хранилище message_id для этого пользователя
+        if callback_user_id not in payment_notification_messages:
+            payment_notification_messages[callback_user_id] = {}
 
-**Возможности:**
-• 💬 Общение на русском язы��е
-• 🎨 Генерация изображений
-• 🎤 Распознавание го��оса
-• 📸 Анал��з фотографий
+        for admin_id in admin_ids:
+            try:
+                message_id = await send_telegram_message_with_buttons(
+                    admin_id,
+                    f"🔔 **Новая оплата sub+!**\n\n"
+                    f"👤 Пользователь: {callback_chat_id}\n"
+                    f"🆔 User ID: `{callback_user_id}`\n\n"
+                    f"💳 Пользователь сообщил об оплате подписки sub+.\n\n"
+                    f"📝 **Действия для администратора:**\n"
+                    f"Нажмите кнопку ниже для подтверждения или отклонения платежа.",
+                    payment_buttons
+                )
+                # Сохраняем message_id для последующего редактирования
+                if message_id:
+                    payment_notification_messages[callback_user_id][admin_id] = message_id
+            except Exception as e:
+                logger.warning("⚠️ Не удалось отправить уведомление админу %s: %s", admin_id, e)
 
-Бот запоминает п��следние 10 сообщенияй!"""
-                        await send_telegram_message(callback_chat_id, help_text)
-                        continue
-
-                    # Обработка кнопок подтверждения/отклонения оплаты
-                    elif callback_data.startswith("pay_confirm_") or callback_data.startswith("pay_decline_"):
-                        from backend.api.telegram_core import answer_callback_query, send_telegram_message, edit_message_text
-                        from backend.database.users_db import get_database
-
-                        # Парсим user_id из callback_data
-                        if callback_data.startswith("pay_confirm_"):
-                            target_user_id = callback_data.replace("pay_confirm_", "")
-                            action = "confirm"
-                        else:
-                            target_user_id = callback_data.replace("pay_decline_", "")
-                            action = "decline"
+        return
 
-                        db = get_database()
+    # Обработка кнопок подтверждения/отклонения оплаты
+    elif callback_data.startswith("pay_confirm_") or callback_data.startswith("pay_decline_"):
+        # Парсим user_id из callback_data
+        if callback_data.startswith("pay_confirm_"):
+            target_user_id = callback_data.replace("pay_confirm_", "")
+            action = "confirm"
+        else:
+            target_user_id = callback_data.replace("pay_decline_", "")
+            action = "decline"
 
-                        # Проверяем права администратора
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(
-                                callback_query["id"],
-                                "❌ У вас нет прав администратора"
-                            )
-                            return
+        db = get_database()
 
-                        # Получаем текущий уровень пользователя
-                        old_level = db.get_user_access_level(target_user_id)
-
-                        if action == "confirm":
-                            # Подтверждаем оплату
-                            if db.set_user_access_level(target_user_id, "sub+"):
-                                # Сбрасываем дневной счётчик
-                                db.reset_daily_generation_count(target_user_id)
-
-                                # Логируем
-                                db.log_admin_action(
-                                    admin_user_id=callback_user_id,
-                                    admin_username="",
-                                    action_type="set_level",
-                                    target_user_id=target_user_id,
-                                    old_value=old_level,
-                                    new_value="sub+",
-                                    details={"inline_payment_confirm": True, "daily_count_reset": True},
-                                    success=True
-                                )
+        # Проверяем права администратора
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(
+                callback_query["id"],
+                "❌ У вас нет прав администратора"
+            )
+            return
 
-                                # Уведомляем администратора
-                                await answer_callback_query(
-                                    callback_query["id"],
-                                    f"✅ Оплата подтверждена!\nПользователь {target_user_id} получил sub+"
-                                )
+        # Получаем текущий уровень пользователя
+        old_level = db.get_user_access_level(target_user_id)
+
+        if action == "confirm":
+            # Подтверждаем оплату
+            if db.set_user_access_level(target_user_id, "sub+"):
+                # Сбрасываем дневной счётчик
+                db.reset_daily_generation_count(target_user_id)
+
+                # Логируем
+                db.log_admin_action(
+                    admin_user_id=callback_user_id,
+                    admin_username="",
+                    action_type="set_level",
+                    target_user_id=target_user_id,
+                    old_value=old_level,
+                    new_value="sub+",
+                    details={"inline_payment_confirm": True, "daily_count_reset": True},
+                    success=True
+                )
+
+                # Уведомляем администратора и редактируем сообщение с кнопками у того, кто нажал
+                await _answer_and_edit(
+                    callback_query,
+                    callback_chat_id,
+                    callback_message_id,
+                    f"✅ **Оплата подтверждена!**\n\n"
+                    f"👤 Пользователь: `{target_user_id}`\n"
+                    f"🆔 Уровень: {old_level} → sub+\n"
+                    f"🎁 Дневной счётчик сброшен: 0/30\n\n"
+                    f"🎉 Пользователь получил 30 генераций в день!",
+                    parse_mode="Markdown",
+                    answer_text=f"✅ Оплата подтверждена!\nПользователь {target_user_id} получил sub+"
+                )
 
-                                # Редактируем сообщения с кнопками у администратора, который нажал
+                # Редактируем сообщения у ВСЕХ администраторов
+                if target_user_id in payment_notification_messages:
+                    for admin_id, msg_id in payment_notification_messages[target_user_id].items():
+                        if admin_id != str(callback_user_id):  # Не редактируем у того, кто нажал
+                            try:
                                 await edit_message_text(
-                                    callback_chat_id,
-                                    callback_message_id,
+                                    admin_id,
+                                    msg_id,
                                     f"✅ **Оплата подтверждена!**\n\n"
                                     f"👤 Пользователь: `{target_user_id}`\n"
                                     f"🆔 Уровень: {old_level} → sub+\n"
@@ -3704,79 +3781,75 @@ async def start_polling_for_bot(token: str, bot_name: str = "Bot"):
                                     f"🎉 Пользователь получил 30 генераций в день!",
                                     parse_mode="Markdown"
                                 )
+                            except Exception as e:
+                                logger.warning("⚠️ Не удалось отредактировать сообщения у админа %s: %s", admin_id, e)
 
-                                # Редактируем сообщения у ВСЕХ администраторов
-                                if target_user_id in payment_notification_messages:
-                                    for admin_id, msg_id in payment_notification_messages[target_user_id].items():
-                                        if admin_id != str(callback_user_id):  # Не редактируем у того, кто нажал
-                                            try:
-                                                await edit_message_text(
-                                                    admin_id,
-                                                    msg_id,
-                                                    f"✅ **Оплата подтверждена!**\n\n"
-                                                    f"👤 Пользователь: `{target_user_id}`\n"
-                                                    f"🆔 Уровень: {old_level} → sub+\n"
-                                                    f"🎁 Дневной счётчик сброшен: 0/30\n\n"
-                                                    f"🎉 Пользователь получил 30 генераций в день!",
-                                                    parse_mode="Markdown"
-                                                )
-                                            except Exception as e:
-                                                logger.warning(f"⚠️ Не удалось отредактировать сообщения у админа {admin_id}: {e}")
-                                    
-                                    # Очищаем хранилище message_id
-                                    del payment_notification_messages[target_user_id]
-
-                                # Уведомляем пользователя
-                                try:
-                                    await send_telegram_message(
-                                        target_user_id,
-                                        f"✅ **Оплата подтверждена!**\n\n"
-                                        f"Ваш уровень повышен до **sub+**!\n\n"
-                                        f"🎁 **Вам доступно 30 генераций изображений в день!**\n\n"
-                                        f"Дневной счётчик сброшен и теперь у вас **0/30** генераций.\n\n"
-                                        f"Спасибо за поддержку LiraAI! 💜",
-                                        parse_mode="Markdown"
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось отправить уведомление {target_user_id}: {e}")
-                            else:
-                                await answer_callback_query(callback_query["id"], "❌ Ошибка при подтверждении оплаты")
-
-                        elif action == "decline":
-                            # Увеличиваем счётчик отклонений
-                            now = datetime.now()
-                            if target_user_id not in user_declined_payments:
-                                user_declined_payments[target_user_id] = {
-                                    "declined_count": 1,
-                                    "last_declined_time": now
-                                }
-                            else:
-                                user_declined_payments[target_user_id]["declined_count"] += 1
-                                user_declined_payments[target_user_id]["last_declined_time"] = now
-
-                            # Отклоняем оплату
-                            db.log_admin_action(
-                                admin_user_id=callback_user_id,
-                                admin_username="",
-                                action_type="payment_declined",
-                                target_user_id=target_user_id,
-                                old_value=old_level,
-                                new_value="declined",
-                                details={"inline_payment_decline": True, "decline_count": user_declined_payments[target_user_id]["declined_count"]},
-                                success=True
-                            )
+                    # Очищаем хранилище message_id
+                    del payment_notification_messages[target_user_id]
 
-                            # Уведомляем администратора
-                            decline_count = user_declined_payments[target_user_id]["declined_count"]
-                            await answer_callback_query(
-                                callback_query["id"],
-                                f"⚠️ Оплата отклонена (#{decline_count})\nПользователь {target_user_id}"
-                            )
+                # Уведомляем пользователя
+                try:
+                    await send_telegram_message(
+                        target_user_id,
+                        f"✅ **Оплата подтверждена!**\n\n"
+                        f"Ваш уровень повышен до **sub+**!\n\n"
+                        f"🎁 **Вам доступно 30 генераций изображений в день!**\n\n"
+                        f"Дневной счётчик сброшен и теперь у вас **0/30** генераций.\n\n"
+                        f"Спасибо за поддержку LiraAI! 💜",
+                        parse_mode="Markdown"
+                    )
+                except Exception as e:
+                    logger.warning("⚠️ Не удалось отправить уведомление %s: %s", target_user_id, e)
+            else:
+                await answer_callback_query(callback_query["id"], "❌ Ошибка при подтверждении оплаты")
+
+        elif action == "decline":
+            # Увеличиваем счётчик отклонений
+            now = datetime.now()
+            if target_user_id not in user_declined_payments:
+                user_declined_payments[target_user_id] = {
+                    "declined_count": 1,
+                    "last_declined_time": now
+                }
+            else:
+                user_declined_payments[target_user_id]["declined_count"] += 1
+                user_declined_payments[target_user_id]["last_declined_time"] = now
+
+            # Отклоняем оплату
+            db.log_admin_action(
+                admin_user_id=callback_user_id,
+                admin_username="",
+                action_type="payment_declined",
+                target_user_id=target_user_id,
+                old_value=old_level,
+                new_value="declined",
+                details={"inline_payment_decline": True, "decline_count": user_declined_payments[target_user_id]["declined_count"]},
+                success=True
+            )
+
+            # Уведомляем администратора
+            decline_count = user_declined_payments[target_user_id]["declined_count"]
+            await _answer_and_edit(
+                callback_query,
+                callback_chat_id,
+                callback_message_id,
+                f"⚠️ **Оплата отклонена**\n\n"
+                f"👤 Пользователь: `{target_user_id}`\n"
+                f"🆔 Уровень: {old_level} (не изменён)\n"
+                f"📊 Отклонений: {decline_count}\n\n"
+                f"Пользователь получит уведомление.",
+                parse_mode="Markdown",
+                answer_text=f"⚠️ Оплата отклонена (#{decline_count})\nПользователь {target_user_id}"
+            )
 
-                            # Редактируем сообщения с кнопками у администратора, который нажал
+            # Редактируем сообщения у ВСЕХ администраторов
+            if target_user_id in payment_notification_messages:
+                for admin_id, msg_id in payment_notification_messages[target_user_id].items():
+                    if admin_id != str(callback_user_id):  # Не редактируем у того, кто нажал
+                        try:
                             await edit_message_text(
-                                callback_chat_id,
-                                callback_message_id,
+                                admin_id,
+                                msg_id,
                                 f"⚠️ **Оплата отклонена**\n\n"
                                 f"👤 Пользователь: `{target_user_id}`\n"
                                 f"🆔 Уровень: {old_level} (не изменён)\n"
@@ -3784,572 +3857,560 @@ async def start_polling_for_bot(token: str, bot_name: str = "Bot"):
                                 f"Пользователь получит уведомление.",
                                 parse_mode="Markdown"
                             )
+                        except Exception as e:
+                            logger.warning("⚠️ Не удалось отредактировать сообщения у админа %s: %s", admin_id, e)
 
-                            # Редактируем сообщения у ВСЕХ администраторов
-                            if target_user_id in payment_notification_messages:
-                                for admin_id, msg_id in payment_notification_messages[target_user_id].items():
-                                    if admin_id != str(callback_user_id):  # Не редактируем у того, кто нажал
-                                        try:
-                                            await edit_message_text(
-                                                admin_id,
-                                                msg_id,
-                                                f"⚠️ **Оплата отклонена**\n\n"
-                                                f"👤 Пользователь: `{target_user_id}`\n"
-                                                f"🆔 Уровень: {old_level} (не изменён)\n"
-                                                f"📊 Отклонений: {decline_count}\n\n"
-                                                f"Пользователь получит уведомление.",
-                                                parse_mode="Markdown"
-                                            )
-                                        except Exception as e:
-                                            logger.warning(f"⚠️ Не удалось отредактировать сообщения у админа {admin_id}: {e}")
-                                
-                                # Очищаем хранилище message_id
-                                del payment_notification_messages[target_user_id]
-
-                            # Уведомляем пользователя
-                            try:
-                                await send_telegram_message(
-                                    target_user_id,
-                                    f"⚠️ **Оплата отклонена**\n\n"
-                                    f"Ваш платёж на уровень **sub+** был отклонён.\n\n"
-                                    f"Если вы считаете, что это ошибка, свяжитесь с @suplira и предоставьте скриншот оплаты.\n\n"
-                                    f"💜 **LiraAI**",
-                                    parse_mode="Markdown"
-                                )
-                            except Exception as e:
-                                logger.warning(f"⚠️ Не удалось отправить уведомление {target_user_id}: {e}")
+                # Очищаем хранилище message_id
+                del payment_notification_messages[target_user_id]
 
-                        continue
+            # Уведомляем пользователя
+            try:
+                await send_telegram_message(
+                    target_user_id,
+                    f"⚠️ **Оплата отклонена**\n\n"
+                    f"Ваш платёж на уровень **sub+** был отклонён.\n\n"
+                    f"Если вы считаете, что это ошибка, свяжитесь с @suplira и предоставьте скриншот оплаты.\n\n"
+                    f"💜 **LiraAI**",
+                    parse_mode="Markdown"
+                )
+            except Exception as e:
+                logger.warning("⚠️ Не удалось отправить уведомление %s: %s", target_user_id, e)
 
-                    # Обработка кнопок пагинации списка пользователей
-                    elif callback_data.startswith("users_page_"):
-                        from backend.api.telegram_core import answer_callback_query, send_telegram_message_with_buttons, edit_message_text
-                        from backend.database.users_db import get_database
+        return
 
-                        await answer_callback_query(callback_query["id"])
+    # Обработка кнопок пагинации списка пользователей
+    elif callback_data.startswith("users_page_"):
+        await answer_callback_query(callback_query["id"])
 
-                        # Парсим номер страницы
-                        page_num = int(callback_data.replace("users_page_", ""))
-                        db = get_database()
+        # Парсим номер страницы
+        page_num = int(callback_data.replace("users_page_", ""))
+        db = get_database()
 
-                        users = db.get_all_users()
-                        users_text, buttons = _build_admin_users_page(users, page_num=page_num)
+        users = db.get_all_users()
+        users_text, buttons = _build_admin_users_page(users, page_num=page_num)
 
-                        # Редактируем сообщения вместо отправки нового
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            users_text,
-                            parse_mode=None,  # Отключаем Markdown чтобы избежать ошибок с username
-                            buttons=buttons
-                        )
-                        continue
+        # Редактируем сообщения вместо отправки нового
+        await edit_message_text(
+            callback_chat_id,
+            callback_message_id,
+            users_text,
+            parse_mode=None,  # Отключаем Markdown чтобы избежать ошибок с username
+            buttons=buttons
+        )
+        return
 
-                    elif callback_data == "admin_users":
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-                        from backend.database.users_db import get_database
+    elif callback_data == "admin_users":
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
-
-                        await answer_callback_query(callback_query["id"])
-                        users = db.get_all_users()
-                        users_text, buttons = _build_admin_users_page(users, page_num=0)
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            users_text,
-                            parse_mode=None,
-                            buttons=buttons
-                        )
-                        continue
+        await answer_callback_query(callback_query["id"])
+        users = db.get_all_users()
+        users_text, buttons = _build_admin_users_page(users, page_num=0)
+        await edit_message_text(
+            callback_chat_id,
+            callback_message_id,
+            users_text,
+            parse_mode=None,
+            buttons=buttons
+        )
+        return
 
-                    elif callback_data.startswith("admin_user:"):
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-                        from backend.database.users_db import get_database
+    elif callback_data.startswith("admin_user:"):
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
-
-                        _, target_user_id, page_str = callback_data.split(":", 2)
-                        page_num = int(page_str)
-                        text, buttons = _build_admin_user_card(db, target_user_id, page_num=page_num)
-
-                        await answer_callback_query(callback_query["id"])
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            text,
-                            parse_mode="Markdown",
-                            buttons=buttons
-                        )
-                        continue
+        _, target_user_id, page_str = callback_data.split(":", 2)
+        page_num = int(page_str)
+        text, buttons = _build_admin_user_card(db, target_user_id, page_num=page_num)
+
+        await _answer_and_edit(
+            callback_query,
+            callback_chat_id,
+            callback_message_id,
+            text,
+            parse_mode="Markdown",
+            buttons=buttons
+        )
+        return
 
-                    elif callback_data.startswith("admin_user_action:"):
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text, send_telegram_message
-                        from backend.database.users_db import get_database
+    elif callback_data.startswith("admin_user_action:"):
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
-
-                        _, action, target_user_id, page_str = callback_data.split(":", 3)
-                        page_num = int(page_str)
-
-                        if action == "subplus":
-                            old_level = db.get_user_access_level(target_user_id)
-                            if old_level == "sub+":
-                                await answer_callback_query(callback_query["id"], "ℹ️ У пользователя уже sub+")
-                                continue
-                            db.add_or_update_user(target_user_id)
-                            success = db.set_user_access_level(target_user_id, "sub+")
-                            if success:
-                                db.reset_daily_generation_count(target_user_id)
-                                db.log_admin_action(
-                                    admin_user_id=callback_user_id,
-                                    admin_username="",
-                                    action_type="set_level",
-                                    target_user_id=target_user_id,
-                                    old_value=old_level,
-                                    new_value="sub+",
-                                    details={"inline_admin_user_card": True, "daily_count_reset": True},
-                                    success=True
-                                )
-                                await answer_callback_query(callback_query["id"], "✅ Выдан sub+")
-                                try:
-                                    await send_telegram_message(
-                                        target_user_id,
-                                        "✅ **Ваш уровень повышен до sub+!**\n\n"
-                                        "🎁 Теперь вам доступно **30 генераций изображений в день**.\n\n"
-                                        "Дневной счётчик сброшен.\n\n"
-                                        "Спасибо за использование LiraAI!",
-                                        parse_mode="Markdown"
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {target_user_id}: {e}")
-                            else:
-                                await answer_callback_query(callback_query["id"], "❌ Не удалось выдать sub+")
-                                continue
-
-                        elif action == "subscriber":
-                            old_level = db.get_user_access_level(target_user_id)
-                            if old_level == "subscriber":
-                                await answer_callback_query(callback_query["id"], "ℹ️ У пользователя уже subscriber")
-                                continue
-                            db.add_or_update_user(target_user_id)
-                            success = db.set_user_access_level(target_user_id, "subscriber")
-                            if success:
-                                db.log_admin_action(
-                                    admin_user_id=callback_user_id,
-                                    admin_username="",
-                                    action_type="set_level",
-                                    target_user_id=target_user_id,
-                                    old_value=old_level,
-                                    new_value="subscriber",
-                                    details={"inline_admin_user_card": True},
-                                    success=True
-                                )
-                                await answer_callback_query(callback_query["id"], "✅ Выдан subscriber")
-                                try:
-                                    await send_telegram_message(
-                                        target_user_id,
-                                        "⭐ **Ваш уровень повышен до subscriber!**\n\n"
-                                        "Теперь вам доступно **5 генераций изображений в день**.\n\n"
-                                        "Спасибо за использование LiraAI!",
-                                        parse_mode="Markdown"
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {target_user_id}: {e}")
-                            else:
-                                await answer_callback_query(callback_query["id"], "❌ Не удалось выдать subscriber")
-                                continue
-
-                        elif action == "user":
-                            old_level = db.get_user_access_level(target_user_id)
-                            if old_level == "user":
-                                await answer_callback_query(callback_query["id"], "ℹ️ У пользователя уже уровень user")
-                                continue
-                            db.add_or_update_user(target_user_id)
-                            success = db.set_user_access_level(target_user_id, "user")
-                            if success:
-                                db.log_admin_action(
-                                    admin_user_id=callback_user_id,
-                                    admin_username="",
-                                    action_type="remove_level",
-                                    target_user_id=target_user_id,
-                                    old_value=old_level,
-                                    new_value="user",
-                                    details={"inline_admin_user_card": True},
-                                    success=True
-                                )
-                                await answer_callback_query(callback_query["id"], "✅ Уровень изменён на user")
-                                try:
-                                    await send_telegram_message(
-                                        target_user_id,
-                                        f"👤 **Ваш уровень доступа изменён.**\n\n"
-                                        f"Было: {old_level}\n"
-                                        f"Стало: user\n\n"
-                                        f"Теперь у вас **3 генерации изображений в день**.\n\n"
-                                        f"Спасибо за использование LiraAI!",
-                                        parse_mode="Markdown"
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {target_user_id}: {e}")
-                            else:
-                                await answer_callback_query(callback_query["id"], "❌ Не удалось изменить уровень")
-                                continue
-
-                        elif action == "reset":
-                            success = db.reset_daily_generation_count(target_user_id)
-                            if success:
-                                db.log_admin_action(
-                                    admin_user_id=callback_user_id,
-                                    admin_username="",
-                                    action_type="reset_daily_limit",
-                                    target_user_id=target_user_id,
-                                    details={"inline_admin_user_card": True},
-                                    success=True
-                                )
-                                await answer_callback_query(callback_query["id"], "✅ Дневной лимит сброшен")
-                                try:
-                                    await send_telegram_message(
-                                        target_user_id,
-                                        "🔄 **Ваш дневной лимит генераций сброшен администратором.**\n\n"
-                                        "Можете снова использовать генерацию изображений.",
-                                        parse_mode="Markdown"
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {target_user_id}: {e}")
-                            else:
-                                await answer_callback_query(callback_query["id"], "❌ Не удалось сбросить лимит")
-                                continue
-
-                        elif action == "history":
-                            history = db.get_admin_dialog_history(target_user_id, limit=10)
-                            stats = db.get_user_dialog_stats(target_user_id) or {}
-                            if not history:
-                                text = f"📚 *История пользователя*\n\n`{target_user_id}`\n\nИстория не найдена."
-                            else:
-                                lines = [
-                                    "📚 *История пользователя*\n",
-                                    f"`{target_user_id}`",
-                                    f"Всего сообщений: *{stats.get('total_messages', 0)}*\n",
-                                ]
-                                for msg in history[-10:]:
-                                    role_icon = "👤" if msg.get("role") == "user" else "🤖"
-                                    created = (msg.get("created_at") or "")[:16]
-                                    content = _escape_markdown(msg.get("content") or "")
-                                    if len(content) > 90:
-                                        content = content[:90] + "..."
-                                    lines.append(f"{role_icon} `{created}` {content}")
-                                text = "\n".join(lines)
-
-                            buttons = [
-                                [{"text": "⬅️ Назад к карточке", "callback_data": f"admin_user:{target_user_id}:{page_num}"}],
-                                [{"text": "⬅️ К админке", "callback_data": "admin_home"}]
-                            ]
-                            await answer_callback_query(callback_query["id"])
-                            await edit_message_text(
-                                callback_chat_id,
-                                callback_message_id,
-                                text,
-                                parse_mode="Markdown",
-                                buttons=buttons
-                            )
-                            continue
+        _, action, target_user_id, page_str = callback_data.split(":", 3)
+        page_num = int(page_str)
 
-                        elif action == "ban_prompt":
-                            pending_ban_input[callback_user_id] = {
-                                "target_user_id": target_user_id,
-                                "page_num": page_num,
-                            }
-                            await answer_callback_query(callback_query["id"], "📝 Введите срок бана в чат")
-                            await send_telegram_message(
-                                callback_chat_id,
-                                f"🔨 Введите срок бана для пользователя `{target_user_id}`.\n\n"
-                                f"Примеры:\n"
-                                f"`7` - бан на 7 дней\n"
-                                f"`30` - бан на 30 дней\n"
-                                f"`permanent` - навсегда\n\n"
-                                f"/cancel - отмена",
-                                parse_mode="Markdown"
-                            )
-                            continue
+        if action == "subplus":
+            old_level = db.get_user_access_level(target_user_id)
+            if old_level == "sub+":
+                await answer_callback_query(callback_query["id"], "ℹ️ У пользователя уже sub+")
+                return
+            db.add_or_update_user(target_user_id)
+            success = db.set_user_access_level(target_user_id, "sub+")
+            if success:
+                db.reset_daily_generation_count(target_user_id)
+                db.log_admin_action(
+                    admin_user_id=callback_user_id,
+                    admin_username="",
+                    action_type="set_level",
+                    target_user_id=target_user_id,
+                    old_value=old_level,
+                    new_value="sub+",
+                    details={"inline_admin_user_card": True, "daily_count_reset": True},
+                    success=True
+                )
+                await answer_callback_query(callback_query["id"], "✅ Выдан sub+")
+                try:
+                    await send_telegram_message(
+                        target_user_id,
+                        "✅ **Ваш уровень повышен до sub+!**\n\n"
+                        "🎁 Теперь вам доступно **30 генераций изображений в день**.\n\n"
+                        "Дневной счётчик сброшен.\n\n"
+                        "Спасибо за использование LiraAI!",
+                        parse_mode="Markdown"
+                    )
+                except Exception as e:
+                    logger.warning("⚠️ Не удалось отправить уведомление пользователю %s: %s", target_user_id, e)
+            else:
+                await answer_callback_query(callback_query["id"], "❌ Не удалось выдать sub+")
+                return
 
-                        elif action == "message":
-                            pending_admin_messages[callback_user_id] = {
-                                "target_user_id": target_user_id,
-                                "page_num": page_num,
-                                "created_at": datetime.now(),
-                            }
-                            await answer_callback_query(callback_query["id"], "✉️ Введите сообщение в чат")
-                            await send_telegram_message(
-                                callback_chat_id,
-                                f"✉️ Введите сообщение для пользователя `{target_user_id}`.\n\n"
-                                f"Следующее обычное текстовое сообщение будет отправлено ему.\n"
-                                f"/cancel - отмена",
-                                parse_mode="Markdown"
-                            )
-                            continue
-
-                        elif action == "unban":
-                            success = db.remove_user_ban(target_user_id)
-                            if success:
-                                db.log_admin_action(
-                                    admin_user_id=callback_user_id,
-                                    admin_username="",
-                                    action_type="unban_user",
-                                    target_user_id=target_user_id,
-                                    details={"inline_admin_user_card": True},
-                                    success=True
-                                )
-                                await answer_callback_query(callback_query["id"], "✅ Пользователь разбанен")
-                                try:
-                                    await send_telegram_message(
-                                        target_user_id,
-                                        "✅ **Блокировка в боте снята.**",
-                                        parse_mode="Markdown"
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось отправить уведомление о разбане {target_user_id}: {e}")
-                            else:
-                                await answer_callback_query(callback_query["id"], "❌ Не удалось снять бан")
-                                continue
-
-                        text, buttons = _build_admin_user_card(db, target_user_id, page_num=page_num)
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            text,
-                            parse_mode="Markdown",
-                            buttons=buttons
-                        )
-                        continue
+        elif action == "subscriber":
+            old_level = db.get_user_access_level(target_user_id)
+            if old_level == "subscriber":
+                await answer_callback_query(callback_query["id"], "ℹ️ У пользователя уже subscriber")
+                return
+            db.add_or_update_user(target_user_id)
+            success = db.set_user_access_level(target_user_id, "subscriber")
+            if success:
+                db.log_admin_action(
+                    admin_user_id=callback_user_id,
+                    admin_username="",
+                    action_type="set_level",
+                    target_user_id=target_user_id,
+                    old_value=old_level,
+                    new_value="subscriber",
+                    details={"inline_admin_user_card": True},
+                    success=True
+                )
+                await answer_callback_query(callback_query["id"], "✅ Выдан subscriber")
+                try:
+                    await send_telegram_message(
+                        target_user_id,
+                        "⭐ **Ваш уровень повышен до subscriber!**\n\n"
+                        "Теперь вам доступно **5 генераций изображений в день**.\n\n"
+                        "Спасибо за использование LiraAI!",
+                        parse_mode="Markdown"
+                    )
+                except Exception as e:
+                    logger.warning("⚠️ Не удалось отправить уведомление пользователю %s: %s", target_user_id, e)
+            else:
+                await answer_callback_query(callback_query["id"], "❌ Не удалось выдать subscriber")
+                return
 
-                    elif callback_data == "admin_stats_panel":
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-                        from backend.database.users_db import get_database
+        elif action == "user":
+            old_level = db.get_user_access_level(target_user_id)
+            if old_level == "user":
+                await answer_callback_query(callback_query["id"], "ℹ️ У пользователя уже уровень user")
+                return
+            db.add_or_update_user(target_user_id)
+            success = db.set_user_access_level(target_user_id, "user")
+            if success:
+                db.log_admin_action(
+                    admin_user_id=callback_user_id,
+                    admin_username="",
+                    action_type="remove_level",
+                    target_user_id=target_user_id,
+                    old_value=old_level,
+                    new_value="user",
+                    details={"inline_admin_user_card": True},
+                    success=True
+                )
+                await answer_callback_query(callback_query["id"], "✅ Уровень изменён на user")
+                try:
+                    await send_telegram_message(
+                        target_user_id,
+                        f"👤 **Ваш уровень доступа изменён.**\n\n"
+                        f"Было: {old_level}\n"
+                        f"Стало: user\n\n"
+                        f"Теперь у вас **3 генерации изображений в день**.\n\n"
+                        f"Спасибо за использование LiraAI!",
+                        parse_mode="Markdown"
+                    )
+                except Exception as e:
+                    logger.warning("⚠️ Не удалось отправить уведомление пользователю %s: %s", target_user_id, e)
+            else:
+                await answer_callback_query(callback_query["id"], "❌ Не удалось изменить уровень")
+                return
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
-
-                        total_users = db.get_all_users_count()
-                        users = db.get_all_users()
-                        admin_count = sum(1 for u in users if u.get("access_level") == "admin")
-                        sub_plus_count = sum(1 for u in users if u.get("access_level") == "sub+")
-                        subscriber_count = sum(1 for u in users if u.get("access_level") == "subscriber")
-                        user_count = sum(1 for u in users if u.get("access_level") == "user")
-                        total_gens = sum(int(u.get("total_count", 0) or 0) for u in users)
-                        today_gens = sum(int(u.get("today_generations", u.get("daily_count", 0)) or 0) for u in users)
-                        active_today = sum(1 for u in users if int(u.get("today_generations", u.get("daily_count", 0)) or 0) > 0)
-
-                        text = (
-                            "📊 *Статистика бота*\n\n"
-                            f"👥 Пользователей: *{total_users}*\n"
-                            f"👑 Админов: *{admin_count}*\n"
-                            f"🚀 sub+: *{sub_plus_count}*\n"
-                            f"⭐ Подписчиков: *{subscriber_count}*\n"
-                            f"👤 Обычных: *{user_count}*\n\n"
-                            f"🎨 Генераций сегодня: *{today_gens}*\n"
-                            f"🎨 Генераций всего: *{total_gens}*\n"
-                            f"🔥 Активных сегодня: *{active_today}*"
-                        )
-                        buttons = [[{"text": "⬅️ К админке", "callback_data": "admin_home"}]]
-
-                        await answer_callback_query(callback_query["id"])
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            text,
-                            parse_mode="Markdown",
-                            buttons=buttons
-                        )
-                        continue
+        elif action == "reset":
+            success = db.reset_daily_generation_count(target_user_id)
+            if success:
+                db.log_admin_action(
+                    admin_user_id=callback_user_id,
+                    admin_username="",
+                    action_type="reset_daily_limit",
+                    target_user_id=target_user_id,
+                    details={"inline_admin_user_card": True},
+                    success=True
+                )
+                await answer_callback_query(callback_query["id"], "✅ Дневной лимит сброшен")
+                try:
+                    await send_telegram_message(
+                        target_user_id,
+                        "🔄 **Ваш дневной лимит генераций сброшен администратором.**\n\n"
+                        "Можете снова использовать генерацию изображений.",
+                        parse_mode="Markdown"
+                    )
+                except Exception as e:
+                    logger.warning("⚠️ Не удалось отправить уведомление пользователю %s: %s", target_user_id, e)
+            else:
+                await answer_callback_query(callback_query["id"], "❌ Не удалось сбросить лимит")
+                return
 
-                    elif callback_data == "admin_logs":
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-                        from backend.database.users_db import get_database
+        elif action == "history":
+            history = db.get_admin_dialog_history(target_user_id, limit=10)
+            stats = db.get_user_dialog_stats(target_user_id) or {}
+            if not history:
+                text = f"📚 *История пользователя*\n\n`{target_user_id}`\n\nИстория не найдена."
+            else:
+                lines = [
+                    "📚 *История пользователя*\n",
+                    f"`{target_user_id}`",
+                    f"Всего сообщений: *{stats.get('total_messages', 0)}*\n",
+                ]
+                for msg in history[-10:]:
+                    role_icon = "👤" if msg.get("role") == "user" else "🤖"
+                    created = (msg.get("created_at") or "")[:16]
+                    content = _escape_markdown(msg.get("content") or "")
+                    if len(content) > 90:
+                        content = content[:90] + "..."
+                    lines.append(f"{role_icon} `{created}` {content}")
+                text = "\n".join(lines)
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
+            buttons = [
+                [{"text": "⬅️ Назад к карточке", "callback_data": f"admin_user:{target_user_id}:{page_num}"}],
+                [{"text": "⬅️ К админке", "callback_data": "admin_home"}]
+            ]
+            await _answer_and_edit(
+                callback_query,
+                callback_chat_id,
+                callback_message_id,
+                text,
+                parse_mode="Markdown",
+                buttons=buttons
+            )
+            return
 
-                        logs = db.get_admin_audit_log(admin_user_id=callback_user_id, limit=10)
-                        if not logs:
-                            text = "📋 *Audit Log*\n\nЗаписей пока нет."
-                        else:
-                            lines = ["📋 *Audit Log*\n"]
-                            for log in logs[:10]:
-                                action_type = log.get("action_type", "unknown")
-                                target = log.get("target_user_id", "N/A")
-                                created = (log.get("created_at") or "")[:16]
-                                status_icon = "✅" if log.get("success", True) else "❌"
-                                lines.append(f"{status_icon} `{action_type}` → `{target}`")
-                                lines.append(f"`{created}`")
-                                lines.append("")
-                            text = "\n".join(lines).strip()
-
-                        buttons = [[{"text": "⬅️ К админке", "callback_data": "admin_home"}]]
-                        await answer_callback_query(callback_query["id"])
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            text,
-                            parse_mode="Markdown",
-                            buttons=buttons
-                        )
-                        continue
+        elif action == "ban_prompt":
+            pending_ban_input[callback_user_id] = {
+                "target_user_id": target_user_id,
+                "page_num": page_num,
+            }
+            await answer_callback_query(callback_query["id"], "📝 Введите срок бана в чат")
+            await send_telegram_message(
+                callback_chat_id,
+                f"🔨 Введите срок бана для пользователя `{target_user_id}`.\n\n"
+                f"Примеры:\n"
+                f"`7` - бан на 7 дней\n"
+                f"`30` - бан на 30 дней\n"
+                f"`permanent` - навсегда\n\n"
+                f"/cancel - отмена",
+                parse_mode="Markdown"
+            )
+            return
 
-                    elif callback_data == "admin_help":
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-                        from backend.database.users_db import get_database
+        elif action == "message":
+            pending_admin_messages[callback_user_id] = {
+                "target_user_id": target_user_id,
+                "page_num": page_num,
+                "created_at": datetime.now(),
+            }
+            await answer_callback_query(callback_query["id"], "✉️ Введите сообщение в чат")
+            await send_telegram_message(
+                callback_chat_id,
+                f"✉️ Введите сообщение для пользователя `{target_user_id}`.\n\n"
+                f"Следующее обычное текстовое сообщение будет отправлено ему.\n"
+                f"/cancel - отмена",
+                parse_mode="Markdown"
+            )
+            return
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
-
-                        await answer_callback_query(callback_query["id"])
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            _build_admin_help_text(),
-                            parse_mode="Markdown",
-                            buttons=[[{"text": "⬅️ К админке", "callback_data": "admin_home"}]]
-                        )
-                        continue
+        elif action == "unban":
+            success = db.remove_user_ban(target_user_id)
+            if success:
+                db.log_admin_action(
+                    admin_user_id=callback_user_id,
+                    admin_username="",
+                    action_type="unban_user",
+                    target_user_id=target_user_id,
+                    details={"inline_admin_user_card": True},
+                    success=True
+                )
+                await answer_callback_query(callback_query["id"], "✅ Пользователь разбанен")
+                try:
+                    await send_telegram_message(
+                        target_user_id,
+                        "✅ **Блокировка в боте снята.**",
+                        parse_mode="Markdown"
+                    )
+                except Exception as e:
+                    logger.warning("⚠️ Не удалось отправить уведомление о разбане %s: %s", target_user_id, e)
+            else:
+                await answer_callback_query(callback_query["id"], "❌ Не удалось снять бан")
+                return
 
-                    elif callback_data == "admin_home":
-                        from backend.api.telegram_core import answer_callback_query, edit_message_text
-                        from backend.database.users_db import get_database
+        text, buttons = _build_admin_user_card(db, target_user_id, page_num=page_num)
+        await edit_message_text(
+            callback_chat_id,
+            callback_message_id,
+            text,
+            parse_mode="Markdown",
+            buttons=buttons
+        )
+        return
 
-                        db = get_database()
-                        if not db.is_admin(callback_user_id):
-                            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
-                            continue
-
-                        admin_text, admin_buttons = _build_admin_panel()
-                        await answer_callback_query(callback_query["id"])
-                        await edit_message_text(
-                            callback_chat_id,
-                            callback_message_id,
-                            admin_text,
-                            parse_mode="Markdown",
-                            buttons=admin_buttons
-                        )
-                        continue
+    elif callback_data == "admin_stats_panel":
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-                    # Обработка inline кнопок из welcome сообщения
-                    elif callback_data.startswith("menu_"):
-                        from backend.api.telegram_core import answer_callback_query, send_telegram_message
+        total_users = db.get_all_users_count()
+        users = db.get_all_users()
+        admin_count = sum(1 for u in users if u.get("access_level") == "admin")
+        sub_plus_count = sum(1 for u in users if u.get("access_level") == "sub+")
+        subscriber_count = sum(1 for u in users if u.get("access_level") == "subscriber")
+        user_count = sum(1 for u in users if u.get("access_level") == "user")
+        total_gens = sum(int(u.get("total_count", 0) or 0) for u in users)
+        today_gens = sum(int(u.get("today_generations", u.get("daily_count", 0)) or 0) for u in users)
+        active_today = sum(1 for u in users if int(u.get("today_generations", u.get("daily_count", 0)) or 0) > 0)
+
+        text = (
+            "📊 *Статистика бота*\n\n"
+            f"👥 Пользователей: *{total_users}*\n"
+            f"👑 Админов: *{admin_count}*\n"
+            f"🚀 sub+: *{sub_plus_count}*\n"
+            f"⭐ Подписчиков: *{subscriber_count}*\n"
+            f"👤 Обычных: *{user_count}*\n\n"
+            f"🎨 Генераций сегодня: *{today_gens}*\n"
+            f"🎨 Генераций всего: *{total_gens}*\n"
+            f"🔥 Активных сегодня: *{active_today}*"
+        )
+        buttons = [[{"text": "⬅️ К админке", "callback_data": "admin_home"}]]
+
+        await _answer_and_edit(
+            callback_query,
+            callback_chat_id,
+            callback_message_id,
+            text,
+            parse_mode="Markdown",
+            buttons=buttons
+        )
+        return
 
-                        await answer_callback_query(callback_query["id"])
+    elif callback_data == "admin_logs":
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-                        if callback_data == "menu_models":
-                            # Открываем выбор моделей
-                            user_selecting_model[callback_user_id] = True
-                            keyboard = create_model_selection_keyboard()
-                            await send_telegram_message(
-                                callback_chat_id,
-                                "🤖 **Выбор модели**\n\nВыберите модель на клавиатуре ниже.",
-                                reply_markup=keyboard,
-                                parse_mode="Markdown"
-                            )
-                        elif callback_data == "menu_photo":
-                            await send_telegram_message(
-                                callback_chat_id,
-                                "📸 **Режим фото**\n\nОтправьте мне фотографию, и я её проанализирую!"
-                            )
-                        elif callback_data == "menu_voice":
-                            await send_telegram_message(
-                                callback_chat_id,
-                                "🎤 **Голосовой режим**\n\nОтправьте голосовое сообщение, и я распознаю его!"
-                            )
-                        elif callback_data == "gen_photo":
-                            user_generating_photo[callback_user_id] = True
-                            await send_telegram_message(
-                                callback_chat_id,
-                                "🎨 **Генерация изображений**\n\nОтправьте описание изображения."
-                            )
-                        elif callback_data == "stats":
-                            # Показываем статистику
-                            stats = db.get_user_stats(callback_user_id)
-                            if stats:
-                                level_info = {
-                                    "admin": "👑 Администратор (безлимит)",
-                                    "subscriber": "⭐ Подписчик (5 �� день)",
-                                    "user": "👤 Пользователь (3 в день)"
-                                }
-                                level = stats.get('access_level', 'user')
-                                first_name = stats.get('first_name', '')
-                                username = stats.get('username', '')
-                                name_parts = []
-                                if first_name:
-                                    name_parts.append(first_name)
-                                if username:
-                                    name_parts.append(f"@{username}")
-                                name = " ".join(name_parts) if name_parts else f"User {callback_user_id}"
-                                stats_text = f"""📊 **Ваша статистика**
+        logs = db.get_admin_audit_log(admin_user_id=callback_user_id, limit=10)
+        if not logs:
+            text = "📋 *Audit Log*\n\nЗаписей пока нет."
+        else:
+            lines = ["📋 *Audit Log*\n"]
+            for log in logs[:10]:
+                action_type = log.get("action_type", "unknown")
+                target = log.get("target_user_id", "N/A")
+                created = (log.get("created_at") or "")[:16]
+                status_icon = "✅" if log.get("success", True) else "❌"
+                lines.append(f"{status_icon} `{action_type}` → `{target}`")
+                lines.append(f"`{created}`")
+                lines.append("")
+            text = "\n".join(lines).strip()
+
+        buttons = [[{"text": "⬅️ К админке", "callback_data": "admin_home"}]]
+        await _answer_and_edit(
+            callback_query,
+            callback_chat_id,
+            callback_message_id,
+            text,
+            parse_mode="Markdown",
+            buttons=buttons
+        )
+        return
 
-👤 {name}
-🔑 Уровень: **{level_info.get(level, 'Пользователь')}**
+    elif callback_data == "admin_help":
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-📈 Генерации:
-• Сегодня: {stats.get('daily_count', 0)}
-• Всего: {stats.get('total_count', 0)}
+        await _answer_and_edit(
+            callback_query,
+            callback_chat_id,
+            callback_message_id,
+            _build_admin_help_text(),
+            parse_mode="Markdown",
+            buttons=[[{"text": "⬅️ К админке", "callback_data": "admin_home"}]]
+        )
+        return
 
-📅 В боте с: {stats.get('created_at', 'неизвестно')[:10]}"""
-                                await send_telegram_message(callback_chat_id, stats_text)
-                            else:
-                                await send_telegram_message(callback_chat_id, "❌ Не удалось получить статистику")
-                        continue
-
-                    # Обработка кнопок для фото
-                    if callback_data.startswith("photo_img_") or callback_data.startswith("photo_text_"):
-                        from backend.api.telegram_photo_handler import handle_photo_callback
-                        from backend.api.telegram_core import answer_callback_query
-
-                        # Отвечаем на callback сразу, чтобы убрать "часики"
-                        await answer_callback_query(callback_query["id"], "✅ Обрабатываю...")
-
-                        # Обрабатываем callback (может занять время)
-                        handled = await handle_photo_callback(
-                            callback_query,
-                            callback_data,
-                            callback_chat_id,
-                            callback_message_id,
-                            callback_user_id,
-                            temp_dir,
-                            download_telegram_file,
-                            config
-                        )
+    elif callback_data == "admin_home":
+        db = get_database()
+        if not db.is_admin(callback_user_id):
+            await answer_callback_query(callback_query["id"], "❌ Нет прав администратора")
+            return
 
-                        if not handled:
-                            await answer_callback_query(callback_query["id"], "❌ Ошибка обработки")
-                        continue
+        admin_text, admin_buttons = _build_admin_panel()
+        await _answer_and_edit(
+            callback_query,
+            callback_chat_id,
+            callback_message_id,
+            admin_text,
+            parse_mode="Markdown",
+            buttons=admin_buttons
+        )
+        return
+
+    # Обработка inline кнопок из welcome сообщения
+    elif callback_data.startswith("menu_"):
+        await answer_callback_query(callback_query["id"])
+
+        if callback_data == "menu_models":
+            # Открываем выбор моделей
+            user_selecting_model[callback_user_id] = True
+            keyboard = MODEL_SELECTION_KEYBOARD
+            await send_telegram_message(
+                callback_chat_id,
+                "🤖 **Выбор модели**\n\nВыберите модель на клавиатуре ниже.",
+                reply_markup=keyboard,
+                parse_mode="Markdown"
+            )
+        elif callback_data == "menu_photo":
+            await send_telegram_message(
+                callback_chat_id,
+                "📸 **Режим фото**\n\nОтправьте мне фотографию, и я её проанализирую!"
+            )
+        elif callback_data == "menu_voice":
+            await send_telegram_message(
+                callback_chat_id,
+                "🎤 **Голосовой режим**\n\nОтправьте голосовое сообщение, и я распознаю его!"
+            )
+        elif callback_data == "gen_photo":
+            user_generating_photo[callback_user_id] = True
+            await send_telegram_message(
+                callback_chat_id,
+                "🎨 **Генерация изображений**\n\nОтправьте описание изображения."
+            )
+        elif callback_data == "stats":
+            # Показываем статистику
+            stats = db.get_user_stats(callback_user_id)
+            if stats:
+                level = stats.get('access_level', 'user')
+                first_name = stats.get('first_name', '')
+                username = stats.get('username', '')
+                name_parts = []
+                if first_name:
+                    name_parts.append(first_name)
+                if username:
+                    name_parts.append(f"@{username}")
+                name = " ".join(name_parts) if name_parts else f"User {callback_user_id}"
+                stats_text = STATS_CALLBACK_TEMPLATE.format(
+                    name=name,
+                    level=LEVEL_INFO.get(level, 'Пользователь'),
+                    daily_count=stats.get('daily_count', 0),
+                    total_count=stats.get('total_count', 0),
+                    created_at=stats.get('created_at', 'неизвестно')[:10]
+                )
+                await send_telegram_message(callback_chat_id, stats_text)
+            else:
+                await send_telegram_message(callback_chat_id, "❌ Не удалось получить статистику")
+        return
+
+    # Обработка кнопок для фото
+    if callback_data.startswith("photo_img_") or callback_data.startswith("photo_text_"):
+        # Отвечаем на callback сразу, чтобы убрать "часики"
+        await answer_callback_query(callback_query["id"], "✅ Обрабатываю...")
+
+        # Обрабатываем callback (может занять время)
+        handled = await handle_photo_callback(
+            callback_query,
+            callback_data,
+            callback_chat_id,
+            callback_message_id,
+            callback_user_id,
+            temp_dir,
+            download_telegram_file,
+            config
+        )
+
+        if not handled:
+            await answer_callback_query(callback_query["id"], "❌ Ошибка обработки")
+        return
+
+
+async def start_polling_for_bot(token: str, bot_name: str = "Bot"):
+    """Запускает polling для одного бота"""
+    global last_update_id
+    last_update_id = 0
+
+    logger.info("📱 Запуск Telegram polling для %s...", bot_name)
+    
+    while True:
+        try:
+            updates = await get_updates(token, offset=last_update_id + 1)
+
+            if updates:
+                logger.debug("[%s] Получено %s обновлений", bot_name, len(updates))
+
+            for update in updates:
+                update_id = update.get("update_id")
+                
+                # СРАЗУ обновляем last_update_id ПЕРЕД обработкой, чтобы избежать дублирования
+                last_update_id = max(last_update_id, update_id)
+
+                # Обрабатываем сообщения
+                if "message" in update:
+                    message = update["message"]
+                    chat_id = str(message.get("chat", {}).get("id"))
+                    chat_type = message.get("chat", {}).get("type", "unknown")
+                    from_user_id = message.get("from", {}).get("id")
+                    text = message.get("text", "")
+
+                    logger.info("[%s] 📨 Получено сообщения в %s %s от %s: %s", bot_name, chat_type, chat_id, from_user_id, text[:50])
+
+                    # Сохраняем связь chat_id -> token
+                    set_token_for_chat(chat_id, token)
+                    _dispatch_to_chat(chat_id, process_message(message, token))
+
+                # Обрабатываем callback_query (для кнопок)
+                if "callback_query" in update:
+                    callback_query = update["callback_query"]
+                    callback_chat_id = str(callback_query["message"]["chat"]["id"])
+                    _dispatch_to_chat(callback_chat_id, process_callback_query(callback_query))
             
             # Небольшая задержка между запросами
             await asyncio.sleep(0.1)
             
         except KeyboardInterrupt:
-            logger.info(f"Остановка polling для {bot_name} по запросу пользователя")
+            logger.info("Остановка polling для %s по запросу пользователя", bot_name)
             break
         except Exception as e:
             error_str = str(e)
             # Для ошибок 502 делаем экспоненциальную задержку
             if "502" in error_str or "Bad Gateway" in error_str:
-                logger.warning(f"Ошибка 502 в polling для {bot_name}, увеличиваю задержку...")
+                logger.warning("Ошибка 502 в polling для %s, увеличиваю задержку...", bot_name)
                 await asyncio.sleep(30)  # Большая задержка для 502
             else:
-                logger.error(f"Ошибка в polling для {bot_name}: {e}")
+                logger.error("Ошибка в polling для %s: %s", bot_name, e)
                 await asyncio.sleep(5)  # Обычная пауза перед повтором
 
 
@@ -2,7 +2,7 @@
 Модуль для обработки изображений в Telegram боте.
 """
 import logging
-import os
+import uuid
 from typing import Dict, Any, Optional
 from pathlib import Path
 
@@ -66,7 +66,7 @@ async def process_telegram_photo(
         await send_telegram_message(chat_id, "🔍 Анализирую изображение...")
         
         # Скачиваем фото
-        local_path = temp_dir / f"photo_{os.getpid()}.jpg"
+        local_path = temp_dir / f"photo_{uuid.uuid4().hex}.jpg"
         downloaded_path = await download_telegram_file(file_id, local_path)
         
         if not downloaded_path:
@@ -84,7 +84,12 @@ async def process_telegram_photo(
         else:
             prompt = "Что на этом изображении? Опиши подробно, обращая внимание на детали. Используй русский язык."
         
-        description = await analyzer.analyze_image(downloaded_path, prompt)
+        try:
+            description = await analyzer.analyze_image(downloaded_path, prompt)
+        finally:
+            # Удаляем временный файл даже если анализ завершился ошибкой
+            Path(downloaded_path).unlink(missing_ok=True)
+            logger.info(f"Удален временный файл: {downloaded_path}")
         
         if not description:
             logger.error(f"Не удалось проанализировать изображение: {file_id}")
@@ -94,13 +99,6 @@ async def process_telegram_photo(
         # Отправляем результат анализа
         await send_telegram_message(chat_id, f"👁️ <b>Я вижу на изображении:</b>\n\n{description}", "HTML")
         
-        # Удаляем временный файл
-        try:
-            os.remove(downloaded_path)
-            logger.info(f"Удален временный файл: {downloaded_path}")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении временного файла: {e}")
-        
         logger.info(f"[VISION] Возвращаю описание: {description[:100]}...")
         return description
         
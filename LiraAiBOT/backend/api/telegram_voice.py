@@ -2,7 +2,7 @@
 Модуль для обработки голосовых сообщений в Telegram боте.
 """
 import logging
-import os
+import uuid
 from typing import Dict, Any, Optional
 from pathlib import Path
 
@@ -74,7 +74,7 @@ async def process_telegram_voice(
         await send_telegram_message(chat_id, "🎤 Распознаю речь...")
         
         # Скачиваем аудиофайл
-        local_path = temp_dir / f"voice_{os.getpid()}.ogg"
+        local_path = temp_dir / f"voice_{uuid.uuid4().hex}.ogg"
         downloaded_path = await download_telegram_file(file_id, local_path)
         
         if not downloaded_path:
@@ -84,13 +84,11 @@ async def process_telegram_voice(
         
         # Распознаем речь
         stt = get_stt_engine()
-        text = await stt.speech_to_text(downloaded_path, language="ru")
-        
-        # Удаляем временный файл
         try:
-            os.remove(downloaded_path)
-        except Exception as e:
-            logger.error(f"Ошибка при удалении временного файла: {e}")
+            text = await stt.speech_to_text(downloaded_path, language="ru")
+        finally:
+            # Удаляем временный файл даже если распознавание завершилось ошибкой
+            Path(downloaded_path).unlink(missing_ok=True)
         
         if not text:
             logger.error(f"Не удалось распознать речь: {file_id}")
@@ -154,11 +152,10 @@ async def process_telegram_voice(
                     tts = get_tts_engine()
                     audio_path = await tts.text_to_speech(response, language="ru")
                     if audio_path:
-                        await send_telegram_audio(chat_id, audio_path, caption="🔊 Голосовой ответ")
                         try:
-                            os.remove(audio_path)
-                        except Exception:
-                            pass
+                            await send_telegram_audio(chat_id, audio_path, caption="🔊 Голосовой ответ")
+                        finally:
+                            Path(audio_path).unlink(missing_ok=True)
                 except Exception as e:
                     logger.warning(f"[VOICE] Не удалось озвучить ответ через gTTS: {e}")
             else:
@@ -15,6 +15,24 @@ logger = logging.getLogger("bot.feedback_bot")
 TOKENS_PER_CHAR = 0.25
 MAX_KNOWLEDGE_TOKENS = 8000  # Используем первые 8000 токенов базы знаний
 
+# Ключевые слова для определения режима
+MODE_KEYWORDS = {
+    "анализ": ("анализ", "ситуация", "помоги", "как дать", "нужно дать"),
+    "коучинг": ("подготовь", "подготовка", "скоро", "через", "минут", "сейчас"),
+    "развитие": ("научи", "обучение", "навык", "развить", "улучшить"),
+    "q&a": ("что такое", "когда", "какая разница", "чем отличается", "?"),
+    "культура": ("культура", "команда", "организация", "внедрить", "построить")
+}
+
+# Описание режимов, добавляемое к системному промпту
+MODE_DESCRIPTIONS = {
+    "анализ": "РЕЖИМ: АНАЛИЗ СИТУАЦИИ - Помоги пользователю проанализировать ситуацию с обратной связью, задай уточняющие вопросы, предложи модель и конкретные фразы.",
+    "коучинг": "РЕЖИМ: КОУЧИНГ В РЕАЛЬНОМ ВРЕМЕНИ - Пользователь готовится к разговору. Дай краткие, практичные советы для подготовки.",
+    "развитие": "РЕЖИМ: РАЗВИТИЕ НАВЫКОВ - Помоги пользователю развить навыки обратной связи через обучение моделям и практику.",
+    "q&a": "РЕЖИМ: ВОПРОС И ОТВЕТ - Ответь на прямой вопрос четко и кратко с практичными примерами.",
+    "культура": "РЕЖИМ: ПОСТРОЕНИЕ КУЛЬТУРЫ - Помоги построить культуру обратной связи в организации/команде."
+}
+
 
 class FeedbackBotHandler:
     """Обработчик для LiraAI MultiAssistent - эксперта по обратной связи"""
@@ -97,18 +115,9 @@ class FeedbackBotHandler:
         """Определяет режим работы бота по контексту сообщения"""
         message_lower = user_message.lower()
         
-        # Ключевые слова для определения режима
-        mode_keywords = {
-            "анализ": ["анализ", "ситуация", "помоги", "как дать", "нужно дать"],
-            "коучинг": ["подготовь", "подготовка", "скоро", "через", "минут", "сейчас"],
-            "развитие": ["научи", "обучение", "навык", "развить", "улучшить"],
-            "q&a": ["что такое", "когда", "какая разница", "чем отличается", "?"],
-            "культура": ["культура", "команда", "организация", "внедрить", "построить"]
-        }
-        
         # Подсчитываем совпадения
         scores = {}
-        for mode, keywords in mode_keywords.items():
+        for mode, keywords in MODE_KEYWORDS.items():
             score = sum(1 for kw in keywords if kw in message_lower)
             if score > 0:
                 scores[mode] = score
@@ -131,16 +140,9 @@ class FeedbackBotHandler:
             # Ограничиваем размер базы знаний в промпте, чтобы не превысить лимиты
         
         # Добавляем информацию о режиме
-        mode_descriptions = {
-            "анализ": "РЕЖИМ: АНАЛИЗ СИТУАЦИИ - Помоги пользователю проанализировать ситуацию с обратной связью, задай уточняющие вопросы, предложи модель и конкретные фразы.",
-            "коучинг": "РЕЖИМ: КОУЧИНГ В РЕАЛЬНОМ ВРЕМЕНИ - Пользователь готовится к разговору. Дай краткие, практичные советы для подготовки.",
-            "развитие": "РЕЖИМ: РАЗВИТИЕ НАВЫКОВ - Помоги пользователю развить навыки обратной связи через обучение моделям и практику.",
-            "q&a": "РЕЖИМ: ВОПРОС И ОТВЕТ - Ответь на прямой вопрос четко и кратко с практичными примерами.",
-            "культура": "РЕЖИМ: ПОСТРОЕНИЕ КУЛЬТУРЫ - Помоги построить культуру обратной связи в организации/команде."
-        }
-        
-        if mode in mode_descriptions:
-            full_prompt += f"\n\n{mode_descriptions[mode]}"
+        mode_description = MODE_DESCRIPTIONS.get(mode)
+        if mode_description:
+            full_prompt += f"\n\n{mode_description}"
         
         return full_prompt
     
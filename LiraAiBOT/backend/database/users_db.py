@@ -6,6 +6,9 @@ import os
 import sqlite3
 import logging
 import json
+import asyncio
+import contextvars
+import functools
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List
 from pathlib import Path
@@ -47,6 +50,9 @@ if USE_SUPABASE and SUPABASE_URL and SUPABASE_KEY:
 if not USE_SUPABASE:
     logger.info("ℹ️ Используем SQLite базу данных")
 
+# Размер страницы для постраничного чтения из Supabase (PostgREST по умолчанию отдаёт не больше 1000 строк)
+SUPABASE_PAGE_SIZE = 1000
+
 
 # ============================================
 # Функции управления кэшем
@@ -89,6 +95,7 @@ def invalidate_user_cache(user_id: str = None):
     """Инвалидирует кэш пользователя"""
     _invalidate_cache(_user_cache, _user_cache_timestamps, user_id)
     _invalidate_cache(_limits_cache, _limits_cache_timestamps, user_id)
+    _invalidate_cache(_seen_users, _seen_users_timestamps, user_id)
     logger.info(f"🗑️ Кэш {'пользователя ' + user_id if user_id else 'полностью'} очищен")
 
 
@@ -99,10 +106,25 @@ _user_cache: Dict[str, Dict] = {}
 _user_cache_timestamps: Dict[str, float] = {}
 _limits_cache: Dict[str, Dict] = {}
 _limits_cache_timestamps: Dict[str, float] = {}
+# Последние записанные в БД данные пользователя: user_id -> (username, first_name, last_name)
+_seen_users: Dict[str, tuple] = {}
+_seen_users_timestamps: Dict[str, float] = {}
 
 # TTL для кэша (5 минут)
 CACHE_TTL = 300  # секунд
 
+
+def _merge_seen_profile(user_id: str, profile: tuple) -> Optional[tuple]:
+    """
+    Сравнивает профиль с последним записанным в БД (поля None - "не передано" и не сравниваются).
+    Возвращает None, если записывать нечего, иначе профиль, дополненный известными полями.
+    """
+    cached = _get_from_cache(_seen_users, _seen_users_timestamps, user_id)
+    if cached is None:
+        return profile
+    merged = tuple(old if new is None else new for new, old in zip(profile, cached))
+    return None if merged == cached else merged
+
 # Кэш настроек бота (тех.режим и т.д.)
 _bot_settings_cache: Dict[str, Any] = {
     "maintenance_enabled": False,
@@ -203,6 +225,11 @@ class BotDatabase:
         conn.close()
         logger.info("✅ Таблицы базы данных созданы")
 
+    def is_user_profile_fresh(self, user_id: str, username: str = None,
+                              first_name: str = None, last_name: str = None) -> bool:
+        """Проверяет, записывались ли эти же данные пользователя в пределах CACHE_TTL"""
+        return _merge_seen_profile(user_id, (username, first_name, last_name)) is None
+
     def add_or_update_user(self, user_id: str, username: str = None,
                           first_name: str = None, last_name: str = None):
         """Добавляет или обновляет пользователя (только Supabase + кэш)"""
@@ -223,6 +250,11 @@ class BotDatabase:
                 _user_cache[user_id]["first_name"] = first_name
             if last_name:
                 _user_cache[user_id]["last_name"] = last_name
+
+        # Те же данные уже записывали в пределах CACHE_TTL - не ходим в БД на каждое сообщение
+        profile = _merge_seen_profile(user_id, (username, first_name, last_name))
+        if profile is None:
+            return
         
         # Если используем Supabase - отправляем данные
         if USE_SUPABASE and supabase:
@@ -261,6 +293,8 @@ class BotDatabase:
                         "total_count": 0
                     }).execute()
 
+                # Запоминаем профиль только после успешной записи, чтобы при сбое повторить её
+                _save_to_cache(_seen_users, _seen_users_timestamps, user_id, profile)
             except Exception as e:
                 # Логируем ошибку но не падаем - кэш работает
                 logger.warning(f"⚠️ Supabase недоступен, работаем в памяти: {e}")
@@ -284,6 +318,7 @@ class BotDatabase:
                 cursor.execute("INSERT INTO generation_limits (user_id, daily_count, last_reset, total_count) VALUES (?, 0, CURRENT_DATE, 0)", (user_id,))
             conn.commit()
             conn.close()
+            _save_to_cache(_seen_users, _seen_users_timestamps, user_id, profile)
 
     def get_user_access_level(self, user_id: str) -> str:
         """Получает уровень доступа пользователя (сначала кэш)"""
@@ -1192,6 +1227,77 @@ class BotDatabase:
         conn.close()
         return count
 
+    def get_stats_summary(self) -> Dict[str, Any]:
+        """
+        Сводка для /admin stats без выгрузки всех пользователей:
+        {"total_users": int, "levels": {уровень: количество}, "total_gens": int}
+        """
+        if USE_SUPABASE and supabase:
+            # Основной путь: один запрос к SQL-функции get_stats_summary (supabase_stats_migration.sql)
+            try:
+                rpc_result = supabase.rpc("get_stats_summary").execute()
+                rows = rpc_result.data or []
+                levels = {row["access_level"]: row["users_count"] or 0 for row in rows}
+                return {
+                    "total_users": sum(levels.values()),
+                    "levels": levels,
+                    "total_gens": sum(row["total_gens"] or 0 for row in rows)
+                }
+            except Exception as e:
+                logger.warning(f"⚠️ RPC get_stats_summary недоступна, считаю по частям: {e}")
+
+            # Запасной путь без миграции: 1 + len(ACCESS_LEVELS) + ceil(N / SUPABASE_PAGE_SIZE) запросов.
+            # PostgREST не умеет GROUP BY без RPC, а обычный select обрезается по max-rows,
+            # поэтому количества берём через count="exact", не выгружая строки
+            try:
+                levels: Dict[str, int] = {}
+                for level in ACCESS_LEVELS:
+                    level_result = supabase.table("users").select("user_id", count="exact").eq("access_level", level).limit(1).execute()
+                    levels[level] = level_result.count or 0
+
+                # Сумму генераций собираем постранично, читая только одну колонку;
+                # без order() Postgres не гарантирует порядок строк между запросами
+                total_gens = 0
+                offset = 0
+                while True:
+                    limits_result = supabase.table("generation_limits").select("total_count").order("user_id").range(
+                        offset, offset + SUPABASE_PAGE_SIZE - 1
+                    ).execute()
+                    rows = limits_result.data or []
+                    total_gens += sum(row.get("total_count") or 0 for row in rows)
+                    if len(rows) < SUPABASE_PAGE_SIZE:
+                        break
+                    offset += SUPABASE_PAGE_SIZE
+
+                return {
+                    "total_users": self.get_all_users_count(),
+                    "levels": levels,
+                    "total_gens": total_gens
+                }
+            except Exception as e:
+                logger.error(f"❌ Ошибка Supabase в get_stats_summary: {e}")
+
+        # SQLite версия: один агрегирующий запрос
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(u.access_level, 'user') as level,
+                   COUNT(*) as users_count,
+                   COALESCE(SUM(g.total_count), 0) as gens
+            FROM users u
+            LEFT JOIN generation_limits g ON u.user_id = g.user_id
+            GROUP BY level
+        """)
+        rows = cursor.fetchall()
+        conn.close()
+
+        levels = {row["level"]: row["users_count"] for row in rows}
+        return {
+            "total_users": sum(levels.values()),
+            "levels": levels,
+            "total_gens": sum(row["gens"] for row in rows)
+        }
+
     def get_all_users(self) -> list:
         """Получает всех пользователей"""
         if USE_SUPABASE and supabase:
@@ -2202,6 +2308,20 @@ def get_database() -> BotDatabase:
     return _db
 
 
+async def run_db(fn, *args, **kwargs):
+    """
+    Выполняет блокирующий вызов БД (SQLite/Supabase) в пуле потоков, не блокируя цикл событий.
+    Контекст (contextvars) переносится в поток, только если в нём что-то есть.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    if len(ctx):
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+    else:
+        call = functools.partial(fn, *args, **kwargs)
+    return await loop.run_in_executor(None, call)
+
+
 def generate_signature(user_id: str) -> str:
     """Генерирует HMAC-SHA256 подпись для user_id"""
     import hmac
@@ -156,6 +156,19 @@ async def startup_event():
     """Инициализация при запуске"""
     logger.info("🚀 Запуск LiraAI MultiAssistent v1.0.0")
 
+    # uvicorn[standard] сам ставит uvloop (loop="auto"), здесь только проверяем, что он подхватился
+    loop = asyncio.get_running_loop()
+    loop_module = type(loop).__module__
+    if loop_module.startswith("uvloop"):
+        logger.info("✅ Цикл событий: uvloop")
+    else:
+        logger.info(f"ℹ️ Цикл событий: {loop_module}.{type(loop).__name__} (uvloop не найден)")
+
+    # Eager-задачи (Python 3.12+): корутина, завершившаяся без ожидания, не создаёт полноценную Task
+    if hasattr(asyncio, "eager_task_factory"):
+        loop.set_task_factory(asyncio.eager_task_factory)
+        logger.info("✅ Включена eager_task_factory")
+
     try:
         # Создаем необходимые директории
         os.makedirs("data", exist_ok=True)
@@ -202,6 +215,20 @@ async def startup_event():
 async def shutdown_event():
     """Очистка при завершении"""
     logger.info("🛑 Завершение работы бота...")
+
+    # Закрываем общие HTTP-сессии
+    try:
+        from backend.vision.hf_replicate import get_hf_replicate_client
+        await get_hf_replicate_client().close()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось закрыть HTTP-сессию Polza.ai: {e}")
+
+    try:
+        from backend.api.telegram_core import close_session
+        await close_session()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось закрыть HTTP-сессию Telegram: {e}")
+
     logger.info("✅ Бот завершил работу корректно")
 
 @app.get("/")
@@ -0,0 +1,48 @@
+"""
+Модуль для хранения временного состояния пользователей в памяти.
+Ограничивает размер хранилища (LRU) и время жизни записей (TTL).
+"""
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Iterator, Optional, Tuple
+
+
+class UserStateCache(MutableMapping):
+    """
+    Словарь user_id -> значение с вытеснением самых старых записей.
+
+    Ведёт себя как обычный dict (get, in, del, присваивание), но хранит не больше
+    maxsize записей, а при заданном ttl забывает записи, которые не обновлялись
+    дольше ttl секунд.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (время истечения или None, значение)
+        self._data: "OrderedDict[Any, Tuple[Optional[float], Any]]" = OrderedDict()
+
+    def __getitem__(self, key):
+        expires_at, value = self._data[key]
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            raise KeyError(key)
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -2,6 +2,7 @@
 Polza.ai API клиент для генерации изображений.
 Использует Z-Image через Polza.ai API
 """
+import base64
 import logging
 import os
 import asyncio
@@ -14,6 +15,9 @@ load_dotenv()
 
 logger = logging.getLogger("bot.vision")
 
+# Суффикс качества, который добавляется к промпту пользователя
+PROMPT_QUALITY_SUFFIX = ", high quality, detailed, artistic, 8k, masterpiece"
+
 
 class HFReplicateClient:
     """Клиент для работы с Polza.ai API (Z-Image)"""
@@ -22,6 +26,9 @@ class HFReplicateClient:
         # Используем POLZA_API_KEY из .env
         self.api_key = os.getenv("POLZA_API_KEY", "")
         self.base_url = "https://polza.ai/api/v1"
+
+        # Общая HTTP-сессия: TLS-соединения к Polza.ai переиспользуются между запросами
+        self._session: Optional[aiohttp.ClientSession] = None
         
         # Модели для генерации изображений с уровнями доступа
         self.models = {
@@ -38,6 +45,7 @@ class HFReplicateClient:
             "subscriber": ["polza-zimage"],
             "user": ["polza-zimage"],
         }
+        self._models_by_level_cache: Dict[str, Dict[str, Any]] = {}
 
         if self.api_key:
             logger.info("✅ Polza.ai клиент инициализирован (Z-Image)")
@@ -45,14 +53,51 @@ class HFReplicateClient:
         else:
             logger.warning("❌ POLZA_API_KEY не настроен")
 
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Лениво создает общую HTTP-сессию с пулом соединений."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Закрывает общую HTTP-сессию (вызывается при остановке приложения)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     def get_models_for_user(self, access_level: str) -> Dict[str, Any]:
         """
         Получает доступные модели для уровня доступа пользователя
         """
         level = access_level if access_level in self.models_by_level else "user"
-        model_keys = self.models_by_level[level]
 
-        return {k: v for k, v in self.models.items() if k in model_keys}
+        # Каталог моделей статичен, поэтому результат кэшируется по уровню доступа
+        cached = self._models_by_level_cache.get(level)
+        if cached is None:
+            model_keys = self.models_by_level[level]
+            cached = {k: v for k, v in self.models.items() if k in model_keys}
+            self._models_by_level_cache[level] = cached
+        return cached
+
+    def clear_models_cache(self):
+        """Сбрасывает кэш моделей по уровням (если каталог меняется во время работы)."""
+        self._models_by_level_cache.clear()
+
+    async def _download_image(self, session: aiohttp.ClientSession, img_url: str) -> Optional[bytes]:
+        """
+        Скачивает готовое изображение по URL целиком в память.
+        Вызывающему коду нужны bytes, поэтому тело читается одним read() без промежуточного буфера.
+        """
+        async with session.get(img_url) as img_response:
+            if img_response.status != 200:
+                logger.error(f"❌ Polza.ai не удалось скачать изображение: {img_response.status}")
+                return None
+
+            image_data = await img_response.read()
+
+        logger.info(f"✅ Polza.ai получено {len(image_data)} байт")
+        return image_data
 
     async def generate_image(
         self,
@@ -88,69 +133,65 @@ class HFReplicateClient:
         try:
             logger.info(f"🎨 Polza.ai запрос ({model_key}): {prompt[:50]}...")
 
-            async with aiohttp.ClientSession() as session:
-                # Используем /media endpoint из документации Polza.ai
-                create_url = f"{self.base_url}/media"
-                
-                # Формат запроса согласно документации Polza.ai
-                payload = {
-                    "model": model_info["model"],
-                    "input": {
-                        "prompt": prompt,
-                        "aspect_ratio": "1:1",
-                        "images": []  # Пустой массив для text-to-image
-                    }
+            session = await self._get_session()
+
+            # Используем /media endpoint из документации Polza.ai
+            create_url = f"{self.base_url}/media"
+            
+            # Формат запроса согласно документации Polza.ai
+            payload = {
+                "model": model_info["model"],
+                "input": {
+                    "prompt": prompt,
+                    "aspect_ratio": "1:1",
+                    "images": []  # Пустой массив для text-to-image
                 }
+            }
 
-                logger.debug(f"📤 Payload: {payload}")
+            logger.debug(f"📤 Payload: {payload}")
 
-                async with session.post(create_url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
-                    response_text = await response.text()
-                    logger.debug(f"📥 Response status: {response.status}, body: {response_text[:500]}")
-                    
-                    if response.status != 200:
-                        logger.error(f"❌ Polza.ai ошибка {response.status}: {response_text}")
-                        return None
+            async with session.post(create_url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response_text = await response.text()
+                logger.debug(f"📥 Response status: {response.status}, body: {response_text[:500]}")
+                
+                if response.status != 200:
+                    logger.error(f"❌ Polza.ai ошибка {response.status}: {response_text}")
+                    return None
 
-                    data = await response.json()
-                    logger.debug(f"📥 Parsed data: {data}")
+                data = await response.json()
+                logger.debug(f"📥 Parsed data: {data}")
+                
+                # Получаем изображение из ответа
+                # Polza.ai может вернуть по-разному
+                if "url" in data:
+                    img_url = data["url"]
+                    logger.info(f"✅ Polza.ai изображение готово: {img_url}")
+                    
+                    # Скачиваем изображение
+                    image_data = await self._download_image(session, img_url)
+                    if image_data:
+                        return image_data
+                
+                elif "data" in data and len(data["data"]) > 0:
+                    img_data = data["data"][0]
                     
-                    # Получаем изображение из ответа
-                    # Polza.ai может вернуть по-разному
-                    if "url" in data:
-                        img_url = data["url"]
+                    if "url" in img_data:
+                        img_url = img_data["url"]
                         logger.info(f"✅ Polza.ai изображение готово: {img_url}")
                         
                         # Скачиваем изображение
-                        async with session.get(img_url) as img_response:
-                            if img_response.status == 200:
-                                image_data = await img_response.read()
-                                logger.info(f"✅ Polza.ai получено {len(image_data)} байт")
-                                return image_data
-                    
-                    elif "data" in data and len(data["data"]) > 0:
-                        img_data = data["data"][0]
-                        
-                        if "url" in img_data:
-                            img_url = img_data["url"]
-                            logger.info(f"✅ Polza.ai изображение готово: {img_url}")
-                            
-                            # Скачиваем изображение
-                            async with session.get(img_url) as img_response:
-                                if img_response.status == 200:
-                                    image_data = await img_response.read()
-                                    logger.info(f"✅ Polza.ai получено {len(image_data)} байт")
-                                    return image_data
-                        
-                        elif "b64_json" in img_data:
-                            # Base64 изображение
-                            import base64
-                            image_data = base64.b64decode(img_data["b64_json"])
-                            logger.info(f"✅ Polza.ai получено {len(image_data)} байт (base64)")
+                        image_data = await self._download_image(session, img_url)
+                        if image_data:
                             return image_data
                     
-                    logger.error(f"❌ Polza.ai не вернул изображение: {data}")
-                    return None
+                    elif "b64_json" in img_data:
+                        # Base64 изображение
+                        image_data = base64.b64decode(img_data["b64_json"])
+                        logger.info(f"✅ Polza.ai получено {len(image_data)} байт (base64)")
+                        return image_data
+                
+                logger.error(f"❌ Polza.ai не вернул изображение: {data}")
+                return None
 
         except Exception as e:
             logger.error(f"❌ Ошибка Polza.ai: {e}", exc_info=True)
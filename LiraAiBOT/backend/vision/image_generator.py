@@ -6,7 +6,7 @@ import logging
 from typing import Optional
 
 from backend.config import Config
-from backend.vision.hf_replicate import get_hf_replicate_client
+from backend.vision.hf_replicate import get_hf_replicate_client, PROMPT_QUALITY_SUFFIX
 
 logger = logging.getLogger("bot.vision")
 
@@ -32,7 +32,7 @@ class ImageGenerator:
         width/height оставлены в сигнатуре для совместимости API.
         """
         model = model or "polza-zimage"
-        enhanced_prompt = f"{prompt}, high quality, detailed, artistic, 8k, masterpiece"
+        enhanced_prompt = prompt + PROMPT_QUALITY_SUFFIX
 
         if model.startswith("kie-"):
             if self.polza_client.api_key:
@@ -2,7 +2,7 @@
 Модуль для преобразования текста в речь через gTTS.
 """
 import logging
-import os
+import uuid
 from pathlib import Path
 from typing import Optional
 
@@ -31,7 +31,7 @@ class TextToSpeech:
         try:
             from gtts import gTTS
 
-            output_path = self.temp_dir / f"tts_{os.getpid()}.mp3"
+            output_path = self.temp_dir / f"tts_{uuid.uuid4().hex}.mp3"
             tts = gTTS(text=text, lang=language, slow=False)
             tts.save(str(output_path))
             return str(output_path)
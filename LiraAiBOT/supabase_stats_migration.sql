@@ -0,0 +1,25 @@
+-- ============================================
+-- LiraAI Bot - Агрегаты для /admin stats
+-- ============================================
+
+-- Количество пользователей и сумма генераций по уровням доступа одним запросом.
+-- Бот вызывает её через supabase.rpc("get_stats_summary"); без этой функции
+-- используется медленный запасной путь (отдельные запросы и постраничное чтение).
+CREATE OR REPLACE FUNCTION get_stats_summary()
+RETURNS TABLE (access_level TEXT, users_count BIGINT, total_gens BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(u.access_level, 'user') AS access_level,
+           COUNT(*) AS users_count,
+           COALESCE(SUM(g.total_count), 0) AS total_gens
+    FROM users u
+    LEFT JOIN generation_limits g ON g.user_id = u.user_id
+    GROUP BY COALESCE(u.access_level, 'user');
+$$;
+
+-- ============================================
+-- Инструкции:
+-- 1. Зайди в Supabase Dashboard -> SQL Editor
+-- 2. Вставь этот SQL и нажми "Run"
+-- 3. Проверь что функция get_stats_summary создана